@@ -21,7 +21,16 @@ class RoleAdmin(admin.ModelAdmin):
     It sets which fields are displayed and available.
     """
 
-    list_display = ["name", "thumbnail_size", "allow_original", "allow_expiring"]
+    list_display = [
+        "name",
+        "thumbnail_size",
+        "extra_thumbnail_sizes",
+        "jpeg_profile",
+        "max_upload_size",
+        "max_megapixels",
+        "allow_original",
+        "allow_expiring",
+    ]
 
 
 class CustomUserAdmin(UserAdmin):
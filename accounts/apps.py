@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "accounts"
+
+    def ready(self):
+        # Connect the signals invalidating the role policy cache.
+        from . import policy  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
@@ -5,10 +5,10 @@ import django.contrib.auth.validators
 from django.db import migrations, models
 import django.db.models.deletion
 import django.utils.timezone
-from accounts.models import Role
 
 
 def create_roles(apps, schema_editor):
+    Role = apps.get_model("accounts", "Role")
     basic_role = Role.objects.create(
         name="Basic", thumbnail_size=200, allow_original=False, allow_expiring=False
     )
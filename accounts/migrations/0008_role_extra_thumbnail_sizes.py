@@ -0,0 +1,42 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:44
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0007_alter_customuser_role"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="role",
+            name="extra_thumbnail_sizes",
+            field=models.CharField(
+                blank=True,
+                help_text="Comma separated heights of additional thumbnails, e.g. 100,800.",
+                max_length=100,
+                validators=[
+                    django.core.validators.RegexValidator(
+                        re.compile("^\\d+(?:,\\d+)*\\Z"),
+                        code="invalid",
+                        message="Enter only digits separated by commas.",
+                    )
+                ],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="customuser",
+            name="role",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="accounts.role",
+            ),
+        ),
+    ]
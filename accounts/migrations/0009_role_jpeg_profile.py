@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:01
+
+import accounts.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0008_role_extra_thumbnail_sizes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="role",
+            name="jpeg_profile",
+            field=models.CharField(
+                blank=True,
+                help_text="Name of the JPEG encoder profile in IMAGES_JPEG_PROFILES used for thumbnails. Empty uses the 'default' profile.",
+                max_length=50,
+                validators=[accounts.models.validate_jpeg_profile],
+            ),
+        ),
+    ]
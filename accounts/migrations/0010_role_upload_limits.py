@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0009_role_jpeg_profile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="role",
+            name="max_megapixels",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Maximum width x height of an uploaded image in megapixels. Empty uses IMAGES_MAX_MEGAPIXELS.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="role",
+            name="max_upload_size",
+            field=models.PositiveBigIntegerField(
+                blank=True,
+                help_text="Maximum size of an uploaded file in bytes. Empty uses IMAGES_MAX_UPLOAD_SIZE.",
+                null=True,
+            ),
+        ),
+    ]
@@ -8,10 +8,19 @@ The 'CustomUser' model extends Django's built in 'AbstractUser' model and adds a
 is a foreign key to Role model, by that users can be assigned to different permission levels in the
 app. If the role is not specified, default role is Basic.
 """
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_comma_separated_integer_list
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
 
+def validate_jpeg_profile(value):
+    """Check that a JPEG profile name is defined in IMAGES_JPEG_PROFILES."""
+    if value and value not in getattr(settings, "IMAGES_JPEG_PROFILES", {}):
+        raise ValidationError(f"Unknown JPEG profile '{value}'.")
+
+
 class Role(models.Model):
     """
     Representing a user role in app.
@@ -19,17 +28,50 @@ class Role(models.Model):
     thumbnail_size - just thumbnail size :)
     allow_original - permission to generate url with original photo.
     allow_expiring - permission to generate expiring url.
+    extra_thumbnail_sizes - comma separated heights of additional thumbnails.
+    jpeg_profile - encoder settings of the thumbnails from IMAGES_JPEG_PROFILES.
+    max_upload_size - maximum size of an uploaded file in bytes.
+    max_megapixels - maximum width x height of an uploaded image in megapixels.
     """
 
     name = models.CharField(max_length=20, unique=True)
     thumbnail_size = models.PositiveIntegerField(default=200)
     allow_original = models.BooleanField(default=False)
     allow_expiring = models.BooleanField(default=False)
+    extra_thumbnail_sizes = models.CharField(
+        max_length=100,
+        blank=True,
+        validators=[validate_comma_separated_integer_list],
+        help_text="Comma separated heights of additional thumbnails, e.g. 100,800.",
+    )
+    jpeg_profile = models.CharField(
+        max_length=50,
+        blank=True,
+        validators=[validate_jpeg_profile],
+        help_text="Name of the JPEG encoder profile in IMAGES_JPEG_PROFILES used for "
+        "thumbnails. Empty uses the 'default' profile.",
+    )
+    max_upload_size = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        help_text="Maximum size of an uploaded file in bytes. "
+        "Empty uses IMAGES_MAX_UPLOAD_SIZE.",
+    )
+    max_megapixels = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Maximum width x height of an uploaded image in megapixels. "
+        "Empty uses IMAGES_MAX_MEGAPIXELS.",
+    )
 
     def __str__(self):
         """Returning name of a role."""
         return str(self.name)
 
+    def get_extra_thumbnail_sizes(self):
+        """Returning list of additional thumbnail heights."""
+        return [int(size) for size in self.extra_thumbnail_sizes.split(",") if size]
+
 
 class CustomUser(AbstractUser):
     """
@@ -0,0 +1,113 @@
+"""
+Module with a per-process cache of the thumbnail policy of every role.
+
+The 'RolePolicy' class describes what users with a role may do: thumbnail heights
+generated on upload and flags for original and expiring links. Policies of all roles
+are loaded with one query on first use and kept in memory, so request handling needs
+no 'Role' queries. The cache is dropped by the 'post_save' / 'post_delete' signals of
+'Role' and, because other processes don't receive those signals, also after
+ROLE_POLICY_TTL seconds. A role missing from the cached policies, e.g. one just
+created by another process, makes them load again.
+
+This module contains functions:
+ - get_role_policy: Return the 'RolePolicy' of a role by its primary key.
+ - invalidate_role_policies: Drop the cached policies.
+"""
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Role
+
+# Built-in roles also get the thumbnail sizes of the listed roles.
+BUILTIN_THUMBNAIL_ROLES = {
+    "Basic": ["Basic"],
+    "Premium": ["Basic", "Premium"],
+    "Enterprise": ["Basic", "Premium"],
+}
+DEFAULT_TTL = 300
+
+_policies: Optional[Dict[int, "RolePolicy"]] = None
+_loaded_at = 0.0
+
+
+@dataclass(frozen=True)
+class RolePolicy:
+    """
+    Permissions of a role.
+    name - role name
+    thumbnail_sizes - heights of the thumbnails created on upload, ascending.
+    allow_original - permission to generate url with original photo.
+    allow_expiring - permission to generate expiring url.
+    jpeg_profile - name of the JPEG encoder profile of the thumbnails.
+    max_upload_size - maximum upload size in bytes, None for the site default.
+    max_megapixels - maximum upload megapixels, None for the site default.
+    """
+
+    name: str
+    thumbnail_sizes: Tuple[int, ...]
+    allow_original: bool
+    allow_expiring: bool
+    jpeg_profile: str = "default"
+    max_upload_size: Optional[int] = None
+    max_megapixels: Optional[int] = None
+
+
+def _build_policies() -> Dict[int, RolePolicy]:
+    """Load all roles with one query and build their policies."""
+    roles = list(Role.objects.all())
+    size_by_name = {role.name: role.thumbnail_size for role in roles}
+    policies = {}
+    for role in roles:
+        sizes = {
+            size_by_name[name]
+            for name in BUILTIN_THUMBNAIL_ROLES.get(role.name, [role.name])
+            if name in size_by_name
+        }
+        sizes.update(role.get_extra_thumbnail_sizes())
+        policies[role.pk] = RolePolicy(
+            name=role.name,
+            thumbnail_sizes=tuple(sorted(sizes)),
+            allow_original=role.allow_original,
+            allow_expiring=role.allow_expiring,
+            jpeg_profile=role.jpeg_profile or "default",
+            max_upload_size=role.max_upload_size,
+            max_megapixels=role.max_megapixels,
+        )
+    return policies
+
+
+def get_role_policy(role_id: Optional[int]) -> Optional[RolePolicy]:
+    """
+    Return the policy of a role.
+
+    Args:
+        role_id (int): Primary key of the role, e.g. 'user.role_id'.
+    Returns:
+        RolePolicy instance, or None if the role doesn't exist.
+    """
+    global _policies, _loaded_at  # pylint: disable=global-statement
+
+    if role_id is None:
+        return None
+    ttl = getattr(settings, "ROLE_POLICY_TTL", DEFAULT_TTL)
+    policies = _policies
+    expired = policies is None or time.monotonic() - _loaded_at > ttl
+    # A missing role may have been created by another process after the load.
+    if expired or role_id not in policies:
+        policies = _build_policies()
+        _policies, _loaded_at = policies, time.monotonic()
+    return policies.get(role_id)
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def invalidate_role_policies(**kwargs):
+    """Drop the cached policies, they are loaded again on next use."""
+    global _policies  # pylint: disable=global-statement
+
+    _policies = None
@@ -6,12 +6,15 @@ The tests cover creation of user with:
     - premium role
     - enterprise role
     - custom role
+and the cached role policies.
 
 To run the tests, use the 'python manage.py test accounts/' command.
 """
+from django.core.exceptions import ValidationError
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from accounts.models import Role
+from accounts.policy import get_role_policy, invalidate_role_policies
 
 
 class CustomUserTests(TestCase):
@@ -99,3 +102,73 @@ class CustomUserTests(TestCase):
         self.assertEqual(super_user.username, "superuser")
         self.assertTrue(super_user.is_active)
         self.assertTrue(super_user.is_superuser)
+
+
+class RolePolicyTests(TestCase):
+    """Test cases for the cached role policies."""
+
+    def setUp(self):
+        """Set up the test environment."""
+        invalidate_role_policies()
+        self.basic_role = Role.objects.get(name="Basic")
+        self.premium_role = Role.objects.get(name="Premium")
+
+    def tearDown(self):
+        """Drop policies cached from rolled back changes."""
+        invalidate_role_policies()
+
+    def test_builtin_policies(self):
+        """Test thumbnail sizes of built-in roles."""
+        self.assertEqual(get_role_policy(self.basic_role.pk).thumbnail_sizes, (200,))
+        premium_policy = get_role_policy(self.premium_role.pk)
+        self.assertEqual(premium_policy.thumbnail_sizes, (200, 400))
+        self.assertTrue(premium_policy.allow_original)
+        self.assertFalse(premium_policy.allow_expiring)
+
+    def test_custom_role_with_multiple_sizes(self):
+        """Test policy of custom role with additional thumbnail sizes."""
+        custom_role = Role.objects.create(
+            name="custom_role", thumbnail_size=300, extra_thumbnail_sizes="100,800"
+        )
+        self.assertEqual(
+            get_role_policy(custom_role.pk).thumbnail_sizes, (100, 300, 800)
+        )
+
+    def test_role_jpeg_profile(self):
+        """Test that the JPEG profile of a role is validated and in its policy."""
+        self.assertEqual(get_role_policy(self.basic_role.pk).jpeg_profile, "default")
+        custom_role = Role.objects.create(name="custom_role", jpeg_profile="high")
+        self.assertEqual(get_role_policy(custom_role.pk).jpeg_profile, "high")
+        custom_role.jpeg_profile = "missing"
+        with self.assertRaises(ValidationError):
+            custom_role.full_clean()
+
+    def test_policies_are_cached(self):
+        """Test that policies are loaded with one query and then cached."""
+        with self.assertNumQueries(1):
+            get_role_policy(self.basic_role.pk)
+        with self.assertNumQueries(0):
+            get_role_policy(self.basic_role.pk)
+            get_role_policy(self.premium_role.pk)
+
+    def test_cache_invalidated_on_role_change(self):
+        """Test that saving and deleting a role drops the cached policies."""
+        get_role_policy(self.basic_role.pk)
+        self.basic_role.thumbnail_size = 150
+        self.basic_role.save()
+        self.assertEqual(get_role_policy(self.basic_role.pk).thumbnail_sizes, (150,))
+        custom_role = Role.objects.create(name="custom_role")
+        self.assertIsNotNone(get_role_policy(custom_role.pk))
+        pk = custom_role.pk
+        custom_role.delete()
+        self.assertIsNone(get_role_policy(pk))
+
+    def test_role_created_by_other_process_found(self):
+        """Test that a role missing from the cached policies reloads them."""
+        get_role_policy(self.basic_role.pk)
+        # Created without the signal, like a role saved by another process.
+        custom_role = Role.objects.bulk_create([Role(name="custom_role")])[0]
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(get_role_policy(custom_role.pk))
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(get_role_policy(custom_role.pk))
@@ -134,4 +134,112 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL="accounts.CustomUser"
 
 MEDIA_URL = "/media/"
-MEDIA_ROOT = BASE_DIR / "media"
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / "media"
+# Uploads bigger than this are streamed to a temporary file instead of being kept
+# in memory; thumbnails are rendered from that file.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+# Serving of stored images by the preview views
+# Size of the chunks used when streaming files through Django.
+IMAGES_STREAM_CHUNK_SIZE = 64 * 1024
+# Set to "nginx" (X-Accel-Redirect) or "xsendfile" (X-Sendfile) to let the front
+# proxy send the file instead of Django.
+IMAGES_SENDFILE_BACKEND = None
+# Internal nginx location mapped to MEDIA_ROOT, used with the "nginx" backend.
+IMAGES_SENDFILE_URL = "/protected-media/"
+# Cache lifetime (seconds) of originals and thumbnails, which never change.
+IMAGES_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Background thumbnails
+# Queue thumbnails for 'manage.py process_thumbnail_jobs' instead of creating them
+# during the upload request, which then returns 202 Accepted.
+IMAGES_ASYNC_THUMBNAILS = False
+# Seconds a worker may hold a job before it is considered crashed.
+IMAGES_THUMBNAIL_JOB_LEASE = 300
+IMAGES_THUMBNAIL_JOB_MAX_ATTEMPTS = 3
+# Render thumbnails on a pool of this many workers; 0 or 1 renders them serially.
+IMAGES_THUMBNAIL_WORKERS = 0
+# "process" for a process pool, "thread" for a thread pool (Pillow releases the
+# GIL while decoding, resizing and encoding).
+IMAGES_THUMBNAIL_EXECUTOR = "process"
+
+# Seconds role policies are cached by each process (see accounts.policy).
+ROLE_POLICY_TTL = 300
+
+# Image listing pages; clients may ask for up to IMAGES_MAX_PAGE_SIZE images.
+IMAGES_PAGE_SIZE = 50
+IMAGES_MAX_PAGE_SIZE = 200
+
+# Expiring links
+# Create HMAC signed links (checked without database queries, not revocable)
+# instead of 'ExpiringImage' rows when the request doesn't say "revocable".
+IMAGES_SIGNED_EXPIRING_LINKS = False
+# Cache alias and timeout of the image ID -> stored file lookups, or None to look
+# them up in the database. The cache must be shared by all workers (e.g. Redis or
+# Memcached; a file-based cache on a single host), a LocMemCache is refused.
+IMAGES_RESOLVER_CACHE = None
+IMAGES_RESOLVER_TIMEOUT = 24 * 60 * 60
+
+# Cache of thumbnail bytes served by the preview view (see images.cache).
+# BACKEND: "local" for a per-process LRU limited to MAX_BYTES, "django" to share
+# thumbnails between workers through the Django cache ALIAS, or None to disable.
+# Deletes only reach the cache of the deleting process, so "local" entries expire
+# after TIMEOUT seconds.
+IMAGES_THUMBNAIL_CACHE = {
+    "BACKEND": "local",
+    "MAX_BYTES": 64 * 1024 * 1024,
+    "MAX_ENTRY_BYTES": 512 * 1024,
+    "TIMEOUT": 60,
+}
+
+# Route the preview endpoints to async views. Enable when running under an ASGI
+# server (see image_uploader/asgi.py); under WSGI the sync views are faster.
+IMAGES_ASYNC_PREVIEWS = False
+
+# Formats thumbnails are stored in besides JPEG ("webp", "avif"); the preview
+# sends one of them to clients whose Accept header asks for it. Formats the
+# installed Pillow can't encode are skipped.
+IMAGES_THUMBNAIL_FORMATS = ["webp"]
+
+# JPEG encoder settings of thumbnails, chosen per role with 'Role.jpeg_profile'.
+# Keys: quality, optimize (optimized Huffman tables), progressive, subsampling
+# ("4:4:4", "4:2:2" or "4:2:0") and strip_exif. Compare profiles with
+# 'manage.py benchmark_jpeg_profiles <image>'.
+IMAGES_JPEG_PROFILES = {
+    "default": {
+        "quality": 80,
+        "optimize": True,
+        "progressive": True,
+        "subsampling": "4:2:0",
+        "strip_exif": True,
+    },
+    "high": {
+        "quality": 90,
+        "optimize": True,
+        "progressive": True,
+        "subsampling": "4:4:4",
+        "strip_exif": True,
+    },
+}
+
+# Upload limits of roles that don't set their own 'max_upload_size' / 'max_megapixels'.
+IMAGES_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+IMAGES_MAX_MEGAPIXELS = 50
+
+# Chunked upload sessions ('/api/v1/uploads'). Chunks are read into memory, keep
+# IMAGES_UPLOAD_CHUNK_SIZE below DATA_UPLOAD_MAX_MEMORY_SIZE. Staging files are
+# written to IMAGES_UPLOAD_STAGING_DIR (default: the system temporary directory),
+# which must be shared by all workers of a host.
+IMAGES_UPLOAD_CHUNK_SIZE = 2 * 1024 * 1024
+IMAGES_UPLOAD_STAGING_DIR = None
+# Sessions without a new chunk for this many seconds expire; run
+# 'manage.py reap_upload_sessions' periodically to delete them and their files.
+IMAGES_UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# Maximum number of files of one '/api/v1/images/batch' request.
+IMAGES_MAX_BATCH_FILES = 100
+
+# Total JPEG bytes of the thumbnails rendered on request
+# ('/api/v1/images/<id>/thumbnails/<height>'); above it the least recently
+# requested ones are deleted. Thumbnails created at upload don't count.
+IMAGES_ON_DEMAND_THUMBNAILS_MAX_BYTES = 256 * 1024 * 1024
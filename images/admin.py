@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Image, Thumbnail, ExpiringImage
+from .models import Image, Thumbnail, ExpiringImage, ThumbnailJob
 
 # Register your models here.
 
 admin.site.register(Image)
 admin.site.register(Thumbnail)
 admin.site.register(ExpiringImage)
+admin.site.register(ThumbnailJob)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ImagesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "images"
+
+    def ready(self):
+        # Connect the signals invalidating the preview caches and releasing blobs.
+        # pylint: disable-next=import-outside-toplevel,unused-import
+        from . import blobs, cache, resolvers  # noqa: F401
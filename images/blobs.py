@@ -0,0 +1,103 @@
+"""
+Module with the content addressed storage of original images.
+
+Every distinct upload is stored once, named after its SHA-256 hash and the
+extension of its sniffed format (never the one of the client's file name, the
+previews send the MIME type of the extension), and recorded as a 'Blob'. Images
+uploaded with the same bytes point to the existing blob instead of storing
+another copy, and their thumbnails are copied from the images already using it
+(see 'create_thumbnails_batch'). 'Blob.ref_count' counts the images of a blob;
+the blob and its file are deleted with the last image.
+
+This module contains functions:
+ - blob_name: Return the storage name of a content hash.
+ - acquire_blob: Return the blob of an upload, storing the file only if its content is new.
+ - release_blob: Drop a reference to a blob, deleting it when it is no longer used.
+ - release_image_blob: Release the blob of a deleted image.
+"""
+from django.core.files.base import File
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Blob, Image
+
+# Extensions of the stored originals by image format.
+EXTENSIONS = {"jpeg": ".jpg", "png": ".png"}
+
+
+def blob_name(content_hash: str, extension: str = "") -> str:
+    """Return the storage name of a blob, e.g. 'blobs/ab/ab12...ef.jpg'."""
+    return f"blobs/{content_hash[:2]}/{content_hash}{extension.lower()}"
+
+
+def acquire_blob(
+    file, content_hash: str, byte_size: int, image_format: str = ""
+) -> Blob:
+    """
+    Return the blob with the given content and take a reference to it.
+
+    The file is only written to storage when no blob has the same hash. The
+    reference is taken with a single UPDATE, so concurrent uploads of the same
+    content never lose a count. The upload is only read, it stays usable as the
+    source of the thumbnails.
+
+    Args:
+        file: Uploaded file, already hashed by 'file_metadata'.
+        content_hash (str): SHA-256 of the file.
+        byte_size (int): Size of the file.
+        image_format (str): Format read from the file, e.g. "png"; it gives the
+            extension of the stored file.
+    Returns:
+        Blob instance; its 'file.name' is the storage name of the original.
+    """
+    while True:
+        if Blob.objects.filter(content_hash=content_hash).update(
+            ref_count=F("ref_count") + 1
+        ):
+            return Blob.objects.get(content_hash=content_hash)
+
+        storage = Blob._meta.get_field("file").storage
+        extension = EXTENSIONS.get(image_format, "")
+        file.seek(0)
+        # Wrapped so storages copy the upload instead of moving its temporary
+        # file, which is still read to render the thumbnails.
+        name = storage.save(
+            blob_name(content_hash, extension), File(file.file, name=file.name)
+        )
+        try:
+            with transaction.atomic():
+                return Blob.objects.create(
+                    content_hash=content_hash,
+                    file=name,
+                    byte_size=byte_size,
+                    ref_count=1,
+                )
+        except IntegrityError:
+            # Another upload of the same content created the blob first.
+            storage.delete(name)
+
+
+def release_blob(blob_id: int):
+    """
+    Drop a reference to a blob. When it was the last one the blob is deleted,
+    and its file once the transaction commits.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            Blob.objects.filter(pk=blob_id).update(ref_count=F("ref_count") - 1)
+            return
+        storage, name = blob.file.storage, blob.file.name
+        blob.delete()
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(post_delete, sender=Image)
+def release_image_blob(sender, instance, **kwargs):
+    """Release the blob of a deleted image, also when deleted with its owner."""
+    if instance.blob_id is not None:
+        release_blob(instance.blob_id)
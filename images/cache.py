@@ -0,0 +1,275 @@
+"""
+Module with the byte cache used to serve hot thumbnails from memory.
+
+Thumbnails never change once created, so the preview view can keep their bytes
+(with the headers needed to answer conditional requests) keyed by token and the
+negotiated format, and skip both the database and the file system on a hit.
+
+The 'LocalThumbnailCache' class is a per-process LRU cache limited by the total
+size of the cached thumbnails. A deleted thumbnail is only dropped from the cache
+of the process deleting it, so entries expire after a short timeout, which bounds
+how long other workers keep serving it. The 'DjangoThumbnailCache' class stores
+thumbnails in a Django cache backend, e.g. a file based cache shared by all
+workers on a node.
+Both refuse thumbnails bigger than the per-entry limit and count hits, misses and
+evictions.
+
+This module contains functions:
+ - get_thumbnail_cache: Return the cache configured in IMAGES_THUMBNAIL_CACHE.
+ - thumbnail_cache_key: Return the key of a thumbnail in a given format.
+ - invalidate_thumbnail: Drop a deleted thumbnail from the cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Thumbnail
+from .utils import PIL_FORMATS
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRY_BYTES = 512 * 1024
+# Seconds a thumbnail stays in the "local" cache.
+DEFAULT_LOCAL_TIMEOUT = 60
+
+_cache = None
+_cache_config = None
+
+
+class CachedFile(NamedTuple):
+    """Bytes of a thumbnail together with its response headers."""
+
+    content: bytes
+    content_type: str
+    etag: str
+    last_modified: Optional[int]
+
+
+class ThumbnailCache:
+    """
+    Base class of the thumbnail caches, keeping the monitoring counters.
+    Subclasses implement '_get', '_set' and '_delete'.
+    """
+
+    def __init__(self, max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES):
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    def get(self, key: str) -> Optional[CachedFile]:
+        """Return the cached thumbnail or None."""
+        entry = self._get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key: str, entry: CachedFile) -> bool:
+        """Cache a thumbnail. Returns False if it is too big to be cached."""
+        if len(entry.content) > self.max_entry_bytes:
+            self.rejected += 1
+            return False
+        self._set(key, entry)
+        return True
+
+    def delete(self, key: str):
+        """Drop a thumbnail from the cache."""
+        self._delete(key)
+
+    async def aget(self, key: str) -> Optional[CachedFile]:
+        """Async version of 'get', run in a worker thread."""
+        return await sync_to_async(self.get, thread_sensitive=False)(key)
+
+    def stats(self) -> dict:
+        """Return the counters of this cache."""
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejected": self.rejected,
+            "max_entry_bytes": self.max_entry_bytes,
+        }
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, entry):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+
+class LocalThumbnailCache(ThumbnailCache):
+    """
+    Per-process LRU cache holding at most 'max_bytes' of thumbnails, each for at
+    most 'timeout' seconds (None keeps them until evicted). The least recently
+    used thumbnails are evicted when a new one doesn't fit.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES,
+        timeout: Optional[float] = DEFAULT_LOCAL_TIMEOUT,
+    ):
+        super().__init__(min(max_entry_bytes, max_bytes))
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def aget(self, key):
+        # Only a dictionary lookup, no need for a thread.
+        return self.get(key)
+
+    def _get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                self.size -= len(entry.content)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, entry):
+        expires = None
+        if self.timeout is not None:
+            expires = time.monotonic() + self.timeout
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[1].content)
+            self._entries[key] = (expires, entry)
+            self.size += len(entry.content)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted.content)
+                self.evictions += 1
+
+    def _delete(self, key):
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is not None:
+                self.size -= len(item[1].content)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update(
+                entries=len(self._entries),
+                bytes=self.size,
+                max_bytes=self.max_bytes,
+                timeout=self.timeout,
+            )
+        return stats
+
+
+class DjangoThumbnailCache(ThumbnailCache):
+    """
+    Cache storing thumbnails in a Django cache backend. Eviction is done by the
+    backend (e.g. MAX_ENTRIES of the local-memory or file based cache), so the
+    'evictions' counter stays at 0.
+    """
+
+    def __init__(
+        self,
+        alias: str = "default",
+        timeout: Optional[int] = None,
+        max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES,
+    ):
+        super().__init__(max_entry_bytes)
+        self.alias = alias
+        self.timeout = timeout
+
+    @staticmethod
+    def _key(key):
+        return f"images:thumbnail-bytes:{key}"
+
+    def _get(self, key):
+        entry = caches[self.alias].get(self._key(key))
+        return CachedFile(*entry) if entry is not None else None
+
+    def _set(self, key, entry):
+        caches[self.alias].set(self._key(key), tuple(entry), self.timeout)
+
+    def _delete(self, key):
+        caches[self.alias].delete(self._key(key))
+
+    def stats(self):
+        stats = super().stats()
+        stats["alias"] = self.alias
+        return stats
+
+
+def get_thumbnail_cache() -> Optional[ThumbnailCache]:
+    """
+    Return the thumbnail cache configured in IMAGES_THUMBNAIL_CACHE, or None when
+    caching is disabled. The cache is created on first use and recreated when
+    the setting changes.
+
+    IMAGES_THUMBNAIL_CACHE keys:
+    BACKEND - "local" (per-process LRU), "django" (Django cache backend) or None.
+    MAX_BYTES - total size of the "local" cache.
+    MAX_ENTRY_BYTES - bigger thumbnails are not cached.
+    TIMEOUT - seconds a thumbnail is cached; DEFAULT_LOCAL_TIMEOUT for "local",
+        the timeout of the Django cache for "django".
+    ALIAS - Django cache alias of the "django" backend.
+    """
+    global _cache, _cache_config  # pylint: disable=global-statement
+
+    config = getattr(settings, "IMAGES_THUMBNAIL_CACHE", None) or {}
+    if config == _cache_config:
+        return _cache
+
+    backend = config.get("BACKEND")
+    max_entry_bytes = config.get("MAX_ENTRY_BYTES", DEFAULT_MAX_ENTRY_BYTES)
+    if backend is None:
+        cache = None
+    elif backend == "local":
+        cache = LocalThumbnailCache(
+            config.get("MAX_BYTES", DEFAULT_MAX_BYTES),
+            max_entry_bytes,
+            config.get("TIMEOUT", DEFAULT_LOCAL_TIMEOUT),
+        )
+    elif backend == "django":
+        cache = DjangoThumbnailCache(
+            config.get("ALIAS", "default"), config.get("TIMEOUT"), max_entry_bytes
+        )
+    else:
+        raise ImproperlyConfigured(
+            f"Unknown IMAGES_THUMBNAIL_CACHE backend '{backend}'. "
+            "Use 'local', 'django' or None."
+        )
+    _cache, _cache_config = cache, dict(config)
+    return cache
+
+
+def thumbnail_cache_key(token: str, image_format: str) -> str:
+    """Return the cache key of a thumbnail requested in the given format."""
+    return f"{token}.{image_format}"
+
+
+@receiver(post_delete, sender=Thumbnail)
+def invalidate_thumbnail(sender, instance, **kwargs):
+    """Drop a deleted thumbnail from the cache, in all formats."""
+    cache = get_thumbnail_cache()
+    if cache is not None:
+        for image_format in PIL_FORMATS:
+            cache.delete(thumbnail_cache_key(instance.token, image_format))
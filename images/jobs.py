@@ -0,0 +1,180 @@
+"""
+Module with a database backed queue for generating thumbnails in the background.
+This module contains functions:
+ - enqueue_thumbnails: Create a 'ThumbnailJob' for an 'Image'.
+ - claim_job: Lease the next available job to a worker.
+ - run_job: Generate the missing thumbnails of a claimed job and record the result.
+ - thumbnail_status: Report readiness of every thumbnail size of an 'Image'.
+
+Jobs are leased for IMAGES_THUMBNAIL_JOB_LEASE seconds. A job whose lease ran out
+is treated as abandoned (e.g. the worker crashed) and is claimed again, up to
+IMAGES_THUMBNAIL_JOB_MAX_ATTEMPTS times. Generating thumbnails is idempotent:
+sizes that already exist are skipped when a job is retried, checked under a row
+lock of the image so a worker that claimed the job again waits for the previous
+one. A worker whose lease ran out doesn't record its result: the job belongs to
+the worker that claimed it last.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from accounts.policy import get_role_policy
+from .models import Image, ThumbnailJob
+from .utils import create_thumbnails
+
+DEFAULT_LEASE = 300
+DEFAULT_MAX_ATTEMPTS = 3
+# Delay before a failed job is retried, multiplied by the number of attempts.
+RETRY_DELAY = 30
+
+
+def enqueue_thumbnails(image: Image, thumbnail_sizes: List[int]) -> ThumbnailJob:
+    """
+    Queue generation of the given thumbnail sizes for an Image.
+
+    Args:
+        image (Image): Image instance to create the thumbnails from.
+        thumbnail_sizes (list): Heights of the thumbnails.
+    Returns:
+        ThumbnailJob instance.
+    """
+    return ThumbnailJob.objects.create(
+        image=image, sizes=list(dict.fromkeys(thumbnail_sizes))
+    )
+
+
+def claim_job(worker: str, lease: Optional[int] = None) -> Optional[ThumbnailJob]:
+    """
+    Lease the oldest available job to a worker.
+
+    A job is available when it is pending, or running with an expired lease.
+    Rows are locked with SKIP LOCKED, so several workers can claim jobs at
+    the same time without waiting on each other.
+
+    Args:
+        worker (str): Name of the worker, stored on the job for debugging.
+        lease (int): Lease length in seconds.
+    Returns:
+        The claimed ThumbnailJob, or None if the queue is empty.
+    """
+    if lease is None:
+        lease = getattr(settings, "IMAGES_THUMBNAIL_JOB_LEASE", DEFAULT_LEASE)
+    max_attempts = getattr(
+        settings, "IMAGES_THUMBNAIL_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS
+    )
+    now = datetime.now()
+    available = Q(lease_expires__isnull=True) | Q(lease_expires__lt=now)
+    while True:
+        with transaction.atomic():
+            job = (
+                ThumbnailJob.objects.select_for_update(skip_locked=True)
+                .filter(
+                    available, status__in=[ThumbnailJob.PENDING, ThumbnailJob.RUNNING]
+                )
+                .order_by("created", "pk")
+                .first()
+            )
+            if job is None:
+                return None
+            if job.attempts >= max_attempts:
+                # The last worker holding the job never reported back.
+                job.status = ThumbnailJob.FAILED
+                job.last_error = job.last_error or "Lease expired too many times."
+                job.save(update_fields=["status", "last_error"])
+                continue
+            job.status = ThumbnailJob.RUNNING
+            job.attempts += 1
+            job.worker = worker
+            job.lease_expires = now + timedelta(seconds=lease)
+            job.save(update_fields=["status", "attempts", "worker", "lease_expires"])
+            return job
+
+
+def _record(job: ThumbnailJob, **fields) -> bool:
+    """
+    Save the result of a job while the claim of 'job' still holds it: the job is
+    running, wasn't claimed again ('attempts' counts the claims) and its lease
+    hasn't run out. Returns False, with 'job' reloaded, if it doesn't.
+    """
+    held = ThumbnailJob.objects.filter(
+        pk=job.pk,
+        status=ThumbnailJob.RUNNING,
+        attempts=job.attempts,
+        worker=job.worker,
+        lease_expires__gt=datetime.now(),
+    ).update(**fields)
+    if not held:
+        job.refresh_from_db()
+        return False
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return True
+
+
+def run_job(job: ThumbnailJob) -> bool:
+    """
+    Generate the thumbnails of a claimed job that don't exist yet.
+
+    On failure the job goes back to the queue with a delay, or is marked as failed
+    once it used all of its attempts. Nothing is recorded when the lease ran out
+    before the job finished.
+
+    Args:
+        job (ThumbnailJob): Job returned by 'claim_job'.
+    Returns:
+        True if the job is done, False if it failed or the lease was lost.
+    """
+    max_attempts = getattr(
+        settings, "IMAGES_THUMBNAIL_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS
+    )
+    try:
+        with transaction.atomic():
+            # A previous holder of the job still rendering is waited for here.
+            image = Image.objects.select_for_update().get(pk=job.image_id)
+            existing = set(image.thumbnails.values_list("height", flat=True))
+            missing = [size for size in job.sizes if size not in existing]
+            if missing:
+                policy = get_role_policy(image.owner.role_id)
+                profile = policy.jpeg_profile if policy else "default"
+                create_thumbnails(image, missing, profile)
+    except Exception as error:  # pylint: disable=broad-except
+        if job.attempts >= max_attempts:
+            status, retry_at = ThumbnailJob.FAILED, None
+        else:
+            status = ThumbnailJob.PENDING
+            retry_at = datetime.now() + timedelta(seconds=RETRY_DELAY * job.attempts)
+        _record(
+            job,
+            status=status,
+            last_error=f"{type(error).__name__}: {error}",
+            lease_expires=retry_at,
+        )
+        return False
+
+    return _record(job, status=ThumbnailJob.DONE, lease_expires=None)
+
+
+def thumbnail_status(image: Image) -> Dict[str, str]:
+    """
+    Report readiness of every thumbnail size of an Image.
+    Uses 'thumbnails' and 'thumbnail_jobs' prefetched on the image if available.
+
+    Args:
+        image (Image): Image instance.
+    Returns:
+        Dict like {"200px": "ready", "400px": "pending"}. A size is "ready" when its
+        thumbnail exists, otherwise it has the state of the job generating it
+        ("pending" or "failed").
+    """
+    status = {}
+    for job in sorted(image.thumbnail_jobs.all(), key=lambda job: job.pk):
+        for size in job.sizes:
+            status[f"{size}px"] = (
+                "failed" if job.status == ThumbnailJob.FAILED else "pending"
+            )
+    for thumbnail in image.thumbnails.all():
+        status[f"{thumbnail.height}px"] = "ready"
+    return status
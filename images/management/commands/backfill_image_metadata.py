@@ -0,0 +1,156 @@
+"""
+Management command filling the metadata fields of images and thumbnails that were
+uploaded before the fields existed.
+
+Rows are read in primary key order in batches; the stored files of a batch are
+read by a pool of worker processes and the results are saved with one
+'bulk_update' per batch. Rows whose file is missing are skipped, so the command
+can be interrupted and run again at any time.
+
+Usage:
+    python manage.py backfill_image_metadata
+    python manage.py backfill_image_metadata --workers 8 --batch-size 1000
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from images.models import Image, Thumbnail
+from images.utils import file_metadata
+
+# Model field -> 'file_metadata' key filled by the command.
+IMAGE_FIELDS = {
+    "width": "width",
+    "height": "height",
+    "byte_size": "byte_size",
+    "format": "format",
+    "content_hash": "content_hash",
+}
+THUMBNAIL_FIELDS = {
+    "width": "width",
+    "rendered_height": "height",
+    "byte_size": "byte_size",
+    "content_hash": "content_hash",
+}
+
+
+def read_metadata(model, field_name: str, name: str) -> Optional[dict]:
+    """
+    Read the metadata of a stored file. Runs in the worker processes.
+    Returns None if the file can't be read.
+    """
+    storage = model._meta.get_field(field_name).storage
+    try:
+        with storage.open(name, "rb") as file:
+            return file_metadata(file)
+    except OSError:
+        return None
+
+
+def backfill(
+    model, field_name: str, fields: dict, pending: Q, batch_size: int, executor
+):
+    """
+    Fill 'fields' of all rows of 'model' matching 'pending'.
+
+    Args:
+        model: Image or Thumbnail.
+        field_name (str): Name of the file field.
+        fields (dict): Metadata fields to save, mapped to 'file_metadata' keys.
+        pending (Q): Rows whose metadata is missing.
+        batch_size (int): Rows read and updated at a time.
+        executor: Process pool reading the files, or None to read them serially.
+    Returns:
+        Tuple with the number of updated rows and of rows with unreadable files.
+    """
+    updated = skipped = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            model.objects.filter(pending, pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", field_name)[:batch_size]
+        )
+        if not batch:
+            return updated, skipped
+        last_pk = batch[-1].pk
+
+        names = [getattr(row, field_name).name for row in batch]
+        if executor is None:
+            results = [read_metadata(model, field_name, name) for name in names]
+        else:
+            results = executor.map(
+                read_metadata,
+                [model] * len(names),
+                [field_name] * len(names),
+                names,
+                chunksize=16,
+            )
+
+        rows = []
+        for row, metadata in zip(batch, results):
+            if metadata is None:
+                skipped += 1
+                continue
+            for field, key in fields.items():
+                setattr(row, field, metadata[key])
+            rows.append(row)
+        model.objects.bulk_update(rows, list(fields))
+        updated += len(rows)
+
+
+class Command(BaseCommand):
+    help = "Fill dimensions, format, byte size and hash of existing images."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes reading the files (default: number of CPUs).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows read and updated at a time (default: 500).",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        executor = None
+        if options["workers"] > 1:
+            # Database connections must not be shared with the forked processes.
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=options["workers"])
+        try:
+            images, skipped_images = backfill(
+                Image,
+                "image_file",
+                IMAGE_FIELDS,
+                Q(content_hash=""),
+                options["batch_size"],
+                executor,
+            )
+            thumbnails, skipped_thumbnails = backfill(
+                Thumbnail,
+                "thumbnail_file",
+                THUMBNAIL_FIELDS,
+                Q(content_hash="") | Q(rendered_height__isnull=True),
+                options["batch_size"],
+                executor,
+            )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Backfilled {images} images and {thumbnails} thumbnails "
+            f"({skipped_images + skipped_thumbnails} unreadable files skipped) "
+            f"in {elapsed:.2f}s."
+        )
@@ -0,0 +1,82 @@
+"""
+Management command reporting the size and encode time of JPEG thumbnails for
+every profile in IMAGES_JPEG_PROFILES, to pick the size/CPU trade-off.
+
+The image is decoded and scaled once per thumbnail height, so only encoding is
+timed.
+
+Usage:
+    python manage.py benchmark_jpeg_profiles photo.jpg
+    python manage.py benchmark_jpeg_profiles photo.jpg --sizes 200,400 --repeat 20
+"""
+import io
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from images.utils import downscale, jpeg_profile, save_options
+
+
+class Command(BaseCommand):
+    help = "Report bytes and encode time of JPEG thumbnails per encoder profile."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Image file to create thumbnails from.")
+        parser.add_argument(
+            "--sizes",
+            default="200,400",
+            help="Comma separated thumbnail heights (default: 200,400).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=10,
+            help="Encodes per profile and height, the mean is reported (default: 10).",
+        )
+        parser.add_argument(
+            "--profile",
+            action="append",
+            dest="profiles",
+            help="Profile to benchmark, may be repeated (default: all profiles).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(
+                {int(size) for size in options["sizes"].split(",")}, reverse=True
+            )
+        except ValueError as error:
+            raise CommandError("--sizes must be comma separated integers.") from error
+        names = options["profiles"] or list(
+            getattr(settings, "IMAGES_JPEG_PROFILES", {}) or ["default"]
+        )
+        profiles = {name: jpeg_profile(name) for name in names}
+
+        try:
+            with PILImage.open(options["path"]) as img:
+                current = ImageOps.exif_transpose(img).convert("RGB")
+        except OSError as error:
+            raise CommandError(f"Can't open image: {error}") from error
+        original_size = current.size
+        exif = current.info.get("exif")
+        thumbnails = {}
+        for size in sizes:
+            current = downscale(current, original_size, size)
+            thumbnails[size] = current
+
+        self.stdout.write(f"{'profile':<12} {'height':>6} {'bytes':>9} {'ms':>8}")
+        for name, profile in profiles.items():
+            encoder_options = save_options("jpeg", profile, exif)
+            for size in sizes:
+                started = time.perf_counter()
+                for _ in range(options["repeat"]):
+                    output = io.BytesIO()
+                    thumbnails[size].save(output, format="JPEG", **encoder_options)
+                elapsed = (time.perf_counter() - started) / options["repeat"]
+                self.stdout.write(
+                    f"{name:<12} {size:>6} {len(output.getvalue()):>9} "
+                    f"{elapsed * 1000:>8.2f}"
+                )
@@ -0,0 +1,176 @@
+"""
+Management command comparing how many slow preview downloads the sync (WSGI)
+and async (ASGI) preview views can serve at the same time.
+
+Every download does what 'image_preview_view' and 'async_image_preview_view'
+do, with the mode, chunk size and streaming passed explicitly instead of read
+from the settings. The WSGI model resolves the token and serves the file
+synchronously on a fixed pool of threads, like a threaded WSGI worker: every
+download holds a thread until the client has read the last chunk. The ASGI model
+resolves and serves it asynchronously on one event loop, where a waiting client
+holds no thread. The file is always streamed by Django, never offloaded to a
+proxy. Clients sleep DELAY seconds after every chunk to simulate slow networks.
+
+Usage:
+    python manage.py benchmark_previews <image token>
+    python manage.py benchmark_previews <image token> --clients 500 --threads 16
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncRequestFactory, RequestFactory
+
+from images.models import Image
+from images.resolvers import aresolve_image_token, resolve_image_token
+from images.serving import aserve_file, guess_content_type, serve_file
+
+
+class _ThreadCounter:
+    """Samples the number of live threads while a benchmark runs."""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def benchmark_wsgi(
+    token: str, clients: int, threads: int, delay: float, chunk_size: int
+):
+    """
+    Serve 'clients' synchronous downloads on a pool of 'threads' threads.
+    Returns (seconds, bytes sent, peak thread count).
+    """
+    factory = RequestFactory()
+
+    def download():
+        image = resolve_image_token(token)
+        response = serve_file(
+            factory.get("/"),
+            image.image_file,
+            content_type=guess_content_type(image.image_file),
+            last_modified=image.upload_date,
+            allow_ranges=True,
+            chunk_size=chunk_size,
+            offload=False,
+        )
+        sent = 0
+        for chunk in response:
+            sent += len(chunk)
+            time.sleep(delay)
+        response.close()
+        return sent
+
+    with _ThreadCounter() as counter:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            sent = sum(executor.map(lambda _: download(), range(clients)))
+        elapsed = time.monotonic() - started
+    return elapsed, sent, counter.peak
+
+
+def benchmark_asgi(token: str, clients: int, delay: float, chunk_size: int):
+    """
+    Serve 'clients' asynchronous downloads on a single event loop.
+    Returns (seconds, bytes sent, peak thread count).
+    """
+    factory = AsyncRequestFactory()
+
+    async def download():
+        image = await aresolve_image_token(token)
+        response = await aserve_file(
+            factory.get("/"),
+            image.image_file,
+            content_type=guess_content_type(image.image_file),
+            last_modified=image.upload_date,
+            allow_ranges=True,
+            chunk_size=chunk_size,
+            offload=False,
+        )
+        sent = 0
+        async for chunk in response:
+            sent += len(chunk)
+            await asyncio.sleep(delay)
+        return sent
+
+    async def run():
+        return sum(await asyncio.gather(*(download() for _ in range(clients))))
+
+    with _ThreadCounter() as counter:
+        started = time.monotonic()
+        sent = asyncio.run(run())
+        elapsed = time.monotonic() - started
+    return elapsed, sent, counter.peak
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent slow downloads served by the WSGI and ASGI previews."
+
+    def add_arguments(self, parser):
+        parser.add_argument("token", help="Token of the image to download.")
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=200,
+            help="Number of concurrent downloads (default: 200).",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="Threads of the simulated WSGI worker (default: 8).",
+        )
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0.01,
+            help="Seconds a client waits after every chunk (default: 0.01).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=8 * 1024,
+            help="Bytes read at a time by the downloads (default: 8192).",
+        )
+
+    def handle(self, *args, **options):
+        token = options["token"]
+        if not Image.objects.filter(token=token).exists():
+            raise CommandError(f"There is no image with token '{token}'.")
+
+        clients = options["clients"]
+        results = {
+            "WSGI": benchmark_wsgi(
+                token,
+                clients,
+                options["threads"],
+                options["delay"],
+                options["chunk_size"],
+            ),
+            "ASGI": benchmark_asgi(
+                token, clients, options["delay"], options["chunk_size"]
+            ),
+        }
+
+        for name, (elapsed, sent, peak_threads) in results.items():
+            self.stdout.write(
+                f"{name}: {clients} downloads in {elapsed:.2f}s "
+                f"({clients / elapsed:.1f} downloads/s, "
+                f"{sent / elapsed / 1024 / 1024:.1f} MiB/s, "
+                f"peak {peak_threads} threads)."
+            )
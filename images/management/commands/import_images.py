@@ -0,0 +1,251 @@
+"""
+Management command importing the images of a local directory tree for a user.
+
+Files go through the same pipeline as uploads: header validation against the
+owner's role limits, content addressed storage and thumbnails. Files are
+validated and hashed by a pool of worker processes, which also renders the
+thumbnails before anything is stored, so a file that can't be decoded (e.g. with
+a truncated body) is rejected like an invalid one. The images of a batch are
+committed in one transaction with one insert, and their thumbnails are inserted
+once it has committed, so the blob rows are locked only for the inserts. If that
+fails the images of the batch are deleted again. Files whose content the owner
+already has are skipped, so an interrupted import continues where it stopped
+when run again.
+
+Usage:
+    python manage.py import_images /srv/archive --owner alice
+    python manage.py import_images /srv/archive --owner alice --workers 8 --batch-size 200
+"""
+import os
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from rest_framework.exceptions import ValidationError
+
+from accounts.policy import RolePolicy, get_role_policy
+from images.blobs import acquire_blob
+from images.models import Blob, Image
+from images.uploads import StagedFile
+from images.utils import (
+    create_thumbnails_batch,
+    file_metadata,
+    make_executor,
+    prerender_thumbnails,
+)
+from images.validation import validate_upload
+
+EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def find_images(directory: str) -> Iterator[str]:
+    """Yield the paths of the JPEG and PNG files of a directory tree, sorted."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def inspect_file(path: str, policy: RolePolicy) -> Tuple[Optional[dict], str]:
+    """
+    Validate a file and read its metadata. Runs in the worker processes.
+    Returns (metadata, "") or (None, reason the file was rejected).
+    """
+    try:
+        with StagedFile(path, os.path.basename(path)) as file:
+            validate_upload(file, policy)
+            return file_metadata(file), ""
+    except ValidationError as error:
+        return None, " ".join(str(detail) for detail in error.detail)
+    except OSError as error:
+        return None, str(error)
+
+
+def store_images(files: List[StagedFile], accepted: List[tuple], owner) -> List[Image]:
+    """
+    Store the originals and insert the images in one transaction. When it rolls
+    back, the files of the blobs it created are deleted.
+    """
+    created = []
+    try:
+        with transaction.atomic():
+            images = []
+            for file, (_, metadata) in zip(files, accepted):
+                blob = acquire_blob(
+                    file,
+                    metadata["content_hash"],
+                    metadata["byte_size"],
+                    metadata["format"],
+                )
+                if blob.ref_count == 1:
+                    created.append(blob.file.name)
+                filename, extension = os.path.splitext(file.name)
+                images.append(
+                    Image(
+                        image_file=blob.file.name,
+                        blob=blob,
+                        owner=owner,
+                        file_name=f"{filename}_{owner.username}{extension}",
+                        **metadata,
+                    )
+                )
+            return Image.objects.bulk_create(images)
+    except Exception:
+        storage = Blob._meta.get_field("file").storage
+        for name in created:
+            storage.delete(name)
+        raise
+
+
+def import_batch(paths: List[str], owner, policy: RolePolicy, executor) -> dict:
+    """
+    Import a batch of files: the thumbnails are rendered first, then the images
+    that rendered are inserted in one transaction, then their thumbnails.
+
+    Args:
+        paths (list): Paths of the files.
+        owner: User the images are imported for.
+        policy (RolePolicy): Policy of the owner's role.
+        executor: Process pool inspecting the files and rendering the
+            thumbnails, or None to do it serially.
+    Returns:
+        Dict with the numbers of "imported", "skipped" and "rejected" files and
+        the "errors" as (path, reason) pairs.
+    """
+    if executor is None:
+        inspected = [inspect_file(path, policy) for path in paths]
+    else:
+        inspected = executor.map(inspect_file, paths, [policy] * len(paths))
+
+    counts = {"imported": 0, "skipped": 0, "rejected": 0, "errors": []}
+    accepted = {}
+    for path, (metadata, error) in zip(paths, inspected):
+        if metadata is None:
+            counts["rejected"] += 1
+            counts["errors"].append((path, error))
+        elif metadata["content_hash"] in accepted:
+            counts["skipped"] += 1
+        else:
+            accepted[metadata["content_hash"]] = (path, metadata)
+    existing = set(
+        Image.objects.filter(owner=owner, content_hash__in=accepted).values_list(
+            "content_hash", flat=True
+        )
+    )
+    counts["skipped"] += len(existing)
+    accepted = [item for key, item in accepted.items() if key not in existing]
+    if not accepted:
+        return counts
+
+    files = [StagedFile(path, os.path.basename(path)) for path, _ in accepted]
+    try:
+        rendered, failed = prerender_thumbnails(
+            {
+                metadata["content_hash"]: file
+                for file, (_, metadata) in zip(files, accepted)
+            },
+            policy.thumbnail_sizes,
+            policy.jpeg_profile,
+            executor,
+        )
+        stored = []
+        for file, (path, metadata) in zip(files, accepted):
+            if metadata["content_hash"] in failed:
+                counts["rejected"] += 1
+                counts["errors"].append((path, str(failed[metadata["content_hash"]])))
+            else:
+                stored.append((file, (path, metadata)))
+        if not stored:
+            return counts
+        images = store_images(
+            [file for file, _ in stored], [item for _, item in stored], owner
+        )
+        try:
+            create_thumbnails_batch(
+                [(image, policy.thumbnail_sizes) for image in images],
+                policy.jpeg_profile,
+                sources={image.pk: file for image, (file, _) in zip(images, stored)},
+                executor=executor,
+                rendered=rendered,
+            )
+        except Exception:
+            # Releases the blobs too; the files are imported again by the next run.
+            Image.objects.filter(pk__in=[image.pk for image in images]).delete()
+            raise
+    finally:
+        for file in files:
+            file.close()
+    counts["imported"] = len(images)
+    return counts
+
+
+class Command(BaseCommand):
+    help = "Import the JPEG and PNG images of a directory tree for a user."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory to import images from.")
+        parser.add_argument(
+            "--owner", required=True, help="Username of the owner of the images."
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes validating files and rendering thumbnails "
+            "(default: number of CPUs).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Files committed in one transaction (default: 100).",
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options["directory"]):
+            raise CommandError(f"'{options['directory']}' is not a directory.")
+        try:
+            owner = get_user_model().objects.get(username=options["owner"])
+        except get_user_model().DoesNotExist as error:
+            raise CommandError(f"There is no user '{options['owner']}'.") from error
+        policy = get_role_policy(owner.role_id)
+        if policy is None:
+            raise CommandError(f"User '{owner.username}' has no role.")
+
+        totals = {"imported": 0, "skipped": 0, "rejected": 0}
+        started = time.monotonic()
+        if options["workers"] > 1:
+            # Database connections must not be shared with the forked processes.
+            connections.close_all()
+        executor = make_executor(options["workers"], "process")
+        try:
+            paths = list(find_images(options["directory"]))
+            for start in range(0, len(paths), options["batch_size"]):
+                counts = import_batch(
+                    paths[start : start + options["batch_size"]],
+                    owner,
+                    policy,
+                    executor,
+                )
+                for path, error in counts.pop("errors"):
+                    self.stderr.write(f"Rejected {path}: {error}")
+                for key, value in counts.items():
+                    totals[key] += value
+                self.stdout.write(
+                    f"{min(start + options['batch_size'], len(paths))}/"
+                    f"{len(paths)} files processed."
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        elapsed = time.monotonic() - started
+        rate = totals["imported"] / elapsed if elapsed > 0 else 0
+        self.stdout.write(
+            f"Imported {totals['imported']} images ({totals['skipped']} already "
+            f"imported, {totals['rejected']} rejected) in {elapsed:.2f}s "
+            f"({rate:.1f} images/s)."
+        )
@@ -0,0 +1,99 @@
+"""
+Management command running background thumbnail workers.
+
+Usage:
+    python manage.py process_thumbnail_jobs --processes 4
+    python manage.py process_thumbnail_jobs --once
+"""
+import multiprocessing
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from images.jobs import claim_job, run_job
+
+
+def work(worker: str, once: bool, poll_interval: float, lease: int, stdout=None):
+    """
+    Claim and run jobs until the queue is empty ('once') or forever.
+
+    Args:
+        worker (str): Name of the worker.
+        once (bool): Exit when there are no more jobs.
+        poll_interval (float): Seconds to wait before checking an empty queue again.
+        lease (int): Lease length in seconds.
+        stdout: Optional output stream for progress messages.
+    Returns:
+        Tuple with the number of finished and failed jobs.
+    """
+    done = failed = 0
+    while True:
+        job = claim_job(worker, lease)
+        if job is None:
+            if once:
+                return done, failed
+            time.sleep(poll_interval)
+            continue
+        if run_job(job):
+            done += 1
+        else:
+            failed += 1
+        if stdout is not None:
+            stdout.write(
+                f"{worker}: job {job.pk} for image {job.image_id} -> {job.status}"
+            )
+
+
+class Command(BaseCommand):
+    help = "Generate queued thumbnails in one or more local worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Number of worker processes (default: 1).",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when the queue is empty instead of waiting for new jobs.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling an empty queue again.",
+        )
+        parser.add_argument(
+            "--lease",
+            type=int,
+            default=None,
+            help="Seconds a claimed job is reserved for a worker.",
+        )
+
+    def handle(self, *args, **options):
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        worker_args = (options["once"], options["poll_interval"], options["lease"])
+
+        if options["processes"] <= 1:
+            done, failed = work(name, *worker_args, stdout=self.stdout)
+            self.stdout.write(f"Finished {done} jobs, {failed} failed.")
+            return
+
+        # Database connections must not be shared with the forked processes.
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=work, args=(f"{name}/{number}", *worker_args)
+            )
+            for number in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.stdout.write(f"{len(processes)} workers finished.")
@@ -0,0 +1,79 @@
+"""
+Management command deleting expired 'ExpiringImage' rows in bounded batches.
+
+Usage:
+    python manage.py reap_expiring_images
+    python manage.py reap_expiring_images --batch-size 500 --interval 600
+"""
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from images.models import ExpiringImage
+
+
+def reap_expired(batch_size: int, pause: float = 0):
+    """
+    Delete expired links, at most 'batch_size' rows per statement, so no
+    transaction holds locks on many rows at a time.
+
+    Args:
+        batch_size (int): Maximum number of rows deleted by one statement.
+        pause (float): Seconds to sleep between batches.
+    Returns:
+        Tuple with the number of deleted rows and batches.
+    """
+    now = datetime.now()
+    deleted = batches = 0
+    while True:
+        batch = list(
+            ExpiringImage.objects.filter(expire_time__lt=now)
+            .order_by("expire_time")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not batch:
+            return deleted, batches
+        count, _ = ExpiringImage.objects.filter(pk__in=batch).delete()
+        deleted += count
+        batches += 1
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    help = "Delete expired expiring image links in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of rows deleted by one statement (default: 1000).",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="Seconds to sleep between batches.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Run again every INTERVAL seconds instead of exiting.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            deleted, batches = reap_expired(options["batch_size"], options["pause"])
+            elapsed = time.monotonic() - started
+            rate = deleted / elapsed if elapsed > 0 else 0
+            self.stdout.write(
+                f"Deleted {deleted} expired links in {batches} batches "
+                f"({elapsed:.2f}s, {rate:.0f} rows/s)."
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,43 @@
+"""
+Management command deleting expired upload sessions and their staging files.
+
+Usage:
+    python manage.py reap_upload_sessions
+    python manage.py reap_upload_sessions --batch-size 500 --interval 600
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from images.uploads import reap_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired chunked upload sessions and their staging files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of sessions deleted by one statement "
+            "(default: 1000).",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Run again every INTERVAL seconds instead of exiting.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            sessions, orphans = reap_expired_sessions(options["batch_size"])
+            self.stdout.write(
+                f"Deleted {sessions} expired upload sessions and {orphans} "
+                f"orphaned staging files in {time.monotonic() - started:.2f}s."
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
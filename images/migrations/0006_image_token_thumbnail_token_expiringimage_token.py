@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0005_expiringimage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="token",
+            field=models.CharField(editable=False, max_length=36, null=True),
+        ),
+        migrations.AddField(
+            model_name="thumbnail",
+            name="token",
+            field=models.CharField(editable=False, max_length=36, null=True),
+        ),
+        migrations.AddField(
+            model_name="expiringimage",
+            name="token",
+            field=models.CharField(editable=False, max_length=36, null=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:14
+
+import uuid
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_tokens(model, url_field, prefix):
+    """
+    Return a RunPython function that copies the random part of the stored URL
+    (the part after 'prefix') into the 'token' column of the given model.
+    Rows without a preview URL get a new token.
+    """
+
+    def backfill(apps, schema_editor):
+        Model = apps.get_model("images", model)
+        seen = set()
+        batch = []
+        for obj in Model.objects.only("pk", url_field).order_by("pk").iterator():
+            url = getattr(obj, url_field) or ""
+            token = url.rsplit(prefix, 1)[-1] if prefix in url else ""
+            if not token or "/" in token or len(token) > 36 or token in seen:
+                token = str(uuid.uuid4())
+            seen.add(token)
+            obj.token = token
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                Model.objects.bulk_update(batch, ["token"])
+                batch = []
+        if batch:
+            Model.objects.bulk_update(batch, ["token"])
+
+    return backfill
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0006_image_token_thumbnail_token_expiringimage_token"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_tokens("Image", "image_url", "/img/"), migrations.RunPython.noop
+        ),
+        migrations.RunPython(
+            backfill_tokens("Thumbnail", "url", "/tmb/"), migrations.RunPython.noop
+        ),
+        migrations.RunPython(
+            backfill_tokens("ExpiringImage", "url", "/exp/"), migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:15
+
+from django.db import migrations, models
+import images.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0007_backfill_tokens"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="image",
+            name="token",
+            field=models.CharField(
+                default=images.models.generate_token,
+                editable=False,
+                max_length=36,
+                unique=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="thumbnail",
+            name="token",
+            field=models.CharField(
+                default=images.models.generate_token,
+                editable=False,
+                max_length=36,
+                unique=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="expiringimage",
+            name="token",
+            field=models.CharField(
+                default=images.models.generate_token,
+                editable=False,
+                max_length=36,
+                unique=True,
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="image",
+            name="image_url",
+        ),
+        migrations.RemoveField(
+            model_name="thumbnail",
+            name="url",
+        ),
+        migrations.RemoveField(
+            model_name="expiringimage",
+            name="url",
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0009_thumbnailjob"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(
+                fields=["owner", "upload_date", "id"], name="image_owner_upload_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0010_image_owner_upload_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="expiringimage",
+            name="expire_time",
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0011_alter_expiringimage_expire_time"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thumbnail",
+            name="variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
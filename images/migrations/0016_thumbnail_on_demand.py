@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0015_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thumbnail",
+            name="last_accessed",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="thumbnail",
+            name="on_demand",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="thumbnail",
+            index=models.Index(
+                fields=["on_demand", "last_accessed"], name="thumbnail_on_demand_idx"
+            ),
+        ),
+    ]
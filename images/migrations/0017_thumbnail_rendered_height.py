@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0016_thumbnail_on_demand"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thumbnail",
+            name="rendered_height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
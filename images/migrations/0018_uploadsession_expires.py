@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:51
+
+from django.db import migrations, models
+import images.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("images", "0017_thumbnail_rendered_height"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadsession",
+            name="expires",
+            field=models.DateTimeField(
+                db_index=True, default=images.models.upload_session_expiry
+            ),
+        ),
+    ]
@@ -3,37 +3,104 @@ This models.py module defines the 'Image' model and 'Thumbnail' model.
 
 The 'Image' model represents an uploaded by user image to the application.
 'Image' stores information about uploaded image like owner, filename, upload date
-and URL for accesing the image.
+and token for accesing the image. Dimensions, byte size, format and SHA-256 hash of
+the file are stored at upload, so they can be listed without opening the file.
+
+The 'Blob' model represents a stored original. Originals are stored once per distinct
+content under their SHA-256 hash; images uploaded with the same bytes share the blob,
+which counts them in 'ref_count' (see images/blobs.py).
+
+The 'UploadSession' and 'UploadChunk' models represent an original uploaded in numbered
+chunks (see images/uploads.py), so an interrupted upload is resumed by sending only the
+missing chunks. Sessions not resumed before 'expires' are deleted with their staging
+file by 'manage.py reap_upload_sessions'.
 
 The 'Thumbnail' model represents and Thumbnails based on 'Image' uploaded to the application.
 'Thumbnail' stores informations about created Thumbnail like height expresed in px. From which
-image it was created.
+image it was created. Besides the JPEG file a thumbnail may have variants in other formats
+(e.g. WebP), chosen by the preview view from the Accept header.
 
-Both models have a custom 'save' method that automatically generate unique URL for accesing
-the image or thumbnaild on current site.
+Every model that can be previewed stores a random, unique and indexed 'token'. The preview
+URL is built from the token with 'get_absolute_url', so the host is never stored in database.
 """
 import uuid
+from datetime import datetime, timedelta
+from typing import List
+from django.conf import settings
 from django.db import models
+from django.db.models.fields.files import FieldFile
 from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+# Upload sessions without a new chunk for this many seconds expire.
+DEFAULT_UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+
+def generate_token() -> str:
+    """Return a new random token used in the preview URLs."""
+    return str(uuid.uuid4())
+
+
+def upload_session_expiry() -> datetime:
+    """Return the expiry time of an upload session receiving a chunk now."""
+    ttl = getattr(settings, "IMAGES_UPLOAD_SESSION_TTL", DEFAULT_UPLOAD_SESSION_TTL)
+    return datetime.now() + timedelta(seconds=ttl)
+
+
+class Blob(models.Model):
+    """
+    The 'Blob' model represents an original file stored once per distinct content.
+    'ref_count' is the number of images pointing to it; the blob and its file are
+    deleted when it drops to zero.
+    """
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to="blobs/")
+    byte_size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
 
 
 class Image(models.Model):
     """
     The 'Image' model represents an uploaded by user image to the application.
     'Image' stores information about uploaded image like owner, filename, upload date
-    and URL for accesing the image.
+    and token for accesing the image.
     """
 
     owner = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     image_file = models.ImageField(upload_to="images/")
-    image_url = models.URLField(default="http://127.0.0.1:8000/admin/images/image/")
+    token = models.CharField(
+        max_length=36, unique=True, default=generate_token, editable=False
+    )
     file_name = models.CharField(max_length=255)
     upload_date = models.DateTimeField(auto_now_add=True)
+    # Metadata of the stored file, empty for rows not backfilled yet.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    byte_size = models.PositiveBigIntegerField(null=True, blank=True)
+    format = models.CharField(max_length=10, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # Shared stored original, 'image_file' holds the same storage name. Empty for
+    # images uploaded before originals were deduplicated.
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="images",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["owner", "upload_date", "id"], name="image_owner_upload_idx"
+            )
+        ]
 
-    def save(self, *args, **kwargs):
-        current_site = "127.0.0.1:8000/api/v1"
-        self.image_url = f"http://{current_site}/img/{uuid.uuid1()}"
-        super().save(*args, **kwargs)
+    def get_absolute_url(self):
+        """Returning path of the original image preview."""
+        return reverse("image_preview", args=[self.token])
 
 
 class Thumbnail(models.Model):
@@ -48,20 +115,141 @@ class Thumbnail(models.Model):
         Image, on_delete=models.CASCADE, related_name="thumbnails"
     )
     thumbnail_file = models.ImageField(upload_to="thumbnails/")
-    url = models.URLField(null=True, blank=True)
+    # Metadata of the JPEG file; 'height' above is the requested height, which
+    # 'rendered_height' is lower than for originals smaller than it.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    rendered_height = models.PositiveIntegerField(null=True, blank=True)
+    byte_size = models.PositiveBigIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    # Storage names of the same thumbnail in other formats, e.g. {"webp": "..."}.
+    variants = models.JSONField(default=dict, blank=True)
+    # IMAGES_JPEG_PROFILES profile the JPEG file was encoded with.
+    jpeg_profile = models.CharField(max_length=50, default="default")
+    # Rendered on first request rather than at upload (see images/on_demand.py);
+    # such thumbnails are evicted least recently requested first.
+    on_demand = models.BooleanField(default=False)
+    last_accessed = models.DateTimeField(null=True, blank=True)
+    token = models.CharField(
+        max_length=36, unique=True, default=generate_token, editable=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["on_demand", "last_accessed"], name="thumbnail_on_demand_idx"
+            )
+        ]
+
+    def get_absolute_url(self):
+        """Returning path of the thumbnail preview."""
+        return reverse("thumbnail_preview", args=[self.token])
 
-    def save(self, *args, **kwargs):
-        current_site = "127.0.0.1:8000/api/v1"
-        self.url = f"http://{current_site}/tmb/{uuid.uuid1()}"
-        super().save(*args, **kwargs)
+    @property
+    def formats(self) -> List[str]:
+        """Formats the thumbnail is stored in, "jpeg" first."""
+        return ["jpeg", *self.variants]
+
+    def get_file(self, image_format: str = "jpeg") -> FieldFile:
+        """Return the stored file of the thumbnail in the given format."""
+        if image_format == "jpeg":
+            return self.thumbnail_file
+        return FieldFile(
+            self, self._meta.get_field("thumbnail_file"), self.variants[image_format]
+        )
 
 
 class ExpiringImage(models.Model):
+    """
+    The 'ExpiringImage' model represents a link to an 'Image' that is valid
+    until 'expire_time'. Expired rows are removed by 'manage.py reap_expiring_images'.
+    """
+
     image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name="images")
-    expire_time = models.DateTimeField()
-    url = models.URLField(null=True, blank=True)
+    expire_time = models.DateTimeField(db_index=True)
+    token = models.CharField(
+        max_length=36, unique=True, default=generate_token, editable=False
+    )
+
+    def get_absolute_url(self):
+        """Returning path of the expiring image preview."""
+        return reverse("expire_image_view", args=[self.token])
+
+
+class ThumbnailJob(models.Model):
+    """
+    The 'ThumbnailJob' model represents a request to generate thumbnails of an 'Image'
+    in the background. Jobs are claimed by workers with a lease; a job whose lease ran
+    out (e.g. the worker crashed) is picked up again until 'attempts' reaches the limit.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    image = models.ForeignKey(
+        Image, on_delete=models.CASCADE, related_name="thumbnail_jobs"
+    )
+    sizes = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "lease_expires"], name="thumbnailjob_queue_idx"
+            )
+        ]
+
+
+class UploadSession(models.Model):
+    """
+    The 'UploadSession' model represents an original sent in chunks of 'chunk_size'
+    bytes. Chunks are written to a staging file as they arrive; finalizing the
+    session creates the 'Image' from that file. Every chunk moves 'expires' forward.
+    """
+
+    owner = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
+    token = models.CharField(
+        max_length=36, unique=True, default=generate_token, editable=False
+    )
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(default=upload_session_expiry, db_index=True)
+
+    @property
+    def chunk_count(self) -> int:
+        """Number of chunks of the upload, the last one may be shorter."""
+        return -(-self.size // self.chunk_size)
+
+
+class UploadChunk(models.Model):
+    """
+    The 'UploadChunk' model represents a chunk of an 'UploadSession' that was
+    received and written to the staging file, with its SHA-256 checksum.
+    """
+
+    session = models.ForeignKey(
+        UploadSession, on_delete=models.CASCADE, related_name="chunks"
+    )
+    number = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64)
 
-    def save(self, *args, **kwargs):
-        current_site = "127.0.0.1:8000/api/v1"
-        self.url = f"http://{current_site}/exp/{uuid.uuid1()}"
-        super().save(*args, **kwargs)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["session", "number"], name="uploadchunk_session_number_uniq"
+            )
+        ]
@@ -0,0 +1,134 @@
+"""
+Module with the thumbnails rendered on first request.
+
+Thumbnails are created at upload for the heights of the owner's role at that
+time. Heights the role allows later (a changed 'thumbnail_size', an upgraded
+user) are rendered the first time they are requested through
+'thumbnail_on_demand_view' and stored as 'Thumbnail' rows with 'on_demand' set.
+
+Concurrent first requests for the same image are serialized on a row lock of the
+image, so only the first one renders and the others find its thumbnail. On
+demand thumbnails form a cache bounded by IMAGES_ON_DEMAND_THUMBNAILS_MAX_BYTES:
+when it is exceeded the least recently requested ones are deleted, with their
+files unless other thumbnails share them. Thumbnails created at upload are never
+evicted.
+
+This module contains functions:
+ - get_or_create_thumbnail: Return the thumbnail of an image and height, rendering it once.
+ - touch_thumbnail: Record a request of an on-demand thumbnail.
+ - evict_on_demand_thumbnails: Delete the least recently requested on-demand
+   thumbnails above the size budget.
+"""
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import Image, Thumbnail
+from .utils import create_thumbnails_batch
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# 'last_accessed' is written at most once per this many seconds per thumbnail.
+TOUCH_INTERVAL = 60
+
+
+def get_or_create_thumbnail(
+    image: Image, height: int, profile: str = "default"
+) -> Tuple[Thumbnail, bool]:
+    """
+    Return the thumbnail of an image with the given height, rendering it when
+    the image has none.
+
+    Args:
+        image (Image): Image instance, with its stored file.
+        height (int): Height of the thumbnail.
+        profile (str): Name of the JPEG profile, e.g. 'RolePolicy.jpeg_profile'.
+    Returns:
+        Tuple with the Thumbnail instance and whether it was created.
+    """
+    thumbnail = image.thumbnails.filter(height=height).order_by("pk").first()
+    if thumbnail is not None:
+        return thumbnail, False
+    with transaction.atomic():
+        # Concurrent first requests wait here and then find the new thumbnail.
+        Image.objects.select_for_update().only("pk").get(pk=image.pk)
+        thumbnail = image.thumbnails.filter(height=height).order_by("pk").first()
+        if thumbnail is not None:
+            return thumbnail, False
+        thumbnail = create_thumbnails_batch(
+            [(image, [height])], profile, on_demand=True
+        )[image.pk][0]
+    evict_on_demand_thumbnails(keep=thumbnail.pk)
+    return thumbnail, True
+
+
+def touch_thumbnail(thumbnail: Thumbnail):
+    """Record a request of an on-demand thumbnail, for the LRU eviction."""
+    if not thumbnail.on_demand:
+        return
+    now = datetime.now()
+    since = now - timedelta(seconds=TOUCH_INTERVAL)
+    if thumbnail.last_accessed is not None and thumbnail.last_accessed > since:
+        return
+    Thumbnail.objects.filter(pk=thumbnail.pk, last_accessed__lt=since).update(
+        last_accessed=now
+    )
+
+
+def evict_on_demand_thumbnails(
+    max_bytes: Optional[int] = None, keep: Optional[int] = None
+) -> int:
+    """
+    Delete the least recently requested on-demand thumbnails until their total
+    size is within the budget. Stored files are deleted once the transaction
+    commits, unless another thumbnail points to them.
+
+    Args:
+        max_bytes (int): Budget in bytes, IMAGES_ON_DEMAND_THUMBNAILS_MAX_BYTES
+            by default.
+        keep (int): Primary key of a thumbnail that must not be evicted.
+    Returns:
+        Number of deleted thumbnails.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(
+            settings, "IMAGES_ON_DEMAND_THUMBNAILS_MAX_BYTES", DEFAULT_MAX_BYTES
+        )
+    cached = Thumbnail.objects.filter(on_demand=True)
+    total = cached.aggregate(total=Sum("byte_size"))["total"] or 0
+    if total <= max_bytes:
+        return 0
+
+    evicted, freed = [], 0
+    for thumbnail in (
+        cached.exclude(pk=keep)
+        .order_by("last_accessed", "pk")
+        .only("pk", "byte_size", "thumbnail_file", "variants", "token")
+        .iterator()
+    ):
+        evicted.append(thumbnail)
+        freed += thumbnail.byte_size or 0
+        if total - freed <= max_bytes:
+            break
+
+    with transaction.atomic():
+        Thumbnail.objects.filter(
+            pk__in=[thumbnail.pk for thumbnail in evicted]
+        ).delete()
+        names = [thumbnail.thumbnail_file.name for thumbnail in evicted]
+        shared = set(
+            Thumbnail.objects.filter(thumbnail_file__in=names).values_list(
+                "thumbnail_file", flat=True
+            )
+        )
+        storage = Thumbnail._meta.get_field("thumbnail_file").storage
+        unused = [
+            name
+            for thumbnail in evicted
+            if thumbnail.thumbnail_file.name not in shared
+            for name in [thumbnail.thumbnail_file.name, *thumbnail.variants.values()]
+        ]
+        transaction.on_commit(lambda: [storage.delete(name) for name in unused])
+    return len(evicted)
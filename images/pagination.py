@@ -0,0 +1,103 @@
+"""
+Module with pagination of the image listing.
+
+The 'ImageCursorPagination' class pages through images newest first using keyset
+(seek) pagination on (upload_date, id). Every page is a single index range scan
+on the (owner, upload_date, id) index, so page 1000 costs the same as page 1.
+The cursor is an opaque string encoding the position of the last returned image.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class ImageCursorPagination(BasePagination):
+    """
+    Keyset pagination over (upload_date, id), newest images first.
+
+    Query parameters:
+    cursor - position returned as 'next' by the previous page.
+    page_size - number of images on a page, at most IMAGES_MAX_PAGE_SIZE.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        """Return the requested page size limited to IMAGES_MAX_PAGE_SIZE."""
+        page_size = getattr(settings, "IMAGES_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+        max_page_size = getattr(settings, "IMAGES_MAX_PAGE_SIZE", MAX_PAGE_SIZE)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, max_page_size))
+
+    @staticmethod
+    def encode_cursor(upload_date: datetime, pk: int) -> str:
+        """Return an opaque cursor pointing after the given image."""
+        position = f"{upload_date.isoformat()}|{pk}".encode()
+        return base64.urlsafe_b64encode(position).decode().rstrip("=")
+
+    def decode_cursor(self, cursor: str):
+        """Return the (upload_date, id) position encoded in a cursor."""
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            upload_date, pk = (
+                base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+            )
+            return datetime.fromisoformat(upload_date), int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+            raise NotFound(self.invalid_cursor_message) from error
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by("-upload_date", "-pk")
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            upload_date, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(upload_date__lt=upload_date) | Q(upload_date=upload_date, pk__lt=pk)
+            )
+
+        page = list(queryset[: page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_cursor = (
+            self.encode_cursor(page[-1].upload_date, page[-1].pk)
+            if self.has_next
+            else None
+        )
+        return page
+
+    def get_next_link(self):
+        """Return URL of the next page, or None on the last page."""
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
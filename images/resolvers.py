@@ -0,0 +1,221 @@
+"""
+Module with a cache in front of the database lookups done by the preview views.
+
+Stored files never change once they are written, so the mapping from an image ID
+or a preview token to its stored file is cached in Django's cache framework
+(IMAGES_RESOLVER_CACHE alias) and dropped when the image or thumbnail is deleted.
+Unknown IDs and tokens are cached too, so previews never reach the database in
+the steady state. The entries are dropped by the process deleting the image, so
+the cache must be shared by all workers: a per-process LocMemCache is refused.
+Without IMAGES_RESOLVER_CACHE the lookups go to the database.
+
+This module contains functions:
+ - resolve_image: Return an unsaved 'Image' carrying the stored file of an image ID.
+ - resolve_image_token: Same as 'resolve_image' for the token of an image preview.
+ - resolve_thumbnail_token: Return an unsaved 'Thumbnail' for a thumbnail token.
+ - aresolve_image_token, aresolve_thumbnail_token: Async versions for ASGI views.
+ - forget_image: Drop the cached entries of an image, e.g. whose file is missing.
+ - forget_image_id: Drop the cached entry of an image ID, for images without a token.
+ - forget_thumbnail: Drop the cached entry of a thumbnail.
+ - invalidate_image, invalidate_thumbnail: Signal receivers calling the above.
+"""
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Image, Thumbnail
+
+DEFAULT_TIMEOUT = 24 * 60 * 60
+# Cached for IDs that don't exist, so repeated misses don't reach the database.
+MISSING = "-"
+
+
+def _cache():
+    """Return the cache of the lookups, or None when they aren't cached."""
+    alias = getattr(settings, "IMAGES_RESOLVER_CACHE", None)
+    if alias is None:
+        return None
+    cache = caches[alias]
+    if isinstance(cache, LocMemCache):
+        raise ImproperlyConfigured(
+            f"IMAGES_RESOLVER_CACHE '{alias}' is local to each process, deleted "
+            "images would stay cached in the other workers. Use a shared cache "
+            "(e.g. Redis or Memcached) or None."
+        )
+    return cache
+
+
+def _timeout():
+    return getattr(settings, "IMAGES_RESOLVER_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+def _resolve(key: str, queryset, fields: tuple):
+    """
+    Return the cached values of 'fields' of the first row of 'queryset',
+    querying the database and caching the result (or MISSING) on a miss.
+    """
+    cache = _cache()
+    if cache is None:
+        return queryset.values_list(*fields).first()
+    cached = cache.get(key)
+    if cached is None:
+        cached = queryset.values_list(*fields).first() or MISSING
+        cache.set(key, cached, _timeout())
+    return None if cached == MISSING else cached
+
+
+async def _aresolve(key: str, queryset, fields: tuple):
+    """Async version of '_resolve' using the async cache and ORM APIs."""
+    cache = _cache()
+    if cache is None:
+        return await queryset.values_list(*fields).afirst()
+    cached = await cache.aget(key)
+    if cached is None:
+        cached = await queryset.values_list(*fields).afirst() or MISSING
+        await cache.aset(key, cached, _timeout())
+    return None if cached == MISSING else cached
+
+
+def resolve_image(image_id: int) -> Optional[Image]:
+    """
+    Return the stored file and upload date of an image, from cache if possible.
+
+    Args:
+        image_id (int): Primary key of the image.
+    Returns:
+        Unsaved Image instance with 'pk', 'image_file' and 'upload_date' set,
+        or None if the image doesn't exist. Its 'token' is not the image's one.
+    """
+    cached = _resolve(
+        f"images:image:{image_id}",
+        Image.objects.filter(pk=image_id),
+        ("image_file", "upload_date"),
+    )
+    if cached is None:
+        return None
+    name, upload_date = cached
+    return Image(pk=image_id, image_file=name, upload_date=upload_date)
+
+
+def _image_token_lookup(token: str):
+    return (
+        f"images:image-token:{token}",
+        Image.objects.filter(token=token),
+        ("pk", "image_file", "upload_date"),
+    )
+
+
+def _image_from_token(token: str, cached) -> Optional[Image]:
+    if cached is None:
+        return None
+    pk, name, upload_date = cached
+    return Image(pk=pk, token=token, image_file=name, upload_date=upload_date)
+
+
+def resolve_image_token(token: str) -> Optional[Image]:
+    """
+    Return the image previewed under a token, from cache if possible.
+
+    Args:
+        token (str): Token of the image.
+    Returns:
+        Unsaved Image instance with 'pk', 'token', 'image_file' and 'upload_date'
+        set, or None if there is no image with that token.
+    """
+    return _image_from_token(token, _resolve(*_image_token_lookup(token)))
+
+
+async def aresolve_image_token(token: str) -> Optional[Image]:
+    """Async version of 'resolve_image_token'."""
+    return _image_from_token(token, await _aresolve(*_image_token_lookup(token)))
+
+
+def _thumbnail_token_lookup(token: str):
+    return (
+        f"images:thumbnail-variants:{token}",
+        Thumbnail.objects.filter(token=token),
+        ("pk", "thumbnail_file", "variants", "image_id", "image__upload_date"),
+    )
+
+
+def _thumbnail_from_token(token: str, cached) -> Optional[Thumbnail]:
+    if cached is None:
+        return None
+    pk, name, variants, image_id, upload_date = cached
+    return Thumbnail(
+        pk=pk,
+        token=token,
+        thumbnail_file=name,
+        variants=variants,
+        image=Image(pk=image_id, upload_date=upload_date),
+    )
+
+
+def resolve_thumbnail_token(token: str) -> Optional[Thumbnail]:
+    """
+    Return the thumbnail previewed under a token, from cache if possible.
+
+    Args:
+        token (str): Token of the thumbnail.
+    Returns:
+        Unsaved Thumbnail instance with 'pk', 'token', 'thumbnail_file' and
+        'variants' set and 'image' carrying the upload date of the original, or
+        None if there is no thumbnail with that token.
+    """
+    return _thumbnail_from_token(token, _resolve(*_thumbnail_token_lookup(token)))
+
+
+async def aresolve_thumbnail_token(token: str) -> Optional[Thumbnail]:
+    """Async version of 'resolve_thumbnail_token'."""
+    return _thumbnail_from_token(
+        token, await _aresolve(*_thumbnail_token_lookup(token))
+    )
+
+
+def forget_image(image: Image):
+    """
+    Drop the cached entries of an image, e.g. one deleted or whose stored file
+    is missing.
+    """
+    cache = _cache()
+    if cache is not None:
+        cache.delete_many(
+            [f"images:image:{image.pk}", f"images:image-token:{image.token}"]
+        )
+
+
+def forget_image_id(image_id: int):
+    """
+    Drop the cached entry of an image ID, e.g. of an image from 'resolve_image',
+    which doesn't carry the token of the image.
+    """
+    cache = _cache()
+    if cache is not None:
+        cache.delete(f"images:image:{image_id}")
+
+
+def forget_thumbnail(thumbnail: Thumbnail):
+    """Drop the cached entry of a thumbnail."""
+    cache = _cache()
+    if cache is not None:
+        cache.delete(f"images:thumbnail-variants:{thumbnail.token}")
+
+
+@receiver(post_delete, sender=Image)
+def invalidate_image(sender, instance, **kwargs):
+    """Drop the cached entries of a deleted image."""
+    forget_image(instance)
+
+
+@receiver(post_delete, sender=Thumbnail)
+def invalidate_thumbnail(sender, instance, **kwargs):
+    """
+    Drop the cached entry of a deleted thumbnail. Also called for the thumbnails
+    deleted together with their image.
+    """
+    forget_thumbnail(instance)
@@ -2,6 +2,46 @@ from rest_framework import serializers
 from accounts.models import CustomUser
 from images.models import Image, Thumbnail
 
+# Image fields returned by 'image_metadata'.
+IMAGE_METADATA_FIELDS = ("width", "height", "byte_size", "format", "content_hash")
+# Thumbnail fields returned by 'thumbnail_metadata'.
+THUMBNAIL_METADATA_FIELDS = ("width", "rendered_height", "byte_size")
+
+
+def absolute_url(request, obj) -> str:
+    """
+    Build the absolute preview URL of an Image, Thumbnail or ExpiringImage.
+    Falls back to the site relative path when there is no request.
+    """
+    path = obj.get_absolute_url()
+    return request.build_absolute_uri(path) if request is not None else path
+
+
+def image_metadata(image: Image) -> dict:
+    """Return the stored metadata of an Image, as sent by the image endpoints."""
+    return {
+        "width": image.width,
+        "height": image.height,
+        "byte_size": image.byte_size,
+        "format": image.format or None,
+        "content_hash": image.content_hash or None,
+    }
+
+
+def thumbnail_metadata(thumbnails) -> dict:
+    """
+    Return the stored metadata of thumbnails keyed like "200px" by their requested
+    height, with the dimensions they were rendered at.
+    """
+    return {
+        f"{thumbnail.height}px": {
+            "width": thumbnail.width,
+            "height": thumbnail.rendered_height,
+            "byte_size": thumbnail.byte_size,
+        }
+        for thumbnail in thumbnails
+    }
+
 
 class UserSerializer(serializers.ModelSerializer):
     role = serializers.StringRelatedField()
@@ -16,12 +56,22 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class ImageSerializer(serializers.ModelSerializer):
+    image_url = serializers.SerializerMethodField()
+
     class Meta:
         model = Image
         fields = ["image_url", "image_file"]
 
+    def get_image_url(self, obj):
+        return absolute_url(self.context.get("request"), obj)
+
 
 class ThumbnailSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
     class Meta:
         model = Thumbnail
         fields = ["url"]
+
+    def get_url(self, obj):
+        return absolute_url(self.context.get("request"), obj)
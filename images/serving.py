@@ -0,0 +1,479 @@
+"""
+Module with helpers used by the preview views to send stored files to the client.
+This module contains functions:
+ - file_etag: Build a strong ETag for a stored file without touching the file.
+ - serve_file: Answer conditional requests with 304 and otherwise build a response
+   for a stored file, either streamed in chunks by Django or offloaded to a front
+   proxy with X-Accel-Redirect / X-Sendfile. Adds ETag, Last-Modified and
+   Cache-Control headers and answers Range requests with 206 Partial Content.
+   A stored file that doesn't exist (any more) raises Http404.
+ - aserve_file: Async version of 'serve_file' for ASGI views, streaming the file
+   with reads offloaded to worker threads.
+ - serve_bytes: Same as 'serve_file' for content already held in memory.
+ - parse_range_header: Parse a Range header into a list of byte ranges.
+ - negotiate_format: Pick the thumbnail format to send from the Accept header.
+ - guess_content_type: Return the MIME type of a stored file from its name.
+"""
+import calendar
+import hashlib
+import mimetypes
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.fields.files import FieldFile
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpRequest,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+# More ranges than this in one request are ignored and the whole file is sent.
+MAX_RANGES = 16
+# Thumbnail formats preferred over JPEG, best first.
+PREFERRED_FORMATS = ("avif", "webp")
+
+# Not known to the mimetypes module of older Python versions.
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+def guess_content_type(field_file: FieldFile) -> str:
+    """Return the MIME type of a stored file, based on its extension."""
+    content_type, _ = mimetypes.guess_type(field_file.name)
+    return content_type or "application/octet-stream"
+
+
+def negotiate_format(request: HttpRequest, available: Sequence[str]) -> str:
+    """
+    Pick the best of the available thumbnail formats the client accepts.
+
+    Only formats named explicitly in the Accept header (with a non-zero q) are
+    used, so clients sending just "*/*" keep getting JPEG.
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        available (list): Formats the thumbnail is stored in, e.g. ["jpeg", "webp"].
+    Returns:
+        "avif", "webp" or "jpeg".
+    """
+    accepted = set()
+    for item in request.headers.get("Accept", "").split(","):
+        media_type, *params = item.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(media_type.strip().lower())
+    for image_format in PREFERRED_FORMATS:
+        if image_format in available and f"image/{image_format}" in accepted:
+            return image_format
+    return "jpeg"
+
+
+def file_etag(field_file: FieldFile) -> str:
+    """
+    Return a strong ETag for a stored file.
+
+    Stored files are never overwritten (the storage picks a new name for every
+    upload), so the storage name identifies the content and the ETag can be
+    computed without opening or stat-ing the file.
+
+    Args:
+        field_file (FieldFile): Stored file.
+    Returns:
+        Quoted ETag value.
+    """
+    digest = hashlib.sha256(field_file.name.encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def parse_range_header(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse the value of a Range header.
+
+    Args:
+        header (str): Value of the Range header, e.g. "bytes=0-499,-500".
+        size (int): Size of the file in bytes.
+    Returns:
+        List of inclusive (start, end) ranges that can be satisfied, an empty
+        list if none of them can, or None if the header is invalid and has to
+        be ignored.
+    """
+    unit, _, ranges_spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not ranges_spec:
+        return None
+
+    ranges = []
+    for spec in ranges_spec.split(","):
+        start, dash, end = spec.strip().partition("-")
+        if not dash or not (start or end):
+            return None
+        if (start and not start.isdigit()) or (end and not end.isdigit()):
+            return None
+        if not start:
+            # Suffix range: the last 'end' bytes of the file.
+            length = int(end)
+            if length > 0 and size > 0:
+                ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(start)
+        if end and start > int(end):
+            return None
+        if start < size:
+            end = min(int(end), size - 1) if end else size - 1
+            ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def _if_range_matches(request: HttpRequest, etag: str, timestamp: Optional[int]):
+    """
+    Check the If-Range header. A Range is only used if If-Range is missing or
+    names the current version of the file.
+    """
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return timestamp is not None and parse_http_date_safe(if_range) == timestamp
+
+
+def _read_range(field_file: FieldFile, start: int, end: int, chunk_size: int):
+    """
+    Yield the bytes between 'start' and 'end' (inclusive) of an open file.
+    """
+    field_file.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = field_file.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _iter_ranges(
+    field_file: FieldFile,
+    parts: List[Tuple[bytes, int, int]],
+    ending: bytes,
+    chunk_size: int,
+) -> Iterator[bytes]:
+    """
+    Yield every range from 'parts' preceded by its header, then 'ending'.
+    Closes the file when done or when the client goes away.
+    """
+    field_file.open("rb")
+    try:
+        for header, start, end in parts:
+            if header:
+                yield header
+            yield from _read_range(field_file, start, end, chunk_size)
+        if ending:
+            yield ending
+    finally:
+        field_file.close()
+
+
+async def _aiter(iterator: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Yield the chunks of a blocking iterator, advancing it in a worker thread so
+    the event loop is never blocked on file I/O.
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await next_chunk(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=False)()
+
+
+def _stream(
+    field_file: FieldFile,
+    parts: List[Tuple[bytes, int, int]],
+    ending: bytes,
+    asynchronous: bool,
+    chunk_size: int,
+):
+    """Return '_iter_ranges' as a blocking or an async iterator."""
+    iterator = _iter_ranges(field_file, parts, ending, chunk_size)
+    return _aiter(iterator) if asynchronous else iterator
+
+
+def _range_response(
+    field_file: FieldFile,
+    content_type: str,
+    ranges: List[Tuple[int, int]],
+    size: int,
+    asynchronous: bool,
+    chunk_size: int,
+):
+    """
+    Build a 206 Partial Content response streaming only the requested ranges.
+    A single range is sent as is, several ranges as multipart/byteranges.
+    """
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            _stream(field_file, [(b"", start, end)], b"", asynchronous, chunk_size),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = end - start + 1
+        return response
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    length = 0
+    for start, end in ranges:
+        header = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+        ).encode()
+        parts.append((header, start, end))
+        length += len(header) + end - start + 1
+    ending = f"\r\n--{boundary}--\r\n".encode()
+    response = StreamingHttpResponse(
+        _stream(field_file, parts, ending, asynchronous, chunk_size),
+        status=206,
+        content_type=f"multipart/byteranges; boundary={boundary}",
+    )
+    response["Content-Length"] = length + len(ending)
+    return response
+
+
+def _offload_response(field_file: FieldFile, content_type: str, backend: str):
+    """
+    Build an empty response that tells the front proxy which file to send.
+
+    Args:
+        field_file (FieldFile): Stored file to be sent by the proxy.
+        content_type (str): Content type of the response.
+        backend (str): "nginx" for X-Accel-Redirect or "xsendfile" for X-Sendfile.
+    Returns:
+        HttpResponse without a body.
+    """
+    response = HttpResponse(content_type=content_type)
+    if backend == "nginx":
+        prefix = getattr(settings, "IMAGES_SENDFILE_URL", "/protected-media/")
+        response["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{quote(field_file.name)}"
+    elif backend == "xsendfile":
+        response["X-Sendfile"] = field_file.path
+    else:
+        raise ImproperlyConfigured(
+            f"Unknown IMAGES_SENDFILE_BACKEND '{backend}'. Use 'nginx' or 'xsendfile'."
+        )
+    return response
+
+
+def _file_response(
+    request: HttpRequest,
+    field_file: FieldFile,
+    content_type: str,
+    allow_ranges: bool,
+    etag: str,
+    timestamp: Optional[int],
+    asynchronous: bool,
+    chunk_size: Optional[int],
+    offload: bool,
+):
+    """
+    Build the response with the file content, streamed or offloaded.
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        field_file (FieldFile): Stored file.
+        content_type (str): Content type of the response.
+        allow_ranges (bool): Answer Range requests with the requested bytes only.
+        etag (str): ETag of the file, checked against If-Range.
+        timestamp (int): Last modification time, checked against If-Range.
+        asynchronous (bool): Stream the file with an async iterator.
+        chunk_size (int): Bytes read at a time, IMAGES_STREAM_CHUNK_SIZE if None.
+        offload (bool): Let IMAGES_SENDFILE_BACKEND send the file.
+    Returns:
+        FileResponse streaming the file, StreamingHttpResponse with the requested
+        ranges, or HttpResponse with offload headers.
+    """
+    backend = getattr(settings, "IMAGES_SENDFILE_BACKEND", None)
+    if backend and offload:
+        # The proxy answers Range requests by itself.
+        return _offload_response(field_file, content_type, backend)
+
+    if chunk_size is None:
+        chunk_size = getattr(settings, "IMAGES_STREAM_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    range_header = request.META.get("HTTP_RANGE")
+    if (
+        allow_ranges
+        and range_header
+        and request.method in ("GET", "HEAD")
+        and _if_range_matches(request, etag, timestamp)
+    ):
+        size = field_file.size
+        ranges = parse_range_header(range_header, size)
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+        if ranges:
+            return _range_response(
+                field_file, content_type, ranges, size, asynchronous, chunk_size
+            )
+
+    if asynchronous:
+        size = field_file.size
+        response = StreamingHttpResponse(
+            _stream(field_file, [(b"", 0, size - 1)], b"", True, chunk_size),
+            content_type=content_type,
+        )
+        response["Content-Length"] = size
+        return response
+
+    response = FileResponse(field_file.open("rb"), content_type=content_type)
+    response.block_size = chunk_size
+    return response
+
+
+def serve_file(
+    request: HttpRequest,
+    field_file: FieldFile,
+    content_type: str,
+    last_modified: Optional[datetime] = None,
+    max_age: Optional[int] = None,
+    allow_ranges: bool = False,
+    asynchronous: bool = False,
+    chunk_size: Optional[int] = None,
+    offload: bool = True,
+):
+    """
+    Return a response sending the given stored file without loading it into memory.
+
+    If-None-Match / If-Modified-Since are checked first, so a matching request
+    gets 304 Not Modified before the file is opened. Otherwise the file is
+    streamed by Django in IMAGES_STREAM_CHUNK_SIZE chunks, or, when
+    IMAGES_SENDFILE_BACKEND is set, the response carries only a header and the
+    front proxy sends the bytes. With 'allow_ranges' a Range request gets
+    206 Partial Content with only the requested slice(s) read from the file.
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        field_file (FieldFile): Stored file (e.g. 'Image.image_file').
+        content_type (str): Content type of the response.
+        last_modified (datetime): Time the file was created, sent as Last-Modified.
+        max_age (int): Cache lifetime in seconds. When not given the file is treated
+            as immutable and cached for IMAGES_CACHE_MAX_AGE seconds.
+        allow_ranges (bool): Support byte-range requests.
+        asynchronous (bool): Stream the body with an async iterator (see
+            'aserve_file').
+        chunk_size (int): Bytes read at a time instead of IMAGES_STREAM_CHUNK_SIZE.
+        offload (bool): Let IMAGES_SENDFILE_BACKEND send the file; False always
+            streams it.
+    Returns:
+        HttpResponseNotModified, FileResponse, StreamingHttpResponse with ranges
+        or HttpResponse with offload headers.
+    Raises:
+        Http404: The stored file doesn't exist.
+    """
+    etag = file_etag(field_file)
+    timestamp = calendar.timegm(last_modified.utctimetuple()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        try:
+            response = _file_response(
+                request,
+                field_file,
+                content_type,
+                allow_ranges,
+                etag,
+                timestamp,
+                asynchronous,
+                chunk_size,
+                offload,
+            )
+        except FileNotFoundError as error:
+            # Deleted after the lookup, e.g. together with its image.
+            raise Http404("File does not exist.") from error
+    return _patch_headers(response, etag, timestamp, max_age, allow_ranges)
+
+
+async def aserve_file(
+    request: HttpRequest, field_file: FieldFile, content_type: str, **kwargs
+):
+    """
+    Async version of 'serve_file' taking the same arguments.
+
+    Stat-ing the file happens in a worker thread, and the body is an async
+    iterator reading every chunk in a worker thread, so under ASGI a slow client
+    holds no thread while it downloads.
+    """
+    return await sync_to_async(serve_file, thread_sensitive=False)(
+        request, field_file, content_type, asynchronous=True, **kwargs
+    )
+
+
+def serve_bytes(
+    request: HttpRequest,
+    content: bytes,
+    content_type: str,
+    etag: str,
+    timestamp: Optional[int] = None,
+    max_age: Optional[int] = None,
+):
+    """
+    Return a response with content already held in memory (e.g. a cached
+    thumbnail), with the same conditional handling and headers as 'serve_file'.
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        content (bytes): Body of the response.
+        content_type (str): Content type of the response.
+        etag (str): ETag of the content, as returned by 'file_etag'.
+        timestamp (int): Last modification time as a Unix timestamp.
+        max_age (int): Cache lifetime in seconds, see 'serve_file'.
+    Returns:
+        HttpResponseNotModified or HttpResponse with the content.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = HttpResponse(content, content_type=content_type)
+    return _patch_headers(response, etag, timestamp, max_age, False)
+
+
+def _patch_headers(
+    response, etag: str, timestamp: Optional[int], max_age: Optional[int], allow_ranges
+):
+    """Add validators and Cache-Control to a response of 'serve_file' / 'serve_bytes'."""
+    if allow_ranges:
+        response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    if timestamp is not None:
+        response["Last-Modified"] = http_date(timestamp)
+    if max_age is None:
+        max_age = getattr(settings, "IMAGES_CACHE_MAX_AGE", DEFAULT_CACHE_MAX_AGE)
+        patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=max(int(max_age), 0))
+    return response
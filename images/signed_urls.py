@@ -0,0 +1,53 @@
+"""
+Module with stateless, HMAC signed expiring links.
+
+A signed token carries the image ID and the expiry time (both base62 encoded) and an
+HMAC-SHA256 signature made with SECRET_KEY, so it can be checked without a database
+query. Unlike 'ExpiringImage' rows these links cannot be revoked before they expire.
+
+This module contains functions:
+ - make_signed_token: Create a token for an image valid until the given time.
+ - read_signed_token: Verify a token and return the image ID and expiry time.
+"""
+from typing import Tuple
+
+from django.core import signing
+
+SALT = "images.signed_urls"
+
+
+def _signer() -> signing.Signer:
+    return signing.Signer(salt=SALT)
+
+
+def make_signed_token(image_id: int, expires: int) -> str:
+    """
+    Create a signed token for an image.
+
+    Args:
+        image_id (int): Primary key of the image.
+        expires (int): Unix timestamp after which the token is rejected.
+    Returns:
+        Token usable in a URL path.
+    """
+    payload = f"{signing.b62_encode(image_id)}.{signing.b62_encode(expires)}"
+    return _signer().sign(payload)
+
+
+def read_signed_token(token: str) -> Tuple[int, int]:
+    """
+    Verify the signature of a token and decode it. Expiry is not checked.
+
+    Args:
+        token (str): Token created by 'make_signed_token'.
+    Returns:
+        Tuple with the image ID and the expiry Unix timestamp.
+    Raises:
+        django.core.signing.BadSignature: The token was not signed by us.
+    """
+    payload = _signer().unsign(token)
+    try:
+        image_id, expires = payload.split(".")
+        return signing.b62_decode(image_id), signing.b62_decode(expires)
+    except ValueError as error:
+        raise signing.BadSignature("Malformed token.") from error
@@ -1,13 +1,86 @@
 from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase as BaseAPITestCase
 from accounts.models import CustomUser, Role
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from PIL import Image as PILImage
 from django.urls import reverse
+import hashlib
 import io
-from django.core.files.uploadedfile import InMemoryUploadedFile
+import os
+import struct
+import zlib
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile
+from django.core.cache import caches
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from io import BytesIO
 import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+from django.db.models.fields.files import FieldFile
+from django.core.management import call_command
+from accounts.policy import get_role_policy, invalidate_role_policies
+from images.cache import (
+    CachedFile,
+    LocalThumbnailCache,
+    get_thumbnail_cache,
+    thumbnail_cache_key,
+)
+from images.jobs import claim_job, run_job
+from images.on_demand import evict_on_demand_thumbnails
+from images.models import (
+    Blob,
+    Image,
+    ExpiringImage,
+    Thumbnail,
+    ThumbnailJob,
+    UploadChunk,
+    UploadSession,
+)
+from images.serializers import ThumbnailSerializer, thumbnail_metadata
+from images.serving import serve_file
+from images.signed_urls import make_signed_token
+from images.views import (
+    async_expire_image_preview_view,
+    async_image_preview_view,
+    async_thumbnail_preview_view,
+)
+from images.utils import (
+    create_thumbnail,
+    create_thumbnails,
+    create_thumbnails_batch,
+    file_metadata,
+    jpeg_profile,
+    make_executor,
+    render_thumbnails,
+    thumbnail_formats,
+)
+
+
+def use_shared_resolver_cache(test):
+    """Cache the preview lookups of a test in a file-based cache of its own."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    settings_override = override_settings(
+        CACHES={
+            **settings.CACHES,
+            "resolver": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": directory.name,
+            },
+        },
+        IMAGES_RESOLVER_CACHE="resolver",
+    )
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
 
 # Create your tests here.
 class APITestCase(APITestCase):
@@ -75,7 +148,7 @@ class APITestCase(APITestCase):
         self.client.login(username=self.basic_user.username, password="testpass123")
         url = reverse("images")
         image = self.temporary_image()
-        data = {"image": image}
+        data = {"image_file": image}
         response = self.client.post(url, data, format="multipart")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn("200px_thumbnail", response.data)
@@ -85,6 +158,248 @@ class APITestCase(APITestCase):
 
     def test_post_image_premium_user(self):
         self.client.login(username=self.premium_user.username, password="testpass123")
+        url = reverse("images")
+        image = PILImage.new("RGB", (1200, 900))
+        upload = BytesIO()
+        image.save(upload, "jpeg")
+        upload.seek(0)
+        upload.name = "premium.jpg"
+        response = self.client.post(url, {"image_file": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("200px_thumbnail", response.data)
+        self.assertIn("400px_thumbnail", response.data)
+        self.assertIn("original_image", response.data)
+        heights = {}
+        for thumbnail in Thumbnail.objects.filter(image__owner=self.premium_user):
+            with PILImage.open(thumbnail.thumbnail_file) as img:
+                heights[thumbnail.height] = img.size
+        self.assertEqual(heights, {200: (267, 200), 400: (533, 400)})
+
+    def test_post_image_makes_no_role_queries(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        self.client.get(reverse("images"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("images"),
+                {"image_file": self.temporary_image()},
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(
+            [query for query in queries if "accounts_role" in query["sql"]]
+        )
+
+    def post_jpeg(self, name, color=(0, 0, 0), size=(300, 200)):
+        """Uploads a JPEG as the logged in user."""
+        upload = uploaded_image(name, size, color)
+        return self.client.post(
+            reverse("images"), {"image_file": upload}, format="multipart"
+        )
+
+    def test_identical_uploads_share_blob_and_thumbnails(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        self.assertEqual(self.post_jpeg("first.jpg").status_code, status.HTTP_200_OK)
+        with mock.patch("images.utils.render_thumbnails") as render:
+            response = self.post_jpeg("second.jpg")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        render.assert_not_called()
+
+        first, second = Image.objects.filter(owner=self.premium_user).order_by("pk")
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.image_file.name, second.image_file.name)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        self.assertEqual(
+            sorted(first.thumbnails.values_list("height", "thumbnail_file")),
+            sorted(second.thumbnails.values_list("height", "thumbnail_file")),
+        )
+        self.assertNotEqual(
+            set(first.thumbnails.values_list("token", flat=True)),
+            set(second.thumbnails.values_list("token", flat=True)),
+        )
+
+    def test_different_uploads_get_own_blobs(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        self.post_jpeg("black.jpg")
+        self.post_jpeg("white.jpg", color=(255, 255, 255))
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(
+            Thumbnail.objects.values("thumbnail_file").distinct().count(), 4
+        )
+
+    def test_original_stored_with_sniffed_extension(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        upload = uploaded_image("p.jpg", size=(30, 20), image_format="png")
+        response = self.client.post(
+            reverse("images"), {"image_file": upload}, format="multipart"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        image = Image.objects.get(owner=self.premium_user)
+        self.assertEqual(image.format, "png")
+        self.assertTrue(image.image_file.name.endswith(".png"))
+        preview = self.client.get(image.get_absolute_url())
+        self.assertEqual(preview["Content-Type"], "image/png")
+
+    def test_blob_deleted_with_last_image(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        self.post_jpeg("first.jpg")
+        self.post_jpeg("second.jpg")
+        blob = Blob.objects.get()
+        storage, name = blob.file.storage, blob.file.name
+        first, second = Image.objects.filter(owner=self.premium_user).order_by("pk")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(storage.exists(name))
+
+    def assert_thumbnails_rendered_from_upload(self):
+        with mock.patch.object(
+            FileSystemStorage, "open", side_effect=AssertionError("storage read")
+        ):
+            response = self.post_jpeg("streamed.jpg", size=(900, 600))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        thumbnail = Thumbnail.objects.get(height=400)
+        with PILImage.open(thumbnail.thumbnail_file) as img:
+            self.assertEqual(img.size, (600, 400))
+        image_file = Image.objects.get().image_file
+        self.assertTrue(image_file.storage.exists(image_file.name))
+
+    def test_upload_in_memory_never_read_from_storage(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        self.assert_thumbnails_rendered_from_upload()
+
+    @override_settings(
+        FILE_UPLOAD_MAX_MEMORY_SIZE=0,
+        IMAGES_THUMBNAIL_WORKERS=2,
+        IMAGES_THUMBNAIL_EXECUTOR="thread",
+    )
+    def test_upload_temporary_file_never_read_from_storage(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        self.assert_thumbnails_rendered_from_upload()
+
+    def test_batch_upload(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        files = []
+        for name, color in [("red.jpg", (255, 0, 0)), ("blue.jpg", (0, 0, 255))]:
+            files.append(uploaded_image(name, (600, 400), color))
+        files.insert(1, SimpleUploadedFile("notes.jpg", b"not an image"))
+        files.append(SimpleUploadedFile("red_again.jpg", files[0].read()))
+        files[0].seek(0)
+
+        with CaptureQueriesContext(connection) as queries, mock.patch(
+            "images.utils.render_thumbnails", wraps=render_thumbnails
+        ) as render:
+            response = self.client.post(
+                reverse("batch_upload"), {"image_files": files}, format="multipart"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual(
+            [result["file_name"] for result in results],
+            ["red.jpg", "notes.jpg", "blue.jpg", "red_again.jpg"],
+        )
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["created", "error", "created", "created"],
+        )
+        self.assertIn("Only JPEG and PNG", str(results[1]["errors"]))
+        self.assertIn("400px_thumbnail", results[3])
+
+        # Identical files are rendered once, rows are inserted with one query each.
+        self.assertEqual(render.call_count, 2)
+        inserts = [
+            query["sql"] for query in queries if query["sql"].startswith("INSERT")
+        ]
+        self.assertEqual(len([sql for sql in inserts if '"images_image"' in sql]), 1)
+        self.assertEqual(
+            len([sql for sql in inserts if '"images_thumbnail"' in sql]), 1
+        )
+        red, _, red_again = Image.objects.order_by("pk")
+        self.assertEqual(
+            sorted(red.thumbnails.values_list("thumbnail_file", flat=True)),
+            sorted(red_again.thumbnails.values_list("thumbnail_file", flat=True)),
+        )
+
+    def test_batch_upload_truncated_file(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        files = [uploaded_image("good.jpg", (600, 400)), truncated_image("cut.jpg")]
+        response = self.client.post(
+            reverse("batch_upload"), {"image_files": files}, format="multipart"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        self.assertEqual([result["status"] for result in results], ["created", "error"])
+        self.assertIn("corrupt", str(results[1]["errors"]))
+        image = Image.objects.get()
+        self.assertEqual(image.pk, results[0]["image_id"])
+        self.assertEqual(image.thumbnails.count(), 2)
+        self.assertEqual(Blob.objects.count(), 1)
+
+    def assert_rejected_before_storage(self, upload, message):
+        with mock.patch.object(FileSystemStorage, "save") as save:
+            response = self.client.post(
+                reverse("images"), {"image_file": upload}, format="multipart"
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(message, str(response.data))
+        save.assert_not_called()
+        self.assertFalse(Image.objects.exists())
+
+    def test_upload_format_sniffed_not_trusted(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        upload = SimpleUploadedFile(
+            "fake.jpg", b"GIF89a not a jpeg", content_type="image/jpeg"
+        )
+        self.assert_rejected_before_storage(upload, "Only JPEG and PNG")
+
+    def test_upload_corrupt_header(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        upload = SimpleUploadedFile(
+            "broken.png", b"\x89PNG\r\n\x1a\n" + b"\x00" * 32, content_type="image/png"
+        )
+        self.assert_rejected_before_storage(upload, "corrupt")
+
+    def test_upload_truncated_body(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        self.assert_rejected_before_storage(truncated_image("cut.jpg"), "corrupt")
+        self.assertFalse(Blob.objects.exists())
+
+    def test_upload_decompression_bomb(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        # A PNG header claiming 100000x100000 pixels, without any pixel data.
+        ihdr = b"IHDR" + struct.pack(">IIBBBBB", 100000, 100000, 8, 2, 0, 0, 0)
+        header = (
+            b"\x89PNG\r\n\x1a\n"
+            + struct.pack(">I", 13)
+            + ihdr
+            + struct.pack(">I", zlib.crc32(ihdr))
+            + struct.pack(">I", 0)
+            + b"IDAT"
+            + struct.pack(">I", zlib.crc32(b"IDAT"))
+        )
+        upload = SimpleUploadedFile("bomb.png", header, content_type="image/png")
+        self.assert_rejected_before_storage(upload, "pixels")
+
+    def test_upload_role_limits(self):
+        self.client.login(username=self.premium_user.username, password="testpass123")
+        # The rollback after the test doesn't send the signals dropping the policies.
+        self.addCleanup(invalidate_role_policies)
+        role = self.premium_user.role
+        role.max_megapixels = 1
+        role.save()
+        upload = uploaded_image("big.jpg", size=(1200, 900))
+        self.assert_rejected_before_storage(upload, "megapixels")
+
+        role.max_megapixels = None
+        role.max_upload_size = 100
+        role.save()
+        upload.seek(0)
+        self.assert_rejected_before_storage(upload, "bytes")
 
     def test_post_image_enterprise_user(self):
         self.client.login(
@@ -102,3 +417,1111 @@ class APITestCase(APITestCase):
 
     def test_post_not_image(self):
         pass
+
+
+def uploaded_image(name, size=(120, 80), color=(0, 0, 0), image_format="jpeg"):
+    """Returns an in-memory upload of a plain image."""
+    output = BytesIO()
+    PILImage.new("RGB", size, color=color).save(output, image_format)
+    return SimpleUploadedFile(
+        name, output.getvalue(), content_type=f"image/{image_format}"
+    )
+
+
+def truncated_image(name):
+    """Returns an upload of a JPEG with a valid header and only half its body."""
+    content = uploaded_image(name, size=(600, 400), color=(0, 128, 255)).read()
+    return SimpleUploadedFile(
+        name, content[: len(content) // 2], content_type="image/jpeg"
+    )
+
+
+def create_user(username, role_name):
+    """Creates a user with the password 'testpass123' and the named role."""
+    return get_user_model().objects.create_user(
+        username=username,
+        password="testpass123",
+        role=Role.objects.get(name=role_name),
+    )
+
+
+class ImagePreviewTests(BaseAPITestCase):
+    """
+    Test cases for the image, thumbnail and expiring link preview views and
+    the thumbnail creation they serve.
+    """
+
+    def setUp(self):
+        use_shared_resolver_cache(self)
+        self.user = create_user("preview_user", "Enterprise")
+        self.image = Image.objects.create(
+            owner=self.user,
+            image_file=uploaded_image("preview.jpg"),
+            file_name="preview_preview_user.jpg",
+        )
+        self.image_bytes = self.image.image_file.read()
+        self.image = Image.objects.get(pk=self.image.pk)
+
+    def test_image_preview_is_streamed(self):
+        response = self.client.get(self.image.get_absolute_url())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(int(response["Content-Length"]), len(self.image_bytes))
+        self.assertEqual(b"".join(response.streaming_content), self.image_bytes)
+
+    @override_settings(IMAGES_SENDFILE_BACKEND="nginx")
+    def test_image_preview_offloaded_to_nginx(self):
+        response = self.client.get(self.image.get_absolute_url())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            f"/protected-media/{self.image.image_file.name}",
+        )
+
+    @override_settings(IMAGES_SENDFILE_BACKEND="xsendfile")
+    def test_image_preview_offloaded_with_xsendfile(self):
+        response = self.client.get(self.image.get_absolute_url())
+        self.assertEqual(response["X-Sendfile"], self.image.image_file.path)
+
+    @override_settings(IMAGES_SENDFILE_BACKEND="nginx")
+    def test_serve_file_streams_when_offload_disabled(self):
+        response = serve_file(
+            RequestFactory().get("/"),
+            self.image.image_file,
+            "image/jpeg",
+            chunk_size=100,
+            offload=False,
+        )
+        chunks = list(response.streaming_content)
+        self.assertNotIn("X-Accel-Redirect", response)
+        self.assertEqual(len(chunks[0]), 100)
+        self.assertEqual(b"".join(chunks), self.image_bytes)
+
+    def test_thumbnail_preview_by_token(self):
+        thumbnail = create_thumbnail(self.image, 40)
+        response = self.client.get(f"/api/v1/tmb/{thumbnail.token}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            ThumbnailSerializer(thumbnail).data["url"],
+            f"/api/v1/tmb/{thumbnail.token}",
+        )
+
+    def test_thumbnail_format_negotiation(self):
+        thumbnail = create_thumbnail(self.image, 40)
+        self.assertEqual(thumbnail.formats, ["jpeg", "webp"])
+        url = thumbnail.get_absolute_url()
+        for accept, content_type in [
+            ("image/avif,image/webp,*/*", "image/webp"),
+            ("*/*", "image/jpeg"),
+            ("image/webp;q=0, image/jpeg", "image/jpeg"),
+            ("", "image/jpeg"),
+        ]:
+            response = self.client.get(url, HTTP_ACCEPT=accept)
+            self.assertEqual(response["Content-Type"], content_type, accept)
+            self.assertEqual(response["Vary"], "Accept")
+        webp = self.client.get(url, HTTP_ACCEPT="image/webp")
+        jpeg = self.client.get(url)
+        self.assertNotEqual(webp["ETag"], jpeg["ETag"])
+        with PILImage.open(BytesIO(webp.content)) as img:
+            self.assertEqual((img.format, img.height), ("WEBP", 40))
+
+    @override_settings(IMAGES_THUMBNAIL_FORMATS=[])
+    def test_thumbnail_without_variants_sent_as_jpeg(self):
+        thumbnail = create_thumbnail(self.image, 40)
+        response = self.client.get(
+            thumbnail.get_absolute_url(), HTTP_ACCEPT="image/webp"
+        )
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_png_original_served_as_png(self):
+        image = Image.objects.create(
+            owner=self.user,
+            image_file=uploaded_image("preview.png", (20, 20), image_format="png"),
+            file_name="preview_preview_user.png",
+        )
+        response = self.client.get(image.get_absolute_url())
+        self.assertEqual(response["Content-Type"], "image/png")
+
+    def test_unknown_token_returns_404(self):
+        response = self.client.get(reverse("image_preview", args=["missing"]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_preview_tokens_resolved_without_queries(self):
+        thumbnail = create_thumbnail(self.image, 40)
+        urls = [self.image.get_absolute_url(), thumbnail.get_absolute_url()]
+        for url in urls:
+            self.client.get(url)
+        with self.assertNumQueries(0), override_settings(IMAGES_THUMBNAIL_CACHE=None):
+            for url in urls:
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_unknown_token_cached(self):
+        url = reverse("thumbnail_preview", args=["unknown"])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deleted_image_token_not_resolved(self):
+        thumbnail = create_thumbnail(self.image, 40)
+        urls = [self.image.get_absolute_url(), thumbnail.get_absolute_url()]
+        for url in urls:
+            self.client.get(url)
+        self.image.delete()
+        for url in urls:
+            self.assertEqual(
+                self.client.get(url).status_code, status.HTTP_404_NOT_FOUND
+            )
+
+    def test_missing_file_returns_404_and_is_forgotten(self):
+        thumbnail = create_thumbnail(self.image, 40)
+        urls = [self.image.get_absolute_url(), thumbnail.get_absolute_url()]
+        with override_settings(IMAGES_THUMBNAIL_CACHE=None):
+            for url in urls:
+                self.client.get(url)
+            # Deleted by another worker, whose invalidation this one didn't see.
+            for field_file in (self.image.image_file, thumbnail.thumbnail_file):
+                field_file.storage.delete(field_file.name)
+            for url in urls:
+                self.assertEqual(
+                    self.client.get(url).status_code, status.HTTP_404_NOT_FOUND
+                )
+        cache = caches["resolver"]
+        self.assertIsNone(cache.get(f"images:image-token:{self.image.token}"))
+        self.assertIsNone(cache.get(f"images:thumbnail-variants:{thumbnail.token}"))
+
+    @override_settings(IMAGES_RESOLVER_CACHE="default")
+    def test_per_process_resolver_cache_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get(self.image.get_absolute_url())
+
+    @override_settings(IMAGES_RESOLVER_CACHE=None)
+    def test_previews_without_resolver_cache(self):
+        self.assertEqual(
+            self.client.get(self.image.get_absolute_url()).status_code,
+            status.HTTP_200_OK,
+        )
+
+    def test_image_preview_cache_headers(self):
+        response = self.client.get(self.image.get_absolute_url())
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+
+    def test_image_preview_not_modified(self):
+        etag = self.client.get(self.image.get_absolute_url())["ETag"]
+        with mock.patch.object(FieldFile, "open") as open_file:
+            response = self.client.get(
+                self.image.get_absolute_url(), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        open_file.assert_not_called()
+
+    def test_expiring_link_max_age_capped_by_expire_time(self):
+        expiring = ExpiringImage.objects.create(
+            image=self.image, expire_time=datetime.now() + timedelta(seconds=600)
+        )
+        response = self.client.get(expiring.get_absolute_url())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        max_age = int(response["Cache-Control"].split("max-age=")[1].split(",")[0])
+        self.assertLessEqual(max_age, 600)
+        self.assertGreater(max_age, 590)
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    def test_expired_link_is_gone_but_not_deleted_on_read(self):
+        expiring = ExpiringImage.objects.create(
+            image=self.image, expire_time=datetime.now() - timedelta(seconds=1)
+        )
+        response = self.client.get(expiring.get_absolute_url())
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertTrue(ExpiringImage.objects.filter(pk=expiring.pk).exists())
+
+    def test_reaper_deletes_expired_links_in_batches(self):
+        now = datetime.now()
+        for seconds in (-30, -20, -10, 600):
+            ExpiringImage.objects.create(
+                image=self.image, expire_time=now + timedelta(seconds=seconds)
+            )
+        output = io.StringIO()
+        call_command("reap_expiring_images", "--batch-size", "2", stdout=output)
+        self.assertIn("Deleted 3 expired links in 2 batches", output.getvalue())
+        self.assertEqual(ExpiringImage.objects.count(), 1)
+
+    def test_image_preview_single_range(self):
+        response = self.client.get(
+            self.image.get_absolute_url(), HTTP_RANGE="bytes=10-109"
+        )
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(
+            response["Content-Range"], f"bytes 10-109/{len(self.image_bytes)}"
+        )
+        self.assertEqual(int(response["Content-Length"]), 100)
+        self.assertEqual(b"".join(response.streaming_content), self.image_bytes[10:110])
+
+    def test_image_preview_multiple_ranges(self):
+        response = self.client.get(
+            self.image.get_absolute_url(), HTTP_RANGE="bytes=0-9,-20"
+        )
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(response["Content-Type"].startswith("multipart/byteranges"))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(int(response["Content-Length"]), len(body))
+        self.assertIn(self.image_bytes[:10], body)
+        self.assertIn(self.image_bytes[-20:], body)
+
+    def test_image_preview_unsatisfiable_range(self):
+        response = self.client.get(
+            self.image.get_absolute_url(), HTTP_RANGE="bytes=999999-"
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.image_bytes)}")
+
+    def test_image_preview_malformed_range_sends_full_file(self):
+        for header in ["bytes=abc-5", "bytes=0-x", "bytes=-", "bytes=1-2,a-"]:
+            response = self.client.get(self.image.get_absolute_url(), HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, header)
+            self.assertEqual(b"".join(response.streaming_content), self.image_bytes)
+
+    def test_image_preview_if_range_mismatch_sends_full_file(self):
+        response = self.client.get(
+            self.image.get_absolute_url(),
+            HTTP_RANGE="bytes=0-9",
+            HTTP_IF_RANGE='"outdated"',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.image_bytes)
+
+    def test_expiring_link_range(self):
+        expiring = ExpiringImage.objects.create(
+            image=self.image, expire_time=datetime.now() + timedelta(seconds=600)
+        )
+        response = self.client.get(expiring.get_absolute_url(), HTTP_RANGE="bytes=5-")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), self.image_bytes[5:])
+
+    def test_thumbnail_upright_and_exif_stripped(self):
+        exif = PILImage.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees, displayed 80x120.
+        output = BytesIO()
+        PILImage.new("RGB", (120, 80)).save(output, "jpeg", exif=exif.tobytes())
+        rendered = render_thumbnails(BytesIO(output.getvalue()), [60])[60].files["jpeg"]
+        with PILImage.open(BytesIO(rendered)) as img:
+            self.assertEqual(img.size, (40, 60))
+            self.assertNotIn("exif", img.info)
+
+    def test_jpeg_profile_options(self):
+        output = BytesIO()
+        PILImage.effect_noise((120, 80), 40).convert("RGB").save(output, "jpeg")
+        rendered = {}
+        for name in ("default", "high"):
+            rendered[name] = render_thumbnails(
+                BytesIO(output.getvalue()), [60], profile=jpeg_profile(name)
+            )[60].files["jpeg"]
+        with PILImage.open(BytesIO(rendered["default"])) as img:
+            self.assertTrue(img.info.get("progressive"))
+        self.assertGreater(len(rendered["high"]), len(rendered["default"]))
+        with self.assertRaises(ImproperlyConfigured):
+            jpeg_profile("missing")
+
+    def test_metadata_backfill(self):
+        thumbnail = create_thumbnail(self.image, 40)
+        Image.objects.filter(pk=self.image.pk).update(width=None, content_hash="")
+        Thumbnail.objects.filter(pk=thumbnail.pk).update(
+            width=None, rendered_height=None, content_hash=""
+        )
+        output = io.StringIO()
+        call_command("backfill_image_metadata", "--workers", "1", stdout=output)
+        self.assertIn("Backfilled 1 images and 1 thumbnails", output.getvalue())
+        image = Image.objects.get(pk=self.image.pk)
+        self.assertEqual((image.width, image.height, image.format), (120, 80, "jpeg"))
+        self.assertEqual(image.byte_size, len(self.image_bytes))
+        self.assertEqual(
+            image.content_hash, hashlib.sha256(self.image_bytes).hexdigest()
+        )
+        thumbnail = Thumbnail.objects.get(pk=thumbnail.pk)
+        self.assertEqual((thumbnail.width, thumbnail.rendered_height), (60, 40))
+
+    def test_thumbnail_taller_than_original_keeps_rendered_size(self):
+        thumbnails = create_thumbnails(self.image, [40, 200])
+        self.assertEqual(
+            [(t.height, t.width, t.rendered_height) for t in thumbnails],
+            [(40, 60, 40), (200, 120, 80)],
+        )
+        self.assertEqual(
+            thumbnail_metadata(thumbnails)["200px"],
+            {"width": 120, "height": 80, "byte_size": thumbnails[1].byte_size},
+        )
+
+    def test_create_thumbnails_decodes_once_and_inserts_once(self):
+        with mock.patch(
+            "images.utils.PILImage.open", wraps=PILImage.open
+        ) as open_image, self.assertNumQueries(1):
+            thumbnails = create_thumbnails(self.image, [20, 60, 40])
+        open_image.assert_called_once()
+        self.assertEqual([thumbnail.height for thumbnail in thumbnails], [20, 60, 40])
+        self.assertTrue(all(thumbnail.pk for thumbnail in thumbnails))
+
+    @override_settings(IMAGES_THUMBNAIL_WORKERS=2, IMAGES_THUMBNAIL_EXECUTOR="thread")
+    def test_create_thumbnails_on_worker_pool(self):
+        second = Image.objects.create(
+            owner=self.user,
+            image_file=uploaded_image("second.jpg", size=(90, 300)),
+            file_name="second_preview_user.jpg",
+        )
+        with mock.patch(
+            "images.utils.render_thumbnails", wraps=render_thumbnails
+        ) as render:
+            result = create_thumbnails_batch([(self.image, [40, 20]), (second, [60])])
+        self.assertEqual(render.call_count, 3)
+        self.assertEqual(render.call_args_list[0].args[0], self.image.image_file.path)
+        self.assertEqual([t.height for t in result[self.image.pk]], [40, 20])
+        with PILImage.open(result[second.pk][0].thumbnail_file) as img:
+            self.assertEqual(img.size, (18, 60))
+
+    def test_create_thumbnails_on_explicit_pool(self):
+        executor = make_executor(2, "thread")
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(executor, "submit", wraps=executor.submit) as submit:
+            result = create_thumbnails_batch([(self.image, [40])], executor=executor)
+        submit.assert_called_once()
+        self.assertEqual(result[self.image.pk][0].rendered_height, 40)
+        with self.assertRaises(ImproperlyConfigured):
+            make_executor(2, "fiber")
+
+    def test_failed_insert_deletes_stored_thumbnails(self):
+        storage = Thumbnail._meta.get_field("thumbnail_file").storage
+        with mock.patch.object(
+            Thumbnail.objects, "bulk_create", side_effect=RuntimeError
+        ), mock.patch.object(storage, "delete", wraps=storage.delete) as delete:
+            with self.assertRaises(RuntimeError):
+                create_thumbnails_batch([(self.image, [40, 20])])
+        deleted = [call.args[0] for call in delete.call_args_list]
+        self.assertEqual(len(deleted), 2 * len(thumbnail_formats()))
+        self.assertFalse(any(storage.exists(name) for name in deleted))
+
+
+@override_settings(IMAGES_THUMBNAIL_CACHE={"BACKEND": "local"})
+class ThumbnailCacheTests(BaseAPITestCase):
+    """
+    Test cases for serving thumbnails from the byte cache.
+    """
+
+    def setUp(self):
+        self.user = create_user("cache_user", "Enterprise")
+        self.image = Image.objects.create(
+            owner=self.user,
+            image_file=uploaded_image("cache.jpg"),
+            file_name="cache_cache_user.jpg",
+        )
+        self.thumbnail = create_thumbnail(self.image, 40)
+        self.thumbnail_bytes = self.thumbnail.thumbnail_file.read()
+        self.url = self.thumbnail.get_absolute_url()
+
+    def test_hot_thumbnail_served_without_queries(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0), mock.patch.object(
+            FieldFile, "open"
+        ) as open_file:
+            second = self.client.get(self.url)
+        open_file.assert_not_called()
+        self.assertEqual(second.content, self.thumbnail_bytes)
+        for header in ("ETag", "Last-Modified", "Cache-Control", "Content-Type"):
+            self.assertEqual(second[header], first[header])
+        stats = get_thumbnail_cache().stats()
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertGreaterEqual(stats["misses"], 1)
+
+    def test_cached_thumbnail_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_deleted_thumbnail_dropped_from_cache(self):
+        self.client.get(self.url)
+        self.thumbnail.delete()
+        self.assertIsNone(
+            get_thumbnail_cache().get(thumbnail_cache_key(self.thumbnail.token, "jpeg"))
+        )
+
+    @override_settings(
+        IMAGES_THUMBNAIL_CACHE={"BACKEND": "local", "MAX_ENTRY_BYTES": 10}
+    )
+    def test_big_thumbnail_streamed_not_cached(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertIsNone(
+            get_thumbnail_cache().get(thumbnail_cache_key(self.thumbnail.token, "jpeg"))
+        )
+
+    @override_settings(IMAGES_THUMBNAIL_CACHE={"BACKEND": "django", "ALIAS": "default"})
+    def test_django_backend(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.content, self.thumbnail_bytes)
+
+    def test_lru_eviction_within_budget(self):
+        cache = LocalThumbnailCache(max_bytes=10, max_entry_bytes=10)
+        for key in "abc":
+            cache.set(key, CachedFile(b"x" * 4, "image/jpeg", '"etag"', None))
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+        cache.set("d", CachedFile(b"x" * 4, "image/jpeg", '"etag"', None))
+        self.assertIsNone(cache.get("c"))
+        self.assertIsNotNone(cache.get("b"))
+        self.assertFalse(cache.set("e", CachedFile(b"x" * 11, "", "", None)))
+        stats = cache.stats()
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(stats["bytes"], 8)
+        self.assertEqual(stats["rejected"], 1)
+
+    def test_local_entries_expire(self):
+        cache = LocalThumbnailCache(timeout=60)
+        with mock.patch("images.cache.time.monotonic", return_value=1000):
+            cache.set("a", CachedFile(b"x" * 4, "image/jpeg", '"etag"', None))
+        with mock.patch("images.cache.time.monotonic", return_value=1059):
+            self.assertIsNotNone(cache.get("a"))
+        with mock.patch("images.cache.time.monotonic", return_value=1060):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_stats_endpoint_staff_only(self):
+        url = reverse("thumbnail_cache_stats")
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["backend"], "LocalThumbnailCache")
+
+
+class AsyncPreviewTests(BaseAPITestCase):
+    """Test cases for the async preview views used under ASGI."""
+
+    def setUp(self):
+        self.user = create_user("async_user", "Enterprise")
+        self.image = Image.objects.create(
+            owner=self.user,
+            image_file=uploaded_image("async.jpg"),
+            file_name="async_async_user.jpg",
+        )
+        self.image_bytes = self.image.image_file.read()
+        self.image = Image.objects.get(pk=self.image.pk)
+        self.thumbnail = create_thumbnail(self.image, 40)
+        self.factory = AsyncRequestFactory()
+
+    @staticmethod
+    async def read_body(response):
+        return b"".join([chunk async for chunk in response])
+
+    async def test_image_streamed_with_async_iterator(self):
+        request = self.factory.get("/")
+        response = await async_image_preview_view(request, self.image.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        self.assertEqual(int(response["Content-Length"]), len(self.image_bytes))
+        self.assertEqual(await self.read_body(response), self.image_bytes)
+
+    async def test_image_range(self):
+        request = self.factory.get("/", headers={"Range": "bytes=10-19"})
+        response = await async_image_preview_view(request, self.image.token)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(await self.read_body(response), self.image_bytes[10:20])
+
+    async def test_thumbnail(self):
+        request = self.factory.get("/")
+        response = await async_thumbnail_preview_view(request, self.thumbnail.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        with self.assertRaises(Http404):
+            await async_thumbnail_preview_view(request, "missing")
+
+    async def test_expired_link_gone(self):
+        expiring = await ExpiringImage.objects.acreate(
+            image=self.image, expire_time=datetime.now() - timedelta(seconds=1)
+        )
+        response = await async_expire_image_preview_view(
+            self.factory.get("/"), expiring.token
+        )
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+
+class UploadSessionTests(BaseAPITestCase):
+    """
+    Test cases for the chunked upload sessions.
+    """
+
+    def setUp(self):
+        staging_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(staging_dir.cleanup)
+        settings_override = override_settings(
+            IMAGES_UPLOAD_CHUNK_SIZE=1024, IMAGES_UPLOAD_STAGING_DIR=staging_dir.name
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = create_user("chunk_user", "Premium")
+        self.client.login(username="chunk_user", password="testpass123")
+        output = BytesIO()
+        PILImage.effect_noise((300, 200), 64).convert("RGB").save(output, "jpeg")
+        self.content = output.getvalue()
+        self.chunks = [
+            self.content[start : start + 1024]
+            for start in range(0, len(self.content), 1024)
+        ]
+
+    def create_session(self):
+        response = self.client.post(
+            reverse("upload_sessions"),
+            {"file_name": "chunked.jpg", "size": len(self.content)},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def put_chunk(self, token, number, data=None, checksum=None):
+        data = self.chunks[number] if data is None else data
+        return self.client.put(
+            reverse("upload_chunk", args=[token, number]),
+            data,
+            content_type="application/octet-stream",
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(data).hexdigest(),
+        )
+
+    def test_chunked_upload_resumed_and_finalized(self):
+        session = self.create_session()
+        self.assertEqual(session["chunk_count"], len(self.chunks))
+        self.assertGreater(len(self.chunks), 2)
+        token = session["token"]
+
+        # Chunks arrive in any order; the upload is interrupted before the first.
+        for number in reversed(range(1, len(self.chunks))):
+            self.assertEqual(self.put_chunk(token, number).status_code, 200)
+        response = self.client.post(reverse("finalize_upload_session", args=[token]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["missing_chunks"], [0])
+
+        resumed = self.client.get(reverse("upload_session", args=[token])).data
+        self.assertEqual(resumed["missing_chunks"], [0])
+        self.put_chunk(token, 0)
+        response = self.client.post(
+            reverse("finalize_upload_session", args=[token]),
+            {"sha256": hashlib.sha256(self.content).hexdigest()},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("400px_thumbnail", response.data)
+
+        image = Image.objects.get(owner=self.user)
+        self.assertEqual(image.file_name, "chunked_chunk_user.jpg")
+        self.assertEqual(image.image_file.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.listdir(settings.IMAGES_UPLOAD_STAGING_DIR))
+
+    def put_all_chunks(self, token):
+        for number in range(len(self.chunks)):
+            self.assertEqual(self.put_chunk(token, number).status_code, 200)
+
+    def test_failed_finalize_keeps_chunks(self):
+        taken = Image.objects.create(
+            owner=self.user, image_file="taken.jpg", file_name="chunked.jpg"
+        )
+        token = self.create_session()["token"]
+        self.put_all_chunks(token)
+        response = self.client.post(reverse("finalize_upload_session", args=[token]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(UploadChunk.objects.count(), len(self.chunks))
+
+        taken.delete()
+        response = self.client.post(reverse("finalize_upload_session", args=[token]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_checksum_mismatch_ends_session(self):
+        token = self.create_session()["token"]
+        self.put_all_chunks(token)
+        response = self.client.post(
+            reverse("finalize_upload_session", args=[token]), {"sha256": "0" * 64}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.listdir(settings.IMAGES_UPLOAD_STAGING_DIR))
+
+    def test_expired_sessions_reaped(self):
+        expired, active = self.create_session()["token"], self.create_session()["token"]
+        for token in (expired, active):
+            self.put_chunk(token, 0)
+        UploadSession.objects.filter(token=expired).update(
+            expires=datetime.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(self.put_chunk(expired, 1).status_code, 404)
+        staging_dir = settings.IMAGES_UPLOAD_STAGING_DIR
+        orphan = os.path.join(staging_dir, "orphan")
+        with open(orphan, "wb") as file:
+            file.write(b"x")
+        # Old staging files of sessions that didn't expire are kept.
+        long_ago = time.time() - 2 * 24 * 60 * 60
+        for name in ("orphan", active):
+            os.utime(os.path.join(staging_dir, name), (long_ago, long_ago))
+
+        output = io.StringIO()
+        call_command("reap_upload_sessions", stdout=output)
+        self.assertIn(
+            "Deleted 1 expired upload sessions and 1 orphaned staging files",
+            output.getvalue(),
+        )
+        self.assertEqual(
+            list(UploadSession.objects.values_list("token", flat=True)), [active]
+        )
+        self.assertEqual(os.listdir(staging_dir), [active])
+
+    def test_bad_chunks_rejected(self):
+        token = self.create_session()["token"]
+        response = self.put_chunk(token, 0, checksum="0" * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.put_chunk(token, 0, data=self.chunks[0][:10])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.put_chunk(token, len(self.chunks), data=b"x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadChunk.objects.exists())
+
+    def test_session_size_limited_by_role(self):
+        response = self.client.post(
+            reverse("upload_sessions"),
+            {"file_name": "huge.jpg", "size": 10**12},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sessions_of_other_users_not_found(self):
+        token = self.create_session()["token"]
+        create_user("other_user", "Premium")
+        self.client.login(username="other_user", password="testpass123")
+        self.assertEqual(self.put_chunk(token, 0).status_code, 404)
+        response = self.client.delete(reverse("upload_session", args=[token]))
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryBudgetTests(BaseAPITestCase):
+    """Test cases pinning the number of queries of the listing and detail views."""
+
+    def setUp(self):
+        self.user = create_user("premium_user", "Premium")
+        self.client.login(username="premium_user", password="testpass123")
+        invalidate_role_policies()
+        get_role_policy(self.user.role_id)
+
+    def create_images(self, count):
+        images = []
+        for number in range(count):
+            image_file = uploaded_image(f"{number}.jpg", size=(60, 40))
+            image = Image.objects.create(
+                owner=self.user,
+                image_file=image_file,
+                file_name=f"{number}_premium_user.jpg",
+                **file_metadata(image_file),
+            )
+            create_thumbnails(image, [10, 20])
+            images.append(image)
+        return images
+
+    def test_list_query_count_does_not_grow_with_images(self):
+        # session, user, images, thumbnails
+        self.create_images(1)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("images"))
+        self.assertEqual(len(response.data["results"]), 1)
+
+        self.create_images(5)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("images"))
+        self.assertEqual(len(response.data["results"]), 6)
+        self.assertEqual(len(response.data["results"][0]["thumbnails"]), 2)
+
+    def test_list_and_detail_include_metadata(self):
+        image = self.create_images(1)[0]
+        entry = self.client.get(reverse("images")).data["results"][0]
+        detail = self.client.get(reverse("image", args=[image.pk])).data
+        for data in (entry, detail):
+            self.assertEqual((data["width"], data["height"]), (60, 40))
+            self.assertEqual(data["format"], "jpeg")
+            self.assertEqual(data["content_hash"], image.content_hash)
+            self.assertEqual(data["thumbnail_metadata"]["20px"]["width"], 30)
+            self.assertEqual(data["thumbnail_metadata"]["20px"]["height"], 20)
+
+    def test_legacy_list_query_count(self):
+        self.create_images(3)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("images"), {"legacy": "true"})
+        self.assertEqual(list(response.data), ["image1", "image2", "image3"])
+
+    def test_list_pages_follow_cursor(self):
+        images = self.create_images(5)
+        # Same upload date for some images, order must fall back to the ID.
+        Image.objects.filter(pk__in=[images[1].pk, images[2].pk]).update(
+            upload_date=images[1].upload_date
+        )
+        seen = []
+        url = reverse("images") + "?page_size=2"
+        while url:
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            seen.extend(item["image_id"] for item in response.data["results"])
+            url = response.data["next"]
+        expected = Image.objects.order_by("-upload_date", "-pk").values_list(
+            "pk", flat=True
+        )
+        self.assertEqual(seen, list(expected))
+
+    def test_list_invalid_cursor(self):
+        response = self.client.get(reverse("images"), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_detail_query_count(self):
+        # session, user, image, thumbnails, thumbnail jobs
+        image = self.create_images(1)[0]
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("image", args=[image.pk]))
+        self.assertEqual(len(response.data["thumbnails"]), 2)
+
+
+class ImportImagesTests(BaseAPITestCase):
+    """
+    Test cases for the 'import_images' management command.
+    """
+
+    def setUp(self):
+        self.user = create_user("import_user", "Premium")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        os.makedirs(os.path.join(self.directory, "2023", "summer"))
+        for path, color in [
+            ("a.jpg", (255, 0, 0)),
+            ("2023/b.png", (0, 255, 0)),
+            ("2023/summer/a_copy.JPG", (255, 0, 0)),
+        ]:
+            PILImage.new("RGB", (600, 400), color=color).save(
+                os.path.join(self.directory, path),
+                "jpeg" if path.lower().endswith(".jpg") else "png",
+            )
+        with open(os.path.join(self.directory, "2023", "broken.jpg"), "wb") as file:
+            file.write(b"not an image")
+        with open(os.path.join(self.directory, "notes.txt"), "w") as file:
+            file.write("not imported")
+
+    def import_images(self):
+        output, errors = io.StringIO(), io.StringIO()
+        call_command(
+            "import_images",
+            self.directory,
+            "--owner",
+            "import_user",
+            "--workers",
+            "1",
+            "--batch-size",
+            "2",
+            stdout=output,
+            stderr=errors,
+        )
+        return output.getvalue(), errors.getvalue()
+
+    def test_import_directory_tree(self):
+        output, errors = self.import_images()
+        self.assertIn("Imported 2 images (1 already imported, 1 rejected)", output)
+        self.assertIn("images/s", output)
+        self.assertIn("broken.jpg", errors)
+        images = Image.objects.filter(owner=self.user)
+        self.assertEqual(
+            sorted(images.values_list("file_name", "format")),
+            [("a_import_user.jpg", "jpeg"), ("b_import_user.png", "png")],
+        )
+        for image in images:
+            self.assertEqual(
+                sorted(image.thumbnails.values_list("height", flat=True)), [200, 400]
+            )
+
+    def test_import_resumed_skips_imported_files(self):
+        self.import_images()
+        os.remove(os.path.join(self.directory, "a.jpg"))
+        PILImage.new("RGB", (60, 40)).save(os.path.join(self.directory, "c.jpg"))
+        output, _ = self.import_images()
+        self.assertIn("Imported 1 images (2 already imported, 1 rejected)", output)
+        self.assertEqual(Image.objects.filter(owner=self.user).count(), 3)
+
+    def test_truncated_file_rejected_rest_imported(self):
+        with open(os.path.join(self.directory, "2023", "cut.jpg"), "wb") as file:
+            file.write(truncated_image("cut.jpg").read())
+        output, errors = self.import_images()
+        self.assertIn("Imported 2 images (1 already imported, 2 rejected)", output)
+        self.assertIn("cut.jpg", errors)
+        self.assertEqual(Image.objects.filter(owner=self.user).count(), 2)
+        self.assertFalse(Image.objects.filter(file_name__startswith="cut").exists())
+
+        output, _ = self.import_images()
+        self.assertIn("Imported 0 images (3 already imported, 2 rejected)", output)
+
+    def test_failed_thumbnail_insert_removes_batch(self):
+        blobs = Blob._meta.get_field("file").storage.path("blobs")
+
+        def stored_files():
+            return {
+                os.path.join(root, name)
+                for root, _, names in os.walk(blobs)
+                for name in names
+            }
+
+        before = stored_files()
+        with mock.patch.object(
+            Thumbnail.objects, "bulk_create", side_effect=RuntimeError
+        ), self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            self.import_images()
+        self.assertFalse(Image.objects.filter(owner=self.user).exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(stored_files(), before)
+
+        output, _ = self.import_images()
+        self.assertIn("Imported 2 images", output)
+
+
+class OnDemandThumbnailTests(BaseAPITestCase):
+    """
+    Test cases for the thumbnails rendered on first request.
+    """
+
+    def setUp(self):
+        # The rollback after the test doesn't send the signals dropping the policies.
+        self.addCleanup(invalidate_role_policies)
+        self.user = create_user("lazy_user", "Premium")
+        self.client.login(username="lazy_user", password="testpass123")
+        self.images = []
+        for name, color in [("first.jpg", (255, 0, 0)), ("second.jpg", (0, 0, 255))]:
+            upload = uploaded_image(name, (300, 200), color)
+            response = self.client.post(
+                reverse("images"), {"image_file": upload}, format="multipart"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.images.append(Image.objects.filter(owner=self.user).latest("pk"))
+        # Heights added to the role after the upload.
+        role = self.user.role
+        role.extra_thumbnail_sizes = ",".join(
+            str(size) for size in [*role.get_extra_thumbnail_sizes(), 50, 100]
+        )
+        role.save()
+
+    def get_thumbnail(self, image, height):
+        return self.client.get(reverse("thumbnail_on_demand", args=[image.pk, height]))
+
+    def test_thumbnail_rendered_on_first_request(self):
+        response = self.get_thumbnail(self.images[0], 100)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        thumbnail = self.images[0].thumbnails.get(height=100)
+        self.assertTrue(thumbnail.on_demand)
+        self.assertIsNotNone(thumbnail.last_accessed)
+        self.assertTrue(response["Location"].endswith(thumbnail.get_absolute_url()))
+        self.assertEqual(self.client.get(response["Location"]).status_code, 200)
+
+        with mock.patch("images.utils.render_thumbnails") as render:
+            again = self.get_thumbnail(self.images[0], 100)
+            upload_time = self.get_thumbnail(self.images[0], 200)
+        render.assert_not_called()
+        self.assertEqual(again["Location"], response["Location"])
+        self.assertEqual(upload_time.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(self.images[0].thumbnails.get(height=200).on_demand)
+
+    def test_height_outside_role_rejected(self):
+        response = self.get_thumbnail(self.images[0], 150)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(self.images[0].thumbnails.filter(height=150).exists())
+
+    def test_other_users_image_rejected(self):
+        create_user("other_lazy_user", "Premium")
+        self.client.login(username="other_lazy_user", password="testpass123")
+        response = self.get_thumbnail(self.images[0], 100)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(self.images[0].thumbnails.filter(height=100).exists())
+
+    def test_least_recently_requested_thumbnails_evicted(self):
+        for image, height in [(self.images[0], 50), (self.images[1], 50)]:
+            self.get_thumbnail(image, height)
+        self.get_thumbnail(self.images[0], 100)
+        oldest = Thumbnail.objects.get(image=self.images[0], height=50)
+        Thumbnail.objects.filter(pk=oldest.pk).update(
+            last_accessed=datetime.now() - timedelta(hours=1)
+        )
+        storage = oldest.thumbnail_file.storage
+        self.assertTrue(storage.exists(oldest.thumbnail_file.name))
+        total = sum(
+            Thumbnail.objects.filter(on_demand=True).values_list("byte_size", flat=True)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(evict_on_demand_thumbnails(max_bytes=total - 1), 1)
+        self.assertEqual(
+            sorted(
+                Thumbnail.objects.filter(on_demand=True).values_list("image", "height")
+            ),
+            [(self.images[0].pk, 100), (self.images[1].pk, 50)],
+        )
+        self.assertFalse(storage.exists(oldest.thumbnail_file.name))
+        self.assertEqual(self.images[0].thumbnails.filter(on_demand=False).count(), 2)
+        self.assertEqual(evict_on_demand_thumbnails(max_bytes=total), 0)
+
+        # An evicted height is rendered again on request.
+        self.assertEqual(self.get_thumbnail(self.images[0], 50).status_code, 302)
+        self.assertTrue(self.images[0].thumbnails.filter(height=50).exists())
+
+
+class SignedExpiringLinkTests(BaseAPITestCase):
+    """Test cases for the stateless signed expiring links."""
+
+    def setUp(self):
+        use_shared_resolver_cache(self)
+        self.user = create_user("enterprise_user", "Enterprise")
+        self.client.login(username="enterprise_user", password="testpass123")
+        self.image = Image.objects.create(
+            owner=self.user,
+            image_file=uploaded_image("signed.jpg", size=(60, 40)),
+            file_name="signed_enterprise_user.jpg",
+        )
+
+    def create_link(self, **data):
+        url = reverse("create_expire_image", args=[self.image.pk])
+        response = self.client.post(url, {"time_to_expire": 300, **data})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["expiring_url"]
+
+    def test_revocable_link_by_default(self):
+        url = self.create_link()
+        self.assertIn("/api/v1/exp/", url)
+        self.assertNotIn("/exp/s/", url)
+        self.assertEqual(ExpiringImage.objects.count(), 1)
+
+    def test_signed_link_served_without_queries(self):
+        url = self.create_link(revocable="false")
+        self.assertIn("/api/v1/exp/s/", url)
+        self.assertEqual(ExpiringImage.objects.count(), 0)
+        self.client.logout()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(
+            int(response["Cache-Control"].split("max-age=")[1].split(",")[0]), 300
+        )
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(IMAGES_SIGNED_EXPIRING_LINKS=True)
+    def test_signed_links_setting(self):
+        self.assertIn("/exp/s/", self.create_link())
+
+    def test_expired_signed_link(self):
+        token = make_signed_token(self.image.pk, int(time.time()) - 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse("signed_expire_image_view", args=[token])
+            )
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_tampered_signed_link(self):
+        token = make_signed_token(self.image.pk, int(time.time()) + 300)
+        signature = token.split(":")[1]
+        forged = make_signed_token(self.image.pk, int(time.time()) + 9999)
+        forged = f"{forged.split(':')[0]}:{signature}"
+        response = self.client.get(reverse("signed_expire_image_view", args=[forged]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_signed_link_of_deleted_image(self):
+        url = self.create_link(revocable="false")
+        self.client.get(url)
+        self.image.delete()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_signed_link_of_missing_file_is_forgotten(self):
+        url = self.create_link(revocable="false")
+        self.client.get(url)
+        storage = self.image.image_file.storage
+        storage.delete(self.image.image_file.name)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(caches["resolver"].get(f"images:image:{self.image.pk}"))
+
+
+@override_settings(IMAGES_ASYNC_THUMBNAILS=True)
+class ThumbnailJobTests(BaseAPITestCase):
+    """Test cases for generating thumbnails in the background."""
+
+    def setUp(self):
+        self.user = create_user("premium_user", "Premium")
+        self.client.login(username="premium_user", password="testpass123")
+
+    def upload(self):
+        upload = uploaded_image("queued.jpg", size=(600, 450))
+        return self.client.post(
+            reverse("images"), {"image_file": upload}, format="multipart"
+        )
+
+    def test_upload_returns_202_and_worker_creates_thumbnails(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        image_id = response.data["image_id"]
+        self.assertEqual(
+            response.data["thumbnails"], {"200px": "pending", "400px": "pending"}
+        )
+        self.assertFalse(Thumbnail.objects.filter(image_id=image_id).exists())
+
+        call_command("process_thumbnail_jobs", "--once", stdout=io.StringIO())
+
+        response = self.client.get(reverse("image", args=[image_id]))
+        self.assertEqual(
+            response.data["thumbnail_status"], {"200px": "ready", "400px": "ready"}
+        )
+        self.assertEqual(len(response.data["thumbnails"]), 2)
+
+    def test_expired_lease_is_claimed_again(self):
+        image_id = self.upload().data["image_id"]
+        crashed = claim_job("crashed-worker")
+        self.assertIsNone(claim_job("other-worker"))
+        ThumbnailJob.objects.filter(pk=crashed.pk).update(
+            lease_expires=datetime.now() - timedelta(seconds=1)
+        )
+        job = claim_job("other-worker")
+        self.assertEqual(job.pk, crashed.pk)
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(run_job(job))
+        self.assertEqual(Thumbnail.objects.filter(image_id=image_id).count(), 2)
+
+    def test_worker_with_expired_lease_records_nothing(self):
+        image_id = self.upload().data["image_id"]
+        stale = claim_job("slow-worker")
+        ThumbnailJob.objects.filter(pk=stale.pk).update(
+            lease_expires=datetime.now() - timedelta(seconds=1)
+        )
+        job = claim_job("other-worker")
+        self.assertFalse(run_job(stale))
+        self.assertEqual(stale.status, ThumbnailJob.RUNNING)
+        self.assertEqual(stale.worker, "other-worker")
+        with mock.patch("images.jobs.create_thumbnails") as create:
+            self.assertTrue(run_job(job))
+        create.assert_not_called()
+        self.assertEqual(Thumbnail.objects.filter(image_id=image_id).count(), 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.DONE)
+
+    @override_settings(IMAGES_THUMBNAIL_JOB_MAX_ATTEMPTS=1)
+    def test_failing_job_is_marked_failed(self):
+        image_id = self.upload().data["image_id"]
+        job = claim_job("worker")
+        with mock.patch("images.jobs.create_thumbnails", side_effect=OSError("boom")):
+            self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ThumbnailJob.FAILED)
+        self.assertIn("boom", job.last_error)
+        response = self.client.get(reverse("image", args=[image_id]))
+        self.assertEqual(response.data["thumbnail_status"]["200px"], "failed")
@@ -0,0 +1,186 @@
+"""
+Module with the staging of originals uploaded in chunks.
+
+A client creates an 'UploadSession' with the name and size of the file, then
+PUTs numbered chunks of 'chunk_size' bytes with their SHA-256 checksum in any
+order, and finally finalizes the session. Every chunk is written at its offset
+of a staging file in IMAGES_UPLOAD_STAGING_DIR as soon as it arrives, so a
+failed upload is resumed by sending only the chunks the session doesn't list,
+and no request ever holds more than one chunk. The staging file is handed to
+the regular upload pipeline on finalize and removed afterwards. Sessions that
+get no chunk for IMAGES_UPLOAD_SESSION_TTL seconds expire and are deleted with
+their staging file by 'reap_expired_sessions'.
+
+This module contains functions:
+ - upload_chunk_size: Return the chunk size of new sessions.
+ - staging_path: Return the path of the staging file of a session.
+ - write_chunk: Verify a chunk and write it to the staging file.
+ - missing_chunks: Return the numbers of the chunks not received yet.
+ - open_staged_file: Open the complete staging file as an uploaded file.
+ - discard_session: Delete a session and its staging file.
+ - reap_expired_sessions: Delete expired sessions and orphaned staging files.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import (
+    DEFAULT_UPLOAD_SESSION_TTL,
+    UploadChunk,
+    UploadSession,
+    upload_session_expiry,
+)
+
+# Chunks are read from the request body, keep them below DATA_UPLOAD_MAX_MEMORY_SIZE.
+DEFAULT_CHUNK_SIZE = 2 * 1024 * 1024
+
+
+class StagedFile(File):
+    """
+    A complete staging file, usable wherever an uploaded file is: it has the
+    client's file name and, like 'TemporaryUploadedFile', a local path.
+    """
+
+    def __init__(self, path: str, name: str):
+        super().__init__(open(path, "rb"), name=name)
+        self._path = path
+
+    def temporary_file_path(self) -> str:
+        """Return the local path of the staging file."""
+        return self._path
+
+
+def upload_chunk_size() -> int:
+    """Return the chunk size of new sessions."""
+    return getattr(settings, "IMAGES_UPLOAD_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+
+
+def _staging_dir() -> str:
+    directory = getattr(settings, "IMAGES_UPLOAD_STAGING_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "image-uploads"
+    )
+    return str(directory)
+
+
+def staging_path(session: UploadSession) -> str:
+    """Return the path of the staging file of a session."""
+    return os.path.join(_staging_dir(), session.token)
+
+
+def write_chunk(session: UploadSession, number: int, data: bytes, checksum: str):
+    """
+    Write a chunk at its offset of the staging file and record it. A chunk that
+    was already received is written again, so retries are harmless.
+
+    Args:
+        session (UploadSession): Session of the upload.
+        number (int): Number of the chunk, starting at 0.
+        data (bytes): Content of the chunk.
+        checksum (str): Hex SHA-256 of 'data' sent by the client.
+    Raises:
+        ValidationError: The number, length or checksum of the chunk is wrong.
+    """
+    if number >= session.chunk_count:
+        raise ValidationError(f"Chunk number must be lower than {session.chunk_count}.")
+    expected = min(session.chunk_size, session.size - number * session.chunk_size)
+    if len(data) != expected:
+        raise ValidationError(f"Chunk {number} must be {expected} bytes long.")
+    if hashlib.sha256(data).hexdigest() != checksum.lower():
+        raise ValidationError(f"Checksum of chunk {number} doesn't match.")
+
+    path = staging_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Chunks may arrive in parallel, each one is written at its own offset.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        os.pwrite(fd, data, number * session.chunk_size)
+    finally:
+        os.close(fd)
+    try:
+        with transaction.atomic():
+            UploadChunk.objects.create(
+                session=session, number=number, checksum=checksum
+            )
+    except IntegrityError:
+        UploadChunk.objects.filter(session=session, number=number).update(
+            checksum=checksum
+        )
+    UploadSession.objects.filter(pk=session.pk).update(expires=upload_session_expiry())
+
+
+def missing_chunks(session: UploadSession) -> List[int]:
+    """Return the numbers of the chunks that weren't received yet."""
+    received = set(session.chunks.values_list("number", flat=True))
+    return [number for number in range(session.chunk_count) if number not in received]
+
+
+def open_staged_file(session: UploadSession) -> StagedFile:
+    """Open the staging file of a session whose chunks were all received."""
+    return StagedFile(staging_path(session), session.file_name)
+
+
+def discard_session(session: UploadSession):
+    """Delete a session, its chunks and its staging file."""
+    try:
+        os.remove(staging_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
+
+
+def reap_expired_sessions(batch_size: int) -> Tuple[int, int]:
+    """
+    Delete the expired sessions with their staging files, 'batch_size' sessions
+    per statement, and the staging files of no session (e.g. deleted with their
+    owner) that weren't written to for IMAGES_UPLOAD_SESSION_TTL seconds.
+
+    Args:
+        batch_size (int): Maximum number of sessions deleted by one statement.
+    Returns:
+        Tuple with the number of deleted sessions and orphaned staging files.
+    """
+    now = datetime.now()
+    sessions = 0
+    while True:
+        batch = list(
+            UploadSession.objects.filter(expires__lt=now)
+            .order_by("expires")
+            .only("pk", "token")[:batch_size]
+        )
+        if not batch:
+            break
+        for session in batch:
+            try:
+                os.remove(staging_path(session))
+            except FileNotFoundError:
+                pass
+        UploadSession.objects.filter(pk__in=[session.pk for session in batch]).delete()
+        sessions += len(batch)
+
+    directory = _staging_dir()
+    if not os.path.isdir(directory):
+        return sessions, 0
+    ttl = getattr(settings, "IMAGES_UPLOAD_SESSION_TTL", DEFAULT_UPLOAD_SESSION_TTL)
+    stale = {
+        entry.name: entry.path
+        for entry in os.scandir(directory)
+        if entry.is_file() and entry.stat().st_mtime < time.time() - ttl
+    }
+    live = set(
+        UploadSession.objects.filter(token__in=stale).values_list("token", flat=True)
+    )
+    for token, path in stale.items():
+        if token not in live:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return sessions, len(stale.keys() - live)
@@ -1,20 +1,66 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     UserViewSet,
+    async_expire_image_preview_view,
+    async_image_preview_view,
+    async_thumbnail_preview_view,
     image_preview_view,
     thumbnail_preview_view,
     image_view,
+    thumbnail_on_demand_view,
     create_expire_image_view,
     expire_image_preview_view,
+    signed_expire_image_preview_view,
+    thumbnail_cache_stats_view,
+    batch_upload_view,
+    create_upload_session_view,
+    upload_session_view,
+    upload_chunk_view,
+    finalize_upload_session_view,
     ImageUploadView,
 )
 
+# Under an ASGI server the previews are served by the async views.
+if getattr(settings, "IMAGES_ASYNC_PREVIEWS", False):
+    image_preview_view = async_image_preview_view
+    thumbnail_preview_view = async_thumbnail_preview_view
+    expire_image_preview_view = async_expire_image_preview_view
+
 urlpatterns = [
     path("users", UserViewSet.as_view(), name="users"),
     path("img/<str:random_id>", image_preview_view, name="image_preview"),
     path("tmb/<str:random_id>", thumbnail_preview_view, name="thumbnail_preview"),
     path("images", ImageUploadView.as_view(), name="images"),
+    path("images/batch", batch_upload_view, name="batch_upload"),
     path("images/<int:id>", image_view, name="image"),
+    path(
+        "images/<int:id>/thumbnails/<int:height>",
+        thumbnail_on_demand_view,
+        name="thumbnail_on_demand",
+    ),
+    path("uploads", create_upload_session_view, name="upload_sessions"),
+    path("uploads/<str:token>", upload_session_view, name="upload_session"),
+    path(
+        "uploads/<str:token>/chunks/<int:number>",
+        upload_chunk_view,
+        name="upload_chunk",
+    ),
+    path(
+        "uploads/<str:token>/finalize",
+        finalize_upload_session_view,
+        name="finalize_upload_session",
+    ),
     path("images/<int:id>/exp", create_expire_image_view, name="create_expire_image"),
     path("exp/<str:random_id>", expire_image_preview_view, name="expire_image_view"),
+    path(
+        "exp/s/<str:token>",
+        signed_expire_image_preview_view,
+        name="signed_expire_image_view",
+    ),
+    path(
+        "stats/thumbnail-cache",
+        thumbnail_cache_stats_view,
+        name="thumbnail_cache_stats",
+    ),
 ]
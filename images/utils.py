@@ -1,13 +1,614 @@
 """
 Module for utility functions for images app.
 This module contains functions:
+ - thumbnail_formats: Return the formats thumbnails are stored in.
+ - jpeg_profile: Return the JPEG encoder settings of a profile.
+ - file_metadata: Read dimensions, format, byte size and hash of an image file.
+ - save_options: Return the 'PIL.Image.save' arguments of a thumbnail format.
+ - downscale: Downscale a decoded image to a height.
+ - render_thumbnails: Decode an image once and encode thumbnails of several heights.
+ - make_executor: Create a pool of workers rendering thumbnails.
+ - prerender_thumbnails: Render the thumbnails of uploads before their images are
+   saved, collecting the files that can't be decoded.
+ - create_thumbnails_batch: Create thumbnails for several 'Image' instances, rendering
+   them in parallel when IMAGES_THUMBNAIL_WORKERS is set.
+ - create_thumbnails: Create thumbnails of several heights from an 'Image' instance,
+   decoding the original only once.
  - create_thumbnail: Create a thumbnail image from an 'Image' instance.
 """
+import hashlib
 import io
+import shutil
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from PIL import ExifTags, ImageOps, UnidentifiedImageError
 from PIL import Image as PILImage
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile, File
+from django.db.models import F
+from django.db.models.fields.files import FieldFile
 from .models import Thumbnail, Image
 
+# Integer 'reduce()' is only used while the result stays at least this many times
+# bigger than the target, the final step is always a high quality resample.
+REDUCING_GAP = 2
+
+# Pillow format names of the formats thumbnails can be stored in.
+PIL_FORMATS = {"jpeg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+
+# Encoder settings of JPEG thumbnails, overridden by the entries of a profile in
+# IMAGES_JPEG_PROFILES. These are Pillow's own defaults.
+DEFAULT_JPEG_PROFILE = {
+    "quality": 75,
+    "optimize": False,
+    "progressive": False,
+    "subsampling": "4:2:0",
+    "strip_exif": True,
+}
+# Errors of files that can't be decoded, e.g. with a truncated body.
+DECODE_ERRORS = (UnidentifiedImageError, OSError, SyntaxError)
+# EXIF orientations that swap width and height of the stored image.
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+_executor = None
+_executor_config = None
+
+
+class RenderedThumbnail(NamedTuple):
+    """A thumbnail encoded by 'render_thumbnails'."""
+
+    width: int
+    height: int
+    # Encoded thumbnail by format, e.g. {"jpeg": b"...", "webp": b"..."}.
+    files: Dict[str, bytes]
+
+
+def thumbnail_formats() -> List[str]:
+    """
+    Return the formats every thumbnail is rendered in: "jpeg" followed by the
+    formats listed in IMAGES_THUMBNAIL_FORMATS that the installed Pillow can
+    encode (AVIF needs Pillow built with libavif).
+    """
+    PILImage.init()
+    formats = ["jpeg"]
+    for image_format in getattr(settings, "IMAGES_THUMBNAIL_FORMATS", []):
+        if image_format not in PIL_FORMATS:
+            raise ImproperlyConfigured(
+                f"Unknown IMAGES_THUMBNAIL_FORMATS entry '{image_format}'. "
+                f"Use one of {', '.join(PIL_FORMATS)}."
+            )
+        if PIL_FORMATS[image_format] in PILImage.SAVE and image_format not in formats:
+            formats.append(image_format)
+    return formats
+
+
+def jpeg_profile(name: str = "default") -> dict:
+    """
+    Return the JPEG encoder settings of a profile in IMAGES_JPEG_PROFILES, with
+    the missing keys taken from DEFAULT_JPEG_PROFILE.
+
+    Args:
+        name (str): Name of the profile, e.g. 'RolePolicy.jpeg_profile'.
+    Returns:
+        Dict with "quality", "optimize", "progressive", "subsampling" and
+        "strip_exif" keys.
+    """
+    profiles = getattr(settings, "IMAGES_JPEG_PROFILES", {})
+    if name not in profiles and name != "default":
+        raise ImproperlyConfigured(f"Unknown JPEG profile '{name}'.")
+    return {**DEFAULT_JPEG_PROFILE, **profiles.get(name, {})}
+
+
+def file_metadata(file) -> dict:
+    """
+    Return the metadata stored on 'Image' for an image file: upright width and
+    height and format read from the image header (nothing is decoded), byte size
+    and SHA-256 hash of the content. Dimensions and format are empty for files
+    Pillow can't identify.
+
+    Args:
+        file: Django File, e.g. an uploaded file or 'Image.image_file'.
+    Returns:
+        Dict with "width", "height", "format", "byte_size" and "content_hash" keys.
+    """
+    digest = hashlib.sha256()
+    byte_size = 0
+    for chunk in file.chunks():
+        digest.update(chunk)
+        byte_size += len(chunk)
+    metadata = {
+        "width": None,
+        "height": None,
+        "format": "",
+        "byte_size": byte_size,
+        "content_hash": digest.hexdigest(),
+    }
+    file.seek(0)
+    try:
+        with PILImage.open(file) as img:
+            orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+            width, height = img.size
+            if orientation in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            metadata.update(width=width, height=height, format=img.format.lower())
+    except (UnidentifiedImageError, OSError):
+        pass
+    file.seek(0)
+    return metadata
+
+
+def save_options(image_format: str, profile: dict, exif: Optional[bytes]) -> dict:
+    """Return the keyword arguments of 'PIL.Image.save' for a thumbnail format."""
+    if image_format != "jpeg":
+        return {}
+    options = {
+        key: profile[key]
+        for key in ("quality", "optimize", "progressive", "subsampling")
+    }
+    if exif and not profile["strip_exif"]:
+        options["exif"] = exif
+    return options
+
+
+def _scaled_width(size: tuple, height: int) -> int:
+    """Return the width matching 'height' for an image of the given (width, height)."""
+    width, original_height = size
+    return max(1, round(width * height / original_height))
+
+
+def downscale(img: PILImage.Image, size: tuple, height: int) -> PILImage.Image:
+    """
+    Downscale an image to the given height keeping the aspect ratio of the original.
+    Images that are already small enough are returned unchanged.
+
+    Args:
+        img (PIL.Image.Image): Decoded image.
+        size (tuple): (width, height) of the original image.
+        height (int): Target height.
+    Returns:
+        Downscaled PIL image.
+    """
+    if img.height <= height:
+        return img
+    factor = img.height // (height * REDUCING_GAP)
+    if factor > 1:
+        img = img.reduce(factor)
+    return img.resize((_scaled_width(size, height), height), PILImage.LANCZOS)
+
+
+def render_thumbnails(
+    source,
+    thumbnail_sizes: Sequence[int],
+    formats: Sequence[str] = ("jpeg",),
+    profile: Optional[dict] = None,
+) -> Dict[int, RenderedThumbnail]:
+    """
+    Decode an image once and encode a thumbnail for every given height and format.
+
+    For JPEG files the decoder is asked (with 'draft') to scale the image down
+    while decoding, to the smallest size still big enough for the largest
+    thumbnail. The image is rotated according to its EXIF orientation, so the
+    thumbnails are upright even when the EXIF data is stripped. Thumbnails are
+    then produced from largest to smallest, each one from the previous result.
+
+    This function is also run in the worker processes, so 'source' is usually
+    a file path rather than the image bytes.
+
+    Args:
+        source: Path or file object of the original image.
+        thumbnail_sizes (list): Heights of the thumbnails.
+        formats (list): Formats to encode every thumbnail in, e.g. ["jpeg", "webp"].
+        profile (dict): JPEG encoder settings returned by 'jpeg_profile'.
+    Returns:
+        Dict mapping every requested height to the rendered thumbnail.
+    """
+    profile = profile or DEFAULT_JPEG_PROFILE
+    rendered = {}
+    with PILImage.open(source) as img:
+        orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+        transposed = orientation in TRANSPOSED_ORIENTATIONS
+        # Size of the upright image.
+        original_size = img.size[::-1] if transposed else img.size
+        largest = min(max(thumbnail_sizes), original_size[1])
+        draft_size = (_scaled_width(original_size, largest), largest)
+        img.draft("RGB", draft_size[::-1] if transposed else draft_size)
+        current = ImageOps.exif_transpose(img).convert("RGB")
+    exif = current.info.get("exif")
+
+    for size in sorted(set(thumbnail_sizes), reverse=True):
+        current = downscale(current, original_size, size)
+        files = {}
+        for image_format in formats:
+            output = io.BytesIO()
+            current.save(
+                output,
+                format=PIL_FORMATS[image_format],
+                **save_options(image_format, profile, exif),
+            )
+            files[image_format] = output.getvalue()
+        rendered[size] = RenderedThumbnail(current.width, current.height, files)
+    return rendered
+
+
+def make_executor(workers: int, kind: str = "process") -> Optional[Executor]:
+    """
+    Return a new pool for rendering thumbnails, or None when fewer than 2
+    workers are asked for. The caller shuts the pool down.
+
+    Args:
+        workers (int): Number of worker processes or threads.
+        kind (str): "process" or "thread".
+    """
+    if not workers or workers < 2:
+        return None
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails")
+    raise ImproperlyConfigured(
+        f"Unknown IMAGES_THUMBNAIL_EXECUTOR '{kind}'. Use 'process' or 'thread'."
+    )
+
+
+def _get_executor() -> Optional[Executor]:
+    """
+    Return the shared pool used to render thumbnails, or None when thumbnails
+    should be rendered serially (IMAGES_THUMBNAIL_WORKERS lower than 2).
+    The pool is created on first use and recreated when the settings change.
+    """
+    global _executor, _executor_config  # pylint: disable=global-statement
+
+    workers = getattr(settings, "IMAGES_THUMBNAIL_WORKERS", 0)
+    kind = getattr(settings, "IMAGES_THUMBNAIL_EXECUTOR", "process")
+    if _executor_config != (workers, kind):
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = make_executor(workers, kind)
+        _executor_config = (workers, kind)
+    return _executor
+
+
+def _file_path(file) -> Optional[str]:
+    """Return the local path of an uploaded or stored file, or None."""
+    if hasattr(file, "temporary_file_path"):
+        return file.temporary_file_path()
+    try:
+        return file.path
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+@contextmanager
+def _local_path(file):
+    """
+    Yield a local file system path of a stored or uploaded file, so worker
+    processes can open it themselves. Uploads kept in memory and storages without
+    local paths are copied to a temporary file.
+    """
+    path = _file_path(file)
+    if path is not None:
+        yield path
+        return
+    with tempfile.NamedTemporaryFile(suffix=".img") as tmp_file:
+        if isinstance(file, FieldFile):
+            with file.open("rb") as source:
+                shutil.copyfileobj(source, tmp_file)
+        else:
+            file.seek(0)
+            shutil.copyfileobj(file, tmp_file)
+        tmp_file.flush()
+        yield tmp_file.name
+
+
+def _render_batch(
+    items: List[Tuple[File, List[int]]],
+    formats: List[str],
+    profile: dict,
+    executor: Optional[Executor],
+    errors: Optional[Dict[int, Exception]] = None,
+) -> List[Dict[int, RenderedThumbnail]]:
+    """
+    Render thumbnails of all (source file, heights) pairs, one task per file and
+    size when an executor is given, otherwise serially with a single decode per file.
+    With 'errors' a file that can't be decoded gets an empty result and its error
+    stored under its index instead of raising.
+    """
+
+    def failed(index, error):
+        if errors is None:
+            raise error
+        errors[index] = error
+        return {}
+
+    if executor is None:
+        rendered = []
+        for index, (source, sizes) in enumerate(items):
+            if not isinstance(source, FieldFile):
+                source.seek(0)
+            try:
+                rendered.append(render_thumbnails(source, sizes, formats, profile))
+            except DECODE_ERRORS as error:
+                rendered.append(failed(index, error))
+        return rendered
+
+    with ExitStack() as stack:
+        futures = []
+        for source, sizes in items:
+            path = stack.enter_context(_local_path(source))
+            futures.append(
+                [
+                    (
+                        size,
+                        executor.submit(
+                            render_thumbnails, path, [size], formats, profile
+                        ),
+                    )
+                    for size in sizes
+                ]
+            )
+        rendered = []
+        for index, image_futures in enumerate(futures):
+            try:
+                rendered.append(
+                    {size: future.result()[size] for size, future in image_futures}
+                )
+            except DECODE_ERRORS as error:
+                rendered.append(failed(index, error))
+        return rendered
+
+
+def _shared_thumbnails(
+    items: List[Tuple[Image, List[int]]], profile: str, formats: List[str]
+) -> Dict[Tuple[int, int], Thumbnail]:
+    """
+    Return existing thumbnails of other images with the same blob, keyed by
+    (blob ID, height), encoded with the same profile and in all 'formats'.
+    """
+    blob_ids = {image.blob_id for image, _ in items if image.blob_id is not None}
+    if not blob_ids:
+        return {}
+    heights = {size for _, sizes in items for size in sizes}
+    shared = {}
+    for thumbnail in (
+        Thumbnail.objects.filter(
+            image__blob_id__in=blob_ids, height__in=heights, jpeg_profile=profile
+        )
+        .annotate(blob_id=F("image__blob_id"))
+        .order_by("pk")
+    ):
+        if set(formats) <= set(thumbnail.formats):
+            shared.setdefault((thumbnail.blob_id, thumbnail.height), thumbnail)
+    return shared
+
+
+def prerender_thumbnails(
+    files: Dict[str, File],
+    sizes: List[int],
+    profile: str = "default",
+    executor: Optional[Executor] = None,
+) -> Tuple[Dict[str, Dict[int, RenderedThumbnail]], Dict[str, Exception]]:
+    """
+    Render the thumbnails of uploads before their images are saved, so a file
+    whose header is valid but whose body can't be decoded is rejected before
+    anything is stored. Sizes that the thumbnails of a stored blob with the same
+    content already have are skipped; 'create_thumbnails_batch' reuses those.
+
+    Args:
+        files (dict): Uploaded files keyed by their content hash.
+        sizes (list): Heights of the thumbnails.
+        profile (str): Name of the JPEG profile, e.g. 'RolePolicy.jpeg_profile'.
+        executor: Pool rendering the thumbnails, e.g. from 'make_executor',
+            instead of the IMAGES_THUMBNAIL_WORKERS one.
+    Returns:
+        Tuple with the rendered thumbnails keyed by content hash and height, to
+        pass to 'create_thumbnails_batch', and the decoding errors keyed by
+        content hash.
+    """
+    sizes = list(dict.fromkeys(sizes))
+    formats = thumbnail_formats()
+    shared = set()
+    for thumbnail in Thumbnail.objects.filter(
+        image__blob__content_hash__in=files, height__in=sizes, jpeg_profile=profile
+    ).annotate(blob_hash=F("image__blob__content_hash")):
+        if set(formats) <= set(thumbnail.formats):
+            shared.add((thumbnail.blob_hash, thumbnail.height))
+    items = []
+    for content_hash, file in files.items():
+        missing = [size for size in sizes if (content_hash, size) not in shared]
+        if missing:
+            items.append((content_hash, file, missing))
+
+    errors = {}
+    results = _render_batch(
+        [(file, missing) for _, file, missing in items],
+        formats,
+        jpeg_profile(profile),
+        executor or _get_executor(),
+        errors,
+    )
+    rendered, failed = {}, {}
+    for index, ((content_hash, _, _), result) in enumerate(zip(items, results)):
+        if index in errors:
+            failed[content_hash] = errors[index]
+        else:
+            rendered[content_hash] = result
+    return rendered, failed
+
+
+def create_thumbnails_batch(
+    items: List[Tuple[Image, List[int]]],
+    profile: str = "default",
+    sources: Optional[Dict[int, File]] = None,
+    on_demand: bool = False,
+    executor: Optional[Executor] = None,
+    rendered: Optional[Dict[str, Dict[int, RenderedThumbnail]]] = None,
+) -> Dict[int, List[Thumbnail]]:
+    """
+    Create thumbnails for several Image instances and save all of them to the
+    database with a single query.
+
+    Every thumbnail is stored as JPEG and in the formats of IMAGES_THUMBNAIL_FORMATS
+    (saved next to it and listed in 'Thumbnail.variants'). JPEG files are encoded
+    with the settings of the given IMAGES_JPEG_PROFILES profile. Thumbnails that
+    another image of the same blob already has, or gets earlier in this batch,
+    are not rendered again: the new rows point to the stored files of those.
+
+    When IMAGES_THUMBNAIL_WORKERS is 2 or more, every image and size is rendered
+    as a separate task on a process pool (or a thread pool with
+    IMAGES_THUMBNAIL_EXECUTOR = "thread"). Workers get the path of the stored file
+    and return only the encoded thumbnail, so the originals are never pickled.
+    Files stored before a failure are deleted again.
+
+    Args:
+        items (list): Pairs of (Image instance, heights of the thumbnails).
+        profile (str): Name of the JPEG profile, e.g. 'RolePolicy.jpeg_profile'.
+        sources (dict): Files to render from instead of the stored originals,
+            keyed by image primary key, e.g. the uploaded files, so the originals
+            are not read back from storage.
+        on_demand (bool): Mark the thumbnails as rendered on request, so they
+            can be evicted (see images/on_demand.py).
+        executor: Pool rendering the thumbnails, e.g. from 'make_executor',
+            instead of the IMAGES_THUMBNAIL_WORKERS one.
+        rendered (dict): Thumbnails from 'prerender_thumbnails', keyed by the
+            content hash of the images; they are not rendered again.
+    Returns:
+        Dict mapping every image's primary key to its thumbnails, in the order of
+        the requested heights.
+    """
+    items = [(image, list(dict.fromkeys(sizes))) for image, sizes in items if sizes]
+    formats = thumbnail_formats()
+    shared = _shared_thumbnails(items, profile, formats)
+    # Images of the same blob in this batch are rendered once, the first one.
+    scheduled = set(shared)
+    to_render = []
+    for image, sizes in items:
+        missing = []
+        for size in sizes:
+            if image.blob_id is None or (image.blob_id, size) not in scheduled:
+                missing.append(size)
+                if image.blob_id is not None:
+                    scheduled.add((image.blob_id, size))
+        if missing:
+            to_render.append((image, missing))
+    prerendered = rendered or {}
+    rendered = {}
+    for image, missing in to_render:
+        ready = prerendered.get(image.content_hash, {})
+        if all(size in ready for size in missing):
+            rendered[image.pk] = ready
+    to_render = [item for item in to_render if item[0].pk not in rendered]
+    sources = sources or {}
+    rendered.update(
+        zip(
+            [image.pk for image, _ in to_render],
+            _render_batch(
+                [
+                    (sources.get(image.pk, image.image_file), sizes)
+                    for image, sizes in to_render
+                ],
+                formats,
+                jpeg_profile(profile),
+                executor or _get_executor(),
+            ),
+        )
+    )
+
+    extra_fields = {}
+    if on_demand:
+        extra_fields = {"on_demand": True, "last_accessed": datetime.now()}
+    thumbnails, stored = [], []
+    try:
+        for image, sizes in items:
+            for size in sizes:
+                source = shared.get((image.blob_id, size))
+                if source is not None:
+                    thumbnails.append(
+                        Thumbnail(
+                            image=image,
+                            height=size,
+                            thumbnail_file=source.thumbnail_file.name,
+                            variants=dict(source.variants),
+                            width=source.width,
+                            rendered_height=source.rendered_height,
+                            byte_size=source.byte_size,
+                            content_hash=source.content_hash,
+                            jpeg_profile=profile,
+                            **extra_fields,
+                        )
+                    )
+                    continue
+                rendered_thumbnail = rendered[image.pk][size]
+                encoded = rendered_thumbnail.files
+                thumbnail = Thumbnail(
+                    image=image,
+                    height=size,
+                    width=rendered_thumbnail.width,
+                    rendered_height=rendered_thumbnail.height,
+                    byte_size=len(encoded["jpeg"]),
+                    content_hash=hashlib.sha256(encoded["jpeg"]).hexdigest(),
+                    jpeg_profile=profile,
+                    **extra_fields,
+                )
+                thumbnail.thumbnail_file.save(
+                    f"{image.file_name}.jpg", ContentFile(encoded["jpeg"]), save=False
+                )
+                stored.append(thumbnail.thumbnail_file.name)
+                for image_format in formats[1:]:
+                    field = thumbnail.thumbnail_file.field
+                    name = field.generate_filename(
+                        thumbnail, f"{image.file_name}.{image_format}"
+                    )
+                    thumbnail.variants[image_format] = field.storage.save(
+                        name, ContentFile(encoded[image_format])
+                    )
+                    stored.append(thumbnail.variants[image_format])
+                if image.blob_id is not None:
+                    shared[(image.blob_id, size)] = thumbnail
+                thumbnails.append(thumbnail)
+        created = Thumbnail.objects.bulk_create(thumbnails)
+    except Exception:
+        # No row points to the files stored so far.
+        storage = Thumbnail._meta.get_field("thumbnail_file").storage
+        for name in stored:
+            storage.delete(name)
+        raise
+
+    result = {image.pk: [] for image, _ in items}
+    for thumbnail in created:
+        result[thumbnail.image.pk].append(thumbnail)
+    return result
+
+
+def create_thumbnails(
+    image: Image,
+    thumbnail_sizes: List[int],
+    profile: str = "default",
+    source: Optional[File] = None,
+    rendered: Optional[Dict[str, Dict[int, RenderedThumbnail]]] = None,
+) -> List[Thumbnail]:
+    """
+    Create thumbnails of all given heights from an Image instance and save them
+    to the database with a single query.
+
+    Args:
+        image (Image): Image instance to create the thumbnails from.
+        thumbnail_sizes (list): Heights of the thumbnails.
+        profile (str): Name of the JPEG profile in IMAGES_JPEG_PROFILES.
+        source (File): File to render from instead of the stored original, e.g.
+            the uploaded file.
+        rendered (dict): Thumbnails from 'prerender_thumbnails'.
+    Returns:
+        List of Thumbnail instances in the order of 'thumbnail_sizes'.
+    """
+    sources = {image.pk: source} if source is not None else None
+    return create_thumbnails_batch(
+        [(image, thumbnail_sizes)], profile, sources, rendered=rendered
+    ).get(image.pk, [])
+
 
 def create_thumbnail(image: Image, thumbnail_size: int) -> Thumbnail:
     """
@@ -21,26 +622,4 @@ def create_thumbnail(image: Image, thumbnail_size: int) -> Thumbnail:
     Returns:
         Thumbnail instance
     """
-    thumbnail = Thumbnail()
-    thumbnail.image = image
-    thumbnail.height = thumbnail_size
-    with PILImage.open(image.image_file) as img:
-        width, heigth = img.size
-        aspect_ratio = width / heigth
-        new_width = int(aspect_ratio * thumbnail_size)
-        img.thumbnail((new_width, thumbnail_size))
-        output = io.BytesIO()
-        img.convert("RGB").save(output, format="JPEG")
-        output.seek(0)
-
-        thumbnail.thumbnail_file = InMemoryUploadedFile(
-            output,
-            "ImageField",
-            f"{image.file_name}.jpg",
-            "image/jpeg",
-            output.getbuffer().nbytes,
-            None,
-        )
-
-    thumbnail.save()
-    return thumbnail
+    return create_thumbnails(image, [thumbnail_size])[0]
@@ -0,0 +1,102 @@
+"""
+Module with the checks run on an upload before anything is written to storage.
+
+The client supplied content type is not trusted: the format is sniffed from the
+magic bytes of the file and confirmed by reading the image header, which gives
+the dimensions without decoding any pixels. The byte size and megapixel limits
+come from the user's role, or IMAGES_MAX_UPLOAD_SIZE / IMAGES_MAX_MEGAPIXELS when
+the role doesn't set them, so decompression bombs are rejected before the full
+decode done by the thumbnail rendering.
+
+This module contains functions:
+ - sniff_format: Return the image format of a file from its magic bytes.
+ - upload_limits: Return the byte size and pixel limits of a role.
+ - validate_upload: Check an uploaded file against the limits of a role.
+"""
+import warnings
+from typing import Optional, Tuple
+
+from django.conf import settings
+from PIL import Image as PILImage
+from PIL import UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+from accounts.policy import RolePolicy
+
+DEFAULT_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+DEFAULT_MAX_MEGAPIXELS = 50
+
+# Leading bytes of the accepted formats.
+MAGIC_BYTES = {
+    b"\xff\xd8\xff": "jpeg",
+    b"\x89PNG\r\n\x1a\n": "png",
+}
+
+
+def sniff_format(file) -> Optional[str]:
+    """Return "jpeg" or "png" from the first bytes of a file, or None."""
+    file.seek(0)
+    head = file.read(max(len(magic) for magic in MAGIC_BYTES))
+    file.seek(0)
+    for magic, image_format in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return image_format
+    return None
+
+
+def upload_limits(policy: RolePolicy) -> Tuple[int, int]:
+    """Return the maximum byte size and pixel count of an upload of a role."""
+    max_bytes = policy.max_upload_size or getattr(
+        settings, "IMAGES_MAX_UPLOAD_SIZE", DEFAULT_MAX_UPLOAD_SIZE
+    )
+    max_megapixels = policy.max_megapixels or getattr(
+        settings, "IMAGES_MAX_MEGAPIXELS", DEFAULT_MAX_MEGAPIXELS
+    )
+    return max_bytes, max_megapixels * 1_000_000
+
+
+def validate_upload(file, policy: RolePolicy) -> str:
+    """
+    Check an uploaded file without decoding it.
+
+    Args:
+        file: Uploaded file.
+        policy (RolePolicy): Policy of the uploading user's role.
+    Returns:
+        Format of the image, "jpeg" or "png".
+    Raises:
+        ValidationError: The file is not a JPEG or PNG image, its header is
+        broken or it exceeds the limits of the role.
+    """
+    if file is None:
+        raise ValidationError("No image file was uploaded.")
+    max_bytes, max_pixels = upload_limits(policy)
+    if file.size > max_bytes:
+        raise ValidationError(
+            f"Image file is too large ({file.size} bytes), "
+            f"the limit is {max_bytes} bytes."
+        )
+
+    image_format = sniff_format(file)
+    if image_format is None:
+        raise ValidationError("Only JPEG and PNG image formats are supported.")
+    try:
+        with warnings.catch_warnings():
+            # Pillow only warns below twice its MAX_IMAGE_PIXELS, the limit is
+            # checked below.
+            warnings.simplefilter("ignore", PILImage.DecompressionBombWarning)
+            with PILImage.open(file, formats=[image_format.upper()]) as img:
+                width, height = img.size
+    except PILImage.DecompressionBombError as error:
+        raise ValidationError("Image has too many pixels.") from error
+    except (UnidentifiedImageError, OSError, SyntaxError) as error:
+        raise ValidationError("Image file is corrupt.") from error
+    finally:
+        file.seek(0)
+
+    if width * height > max_pixels:
+        raise ValidationError(
+            f"Image is too large ({width}x{height} pixels), "
+            f"the limit is {max_pixels // 1_000_000} megapixels."
+        )
+    return image_format
@@ -1,65 +1,198 @@
+import calendar
+import hashlib
 import os
+import time
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core.signing import BadSignature
 from django.core.exceptions import (
     ObjectDoesNotExist,
     MultipleObjectsReturned,
     PermissionDenied,
 )
-from django.http import HttpResponse, HttpResponseGone, Http404
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponseGone, HttpResponseRedirect, Http404
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 
 from rest_framework import generics
 from rest_framework import permissions
-from rest_framework.decorators import api_view, parser_classes
+from rest_framework import status
+from rest_framework.decorators import api_view, parser_classes, permission_classes
 from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 
-from accounts.models import CustomUser, Role
-from .models import Image, Thumbnail, ExpiringImage
-from .serializers import UserSerializer, ImageSerializer, ThumbnailSerializer
-from .utils import create_thumbnail
+from accounts.models import CustomUser
+from accounts.policy import get_role_policy
+from .blobs import acquire_blob
+from .cache import CachedFile, get_thumbnail_cache, thumbnail_cache_key
+from .jobs import enqueue_thumbnails, thumbnail_status
+from .models import Image, Thumbnail, ExpiringImage, UploadSession
+from .on_demand import get_or_create_thumbnail, touch_thumbnail
+from .pagination import ImageCursorPagination
+from .resolvers import (
+    aresolve_image_token,
+    aresolve_thumbnail_token,
+    forget_image,
+    forget_image_id,
+    forget_thumbnail,
+    resolve_image,
+    resolve_image_token,
+    resolve_thumbnail_token,
+)
+from .serializers import (
+    UserSerializer,
+    ImageSerializer,
+    ThumbnailSerializer,
+    IMAGE_METADATA_FIELDS,
+    THUMBNAIL_METADATA_FIELDS,
+    absolute_url,
+    image_metadata,
+    thumbnail_metadata,
+)
+from .serving import (
+    aserve_file,
+    file_etag,
+    guess_content_type,
+    negotiate_format,
+    serve_bytes,
+    serve_file,
+)
+from .signed_urls import make_signed_token, read_signed_token
+from .utils import (
+    create_thumbnails,
+    create_thumbnails_batch,
+    file_metadata,
+    prerender_thumbnails,
+    thumbnail_formats,
+)
+from .uploads import (
+    discard_session,
+    missing_chunks,
+    open_staged_file,
+    upload_chunk_size,
+    write_chunk,
+)
+from .validation import upload_limits, validate_upload
 from datetime import datetime, timedelta
 
+# Files accepted by one batch upload when IMAGES_MAX_BATCH_FILES isn't set.
+DEFAULT_MAX_BATCH_FILES = 100
+
 
 def image_preview_view(request, random_id):
     """
-    A view that retrieves an Image object by its URL and returns the image data
-    as a HTTP response.
+    A view that retrieves an Image object by its token and streams the image data
+    as a HTTP response. The original never changes, so it is sent with a long,
+    immutable max-age and conditional requests are answered with 304.
+    Range requests get only the requested bytes (206 Partial Content).
+    The token is resolved through the cache in 'images.resolvers'.
 
     Args:
         request (HttpRequest): A Django HTTP request object.
-        random_id (str): A random identifier that corresponds to the Image object's URL.
+        random_id (str): The token of the Image object.
     """
+    image = resolve_image_token(random_id)
+    if image is None:
+        raise Http404("Image does not exist.")
     try:
-        image = Image.objects.get(
-            image_url=f"http://127.0.0.1:8000/api/v1/img/{random_id}"
+        return serve_file(
+            request,
+            image.image_file,
+            content_type=guess_content_type(image.image_file),
+            last_modified=image.upload_date,
+            allow_ranges=True,
         )
-    except Image.DoesNotExist:
-        raise Http404("Image does not exist.")
-    with image.image_file.open() as img:
-        image_data = img.read()
-    return HttpResponse(image_data, content_type="image/jpeg")
+    except Http404:
+        # The file was deleted, don't keep resolving the token to it.
+        forget_image(image)
+        raise
+
+
+def _cache_thumbnail(cache, key: str, thumbnail: Thumbnail, image_format: str):
+    """
+    Read a thumbnail in the given format into the thumbnail cache. Returns the
+    cached entry, or None if caching is disabled or the file is too big to be cached.
+    Raises Http404 if the file doesn't exist.
+    """
+    thumbnail_file = thumbnail.get_file(image_format)
+    if cache is None:
+        return None
+    try:
+        if thumbnail_file.size > cache.max_entry_bytes:
+            return None
+        with thumbnail_file.open("rb"):
+            content = thumbnail_file.read()
+    except FileNotFoundError as error:
+        raise Http404("File does not exist.") from error
+    cached = CachedFile(
+        content,
+        f"image/{image_format}",
+        file_etag(thumbnail_file),
+        calendar.timegm(thumbnail.image.upload_date.utctimetuple()),
+    )
+    cache.set(key, cached)
+    return cached
+
+
+def _serve_cached_thumbnail(request, cached: CachedFile):
+    """Return a response with a cached thumbnail."""
+    response = serve_bytes(
+        request,
+        cached.content,
+        cached.content_type,
+        cached.etag,
+        cached.last_modified,
+    )
+    patch_vary_headers(response, ["Accept"])
+    return response
 
 
 def thumbnail_preview_view(request, random_id):
     """
-    A view that retrieves an Thumbnail object by its URL and returns the image data
-    as a HTTP response.
+    A view that retrieves an Thumbnail object by its token and streams the image data
+    as a HTTP response. Thumbnails never change, so they are sent with a long,
+    immutable max-age and conditional requests are answered with 304.
+
+    The thumbnail is sent as WebP or AVIF when it is stored in that format and the
+    Accept header asks for it, otherwise as JPEG; responses carry "Vary: Accept".
+
+    Small thumbnails are kept in the cache configured in IMAGES_THUMBNAIL_CACHE,
+    so hot thumbnails are sent without a database query or file read. Bigger ones
+    are looked up through the token cache in 'images.resolvers'.
 
     Args:
         request (HttpRequest): A Django HTTP request object.
-        random_id (str): A random identifier that corresponds to the Thumbnail object's URL.
+        random_id (str): The token of the Thumbnail object.
     """
-    try:
-        image = Thumbnail.objects.get(
-            url=f"http://127.0.0.1:8000/api/v1/tmb/{random_id}"
-        )
-    except Thumbnail.DoesNotExist:
-        raise Http404("Thumbnail does not exist.")
-    with image.thumbnail_file.open() as img:
-        image_data = img.read()
-    return HttpResponse(image_data, content_type="image/jpeg")
+    cache = get_thumbnail_cache()
+    key = thumbnail_cache_key(random_id, negotiate_format(request, thumbnail_formats()))
+    cached = cache.get(key) if cache is not None else None
+    if cached is None:
+        thumbnail = resolve_thumbnail_token(random_id)
+        if thumbnail is None:
+            raise Http404("Thumbnail does not exist.")
+        image_format = negotiate_format(request, thumbnail.formats)
+        try:
+            cached = _cache_thumbnail(cache, key, thumbnail, image_format)
+            if cached is None:
+                response = serve_file(
+                    request,
+                    thumbnail.get_file(image_format),
+                    content_type=f"image/{image_format}",
+                    last_modified=thumbnail.image.upload_date,
+                )
+                patch_vary_headers(response, ["Accept"])
+                return response
+        except Http404:
+            # The file was deleted, don't keep resolving the token to it.
+            forget_thumbnail(thumbnail)
+            raise
+    return _serve_cached_thumbnail(request, cached)
 
 
 @login_required
@@ -71,6 +204,11 @@ def thumbnail_preview_view(request, random_id):
 def create_expire_image_view(request, id):
     """
     A view that creates an expiring URL for an Image object.
+
+    By default the link is an 'ExpiringImage' row that can be revoked by deleting
+    it. With "revocable": false in the request (or IMAGES_SIGNED_EXPIRING_LINKS
+    enabled and "revocable" not given) the link is a signed token instead, which
+    is checked without any database query when it is opened.
     Args:
         request (Request): Django HTTP request object.
         id (int): ID of the image object.
@@ -82,10 +220,11 @@ def create_expire_image_view(request, id):
         # Get Image
         image = Image.objects.get(pk=id)
         # Check if requestes user is owner of the image.
-        if image.owner != request.user:
+        if image.owner_id != request.user.pk:
             raise PermissionDenied("You are not authorized to view this image.")
         # Check if request user have permission to create expiring urls.
-        if not request.user.role.allow_expiring:
+        policy = get_role_policy(request.user.role_id)
+        if policy is None or not policy.allow_expiring:
             raise PermissionDenied("You are not allowed to create expiring images.")
     except ObjectDoesNotExist:
         # If Image with given ID doesn't exists.
@@ -99,12 +238,22 @@ def create_expire_image_view(request, id):
     time_to_expire = request.data.get("time_to_expire")
     if int(time_to_expire) < 300 or int(time_to_expire) > 30000:
         raise ValidationError("Time to expire must be between 300 and 30000 seconds.")
+    revocable = request.data.get("revocable")
+    if revocable is None:
+        signed = getattr(settings, "IMAGES_SIGNED_EXPIRING_LINKS", False)
+    else:
+        signed = str(revocable).lower() in ("0", "false", "no")
+    if signed:
+        token = make_signed_token(image.pk, int(time.time()) + int(time_to_expire))
+        path = reverse("signed_expire_image_view", args=[token])
+        return Response({"expiring_url": request.build_absolute_uri(path)})
+
     # Create new object
     expire_url = ExpiringImage()
     expire_url.image = image
     expire_url.expire_time = datetime.now() + timedelta(seconds=int(time_to_expire))
     expire_url.save()
-    response_data = {"expiring_url": expire_url.url}
+    response_data = {"expiring_url": absolute_url(request, expire_url)}
     return Response(response_data)
 
 
@@ -115,9 +264,12 @@ def expire_image_preview_view(request, random_id):
 
     This view receives a GET request with a `random_id` parameter that identifies
     the expiring image to retrieve. If the image exists and its expiration time
-    has not passed yet, it returns an HTTP response with the image data and the
-    "image/jpeg" content type. If the image link has expired, it deletes the
-    expiring image object and returns an HTTP response with status code 410 Gone.
+    has not passed yet, it returns an HTTP response streaming the image data with
+    the content type of the original. If the image link has expired, it returns an
+    HTTP response with status code 410 Gone; expired rows are deleted in bulk by
+    'manage.py reap_expiring_images'.
+    The response may be cached only until the link expires. Range requests
+    get only the requested bytes (206 Partial Content).
 
     Parameters:
     - `request`: The HTTP request object.
@@ -126,20 +278,157 @@ def expire_image_preview_view(request, random_id):
     - `HttpResponse` with the image data and content type, or status code 410 Gone.
     """
     try:
-        image = ExpiringImage.objects.get(
-            url=f"http://127.0.0.1:8000/api/v1/exp/{random_id}"
-        )
+        image = ExpiringImage.objects.select_related("image").get(token=random_id)
     except ObjectDoesNotExist:
         return HttpResponseGone("The image doesn't exist or the link has expired.")
 
-    if datetime.now() > image.expire_time:
-        image.delete()
+    now = datetime.now()
+    if now > image.expire_time:
         return HttpResponseGone("The image link has expired.")
 
-    with image.image.image_file.open() as img:
-        image_data = img.read()
+    return serve_file(
+        request,
+        image.image.image_file,
+        content_type=guess_content_type(image.image.image_file),
+        last_modified=image.image.upload_date,
+        max_age=(image.expire_time - now).total_seconds(),
+        allow_ranges=True,
+    )
+
+
+def signed_expire_image_preview_view(request, token):
+    """
+    Retrieve an image preview given a signed expiring token.
+
+    The signature and expiry time are checked without touching the database and
+    the stored file of the image comes from the resolver cache, so serving a
+    popular link normally needs no queries at all.
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        token (str): Token created by 'make_signed_token'.
+    Returns:
+        Response streaming the image, 404 for invalid tokens or 410 Gone when
+        the link has expired.
+    """
+    try:
+        image_id, expires = read_signed_token(token)
+    except BadSignature:
+        raise Http404("Invalid link.")
+
+    remaining = expires - time.time()
+    if remaining <= 0:
+        return HttpResponseGone("The image link has expired.")
+
+    image = resolve_image(image_id)
+    if image is None:
+        return HttpResponseGone("The image doesn't exist or the link has expired.")
+
+    try:
+        return serve_file(
+            request,
+            image.image_file,
+            content_type=guess_content_type(image.image_file),
+            last_modified=image.upload_date,
+            max_age=remaining,
+            allow_ranges=True,
+        )
+    except Http404:
+        # The file was deleted, don't keep resolving the image to it.
+        forget_image_id(image.pk)
+        raise
+
 
-    return HttpResponse(image_data, content_type="image/jpeg")
+async def async_image_preview_view(request, random_id):
+    """
+    Async version of 'image_preview_view' for ASGI servers (IMAGES_ASYNC_PREVIEWS).
+    The token is resolved with async cache and ORM calls and the file is streamed
+    with reads done in worker threads, so slow downloads don't hold a thread.
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        random_id (str): The token of the Image object.
+    """
+    image = await aresolve_image_token(random_id)
+    if image is None:
+        raise Http404("Image does not exist.")
+    try:
+        return await aserve_file(
+            request,
+            image.image_file,
+            content_type=guess_content_type(image.image_file),
+            last_modified=image.upload_date,
+            allow_ranges=True,
+        )
+    except Http404:
+        await sync_to_async(forget_image)(image)
+        raise
+
+
+async def async_thumbnail_preview_view(request, random_id):
+    """
+    Async version of 'thumbnail_preview_view' for ASGI servers
+    (IMAGES_ASYNC_PREVIEWS).
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        random_id (str): The token of the Thumbnail object.
+    """
+    cache = get_thumbnail_cache()
+    key = thumbnail_cache_key(random_id, negotiate_format(request, thumbnail_formats()))
+    cached = await cache.aget(key) if cache is not None else None
+    if cached is None:
+        thumbnail = await aresolve_thumbnail_token(random_id)
+        if thumbnail is None:
+            raise Http404("Thumbnail does not exist.")
+        image_format = negotiate_format(request, thumbnail.formats)
+        try:
+            cached = await sync_to_async(_cache_thumbnail, thread_sensitive=False)(
+                cache, key, thumbnail, image_format
+            )
+            if cached is None:
+                response = await aserve_file(
+                    request,
+                    thumbnail.get_file(image_format),
+                    content_type=f"image/{image_format}",
+                    last_modified=thumbnail.image.upload_date,
+                )
+                patch_vary_headers(response, ["Accept"])
+                return response
+        except Http404:
+            await sync_to_async(forget_thumbnail)(thumbnail)
+            raise
+    return _serve_cached_thumbnail(request, cached)
+
+
+async def async_expire_image_preview_view(request, random_id):
+    """
+    Async version of 'expire_image_preview_view' for ASGI servers
+    (IMAGES_ASYNC_PREVIEWS).
+
+    Args:
+        request (HttpRequest): A Django HTTP request object.
+        random_id (str): The random ID that identifies the expiring image.
+    """
+    try:
+        image = await ExpiringImage.objects.select_related("image").aget(
+            token=random_id
+        )
+    except ObjectDoesNotExist:
+        return HttpResponseGone("The image doesn't exist or the link has expired.")
+
+    now = datetime.now()
+    if now > image.expire_time:
+        return HttpResponseGone("The image link has expired.")
+
+    return await aserve_file(
+        request,
+        image.image.image_file,
+        content_type=guess_content_type(image.image.image_file),
+        last_modified=image.image.upload_date,
+        max_age=(image.expire_time - now).total_seconds(),
+        allow_ranges=True,
+    )
 
 
 @login_required
@@ -153,8 +442,10 @@ def image_view(request, id):
         id (int): The ID of the image.
     """
     try:
-        image = Image.objects.get(pk=id)
-        if image.owner != request.user:
+        image = Image.objects.prefetch_related("thumbnails", "thumbnail_jobs").get(
+            pk=id
+        )
+        if image.owner_id != request.user.pk:
             raise PermissionDenied("You are not authorized to view this image.")
     except ObjectDoesNotExist:
         raise ValidationError("Image with that ID doesn't exists")
@@ -166,17 +457,154 @@ def image_view(request, id):
     thumbnail_data = {}
     thumbnails = image.thumbnails.all()
     for thumbnail in thumbnails:
-        thumbnail_data[f"{thumbnail.height}px_url"] = thumbnail.url
-    original_url = image.image_url if request.user.role.allow_original else None
+        thumbnail_data[f"{thumbnail.height}px_url"] = absolute_url(request, thumbnail)
+    policy = get_role_policy(request.user.role_id)
+    original_url = (
+        absolute_url(request, image) if policy and policy.allow_original else None
+    )
     response_data = {
         "image_id": image.pk,
         "filename": image.file_name,
         "original_url": original_url,
         "thumbnails": thumbnail_data,
+        "thumbnail_status": thumbnail_status(image),
+        **image_metadata(image),
+        "thumbnail_metadata": thumbnail_metadata(thumbnails),
     }
     return Response(response_data)
 
 
+@login_required
+@api_view(["GET"])
+def thumbnail_on_demand_view(request, id, height):
+    """
+    View redirecting to the thumbnail of an image with the given height. Heights
+    the image has no thumbnail of yet are rendered on the first request.
+
+    Args:
+        request (Request): Django HTTP request object.
+        id (int): The ID of the image.
+        height (int): Height of the thumbnail, one of the user's role heights.
+    """
+    try:
+        image = Image.objects.get(pk=id)
+        if image.owner_id != request.user.pk:
+            raise PermissionDenied("You are not authorized to view this image.")
+    except ObjectDoesNotExist:
+        raise ValidationError("Image with that ID doesn't exists")
+
+    policy = get_role_policy(request.user.role_id)
+    if policy is None or height not in policy.thumbnail_sizes:
+        raise PermissionDenied("Your account tier has no thumbnails of that height.")
+    thumbnail, created = get_or_create_thumbnail(image, height, policy.jpeg_profile)
+    if not created:
+        touch_thumbnail(thumbnail)
+    return HttpResponseRedirect(absolute_url(request, thumbnail))
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def thumbnail_cache_stats_view(request):
+    """
+    View returning the counters of the thumbnail cache of the process that
+    handles the request (hits, misses, evictions, size). Staff only.
+
+    Args:
+        request (Request): Django HTTP request object.
+    """
+    cache = get_thumbnail_cache()
+    return Response(cache.stats() if cache is not None else {"backend": None})
+
+
+def _store_upload(request, image_file, policy) -> Response:
+    """
+    Validate an uploaded original, store it and create its thumbnails (or queue
+    them with IMAGES_ASYNC_THUMBNAILS). Shared by the single file upload and the
+    chunked upload sessions.
+
+    Args:
+        request (Request): DRF request of the uploading user.
+        image_file: Uploaded file, or the staging file of an upload session.
+        policy (RolePolicy): Policy of the user's role.
+    Returns:
+        DRF response with the thumbnail and original URLs, 202 when the
+        thumbnails are queued.
+    """
+    user = request.user
+    # Checked before anything is written to storage or decoded.
+    validate_upload(image_file, policy)
+
+    filename, extension = os.path.splitext(image_file.name)
+    new_filename = f"{filename}_{user.username}{extension}"
+
+    if Image.objects.filter(file_name=image_file.name).exists():
+        raise ValidationError("Image with the same name field already exists.")
+
+    metadata = file_metadata(image_file)
+    asynchronous = getattr(settings, "IMAGES_ASYNC_THUMBNAILS", False)
+    rendered = None
+    if not asynchronous:
+        # Rendered from the upload before anything is stored, so a body that
+        # can't be decoded stores nothing and the original is never read back.
+        rendered, errors = prerender_thumbnails(
+            {metadata["content_hash"]: image_file},
+            policy.thumbnail_sizes,
+            policy.jpeg_profile,
+        )
+        if errors:
+            raise ValidationError("Image file is corrupt.")
+    with transaction.atomic():
+        blob = acquire_blob(
+            image_file,
+            metadata["content_hash"],
+            metadata["byte_size"],
+            metadata["format"],
+        )
+        image = Image(
+            image_file=blob.file.name,
+            blob=blob,
+            owner=user,
+            file_name=new_filename,
+            **metadata,
+        )
+        image.save()
+
+    allow_original = policy.name == "Enterprise" or policy.allow_original
+
+    if asynchronous:
+        enqueue_thumbnails(image, policy.thumbnail_sizes)
+        response_data = {
+            "image_id": image.pk,
+            "status": "pending",
+            "thumbnails": thumbnail_status(image),
+        }
+        if allow_original:
+            response_data["original_image"] = ImageSerializer(
+                image, context={"request": request}
+            ).data
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
+    thumbnail_data = {}
+    thumbnails = create_thumbnails(
+        image,
+        policy.thumbnail_sizes,
+        policy.jpeg_profile,
+        source=image_file,
+        rendered=rendered,
+    )
+    for thumbnail in thumbnails:
+        thumbnail_data[f"{thumbnail.height}px_thumbnail"] = ThumbnailSerializer(
+            thumbnail, context={"request": request}
+        ).data
+
+    if allow_original:
+        thumbnail_data["original_image"] = ImageSerializer(
+            image, context={"request": request}
+        ).data
+
+    return Response(thumbnail_data)
+
+
 class ImageUploadView(generics.CreateAPIView, generics.ListAPIView):
     """
     API endpoint that allows authenticated users to upload images and
@@ -184,14 +612,20 @@ class ImageUploadView(generics.CreateAPIView, generics.ListAPIView):
 
     A POST request with a valid JPEG or PNG image file to this endpoint
     will create a new Image object associated with the authenticated user,
-    store the uploaded image file, create and store its thumbnails, and
-    return the URLs of the generated thumbnails and, if allowed by the user's
-    role, the URL of the original image.
-
-    A GET request to this endpoint will return a JSON object containing
-    information about all images uploaded by the authenticated user,
-    including their IDs, filenames, original URLs (if allowed), and URLs
-    of their thumbnails.
+    store the uploaded image file (once per distinct content, an identical
+    upload reuses the stored original and its thumbnails, see images/blobs.py),
+    create and store its thumbnails, and return the URLs of the generated
+    thumbnails and, if allowed by the user's role, the URL of the original
+    image. With IMAGES_ASYNC_THUMBNAILS the thumbnails are queued for the
+    'process_thumbnail_jobs' workers instead and the response is 202 Accepted
+    with the image ID.
+
+    A GET request to this endpoint will return a page of images uploaded by
+    the authenticated user, newest first, including their IDs, filenames,
+    original URLs (if allowed), and URLs of their thumbnails. The 'next' URL
+    of the response points to the following page (see ImageCursorPagination).
+    With '?legacy=true' all images are returned in a single object keyed
+    'image1' ... 'imageN'.
 
     Only authenticated users with a valid role are authorized to access this view.
     """
@@ -200,77 +634,331 @@ class ImageUploadView(generics.CreateAPIView, generics.ListAPIView):
     parser_classes = (MultiPartParser, FormParser)
     serializer_class = ImageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ImageCursorPagination
 
     def create(self, request, *args, **kwargs):
         image_file = request.FILES.get("image_file")
 
         user = request.user
-        if user.role is None:
+        policy = get_role_policy(user.role_id)
+        if policy is None:
             raise ValidationError("User should have an role.")
 
-        filename, extension = os.path.splitext(image_file.name)
-        new_filename = f"{filename}_{user.username}{extension}"
+        return _store_upload(request, image_file, policy)
 
-        if Image.objects.filter(file_name=image_file.name).exists():
-            raise ValidationError("Image with the same name field already exists.")
+    def list(self, request, *args, **kwargs):
+        user = request.user
+        policy = get_role_policy(user.role_id)
+        if policy is None:
+            raise ValidationError("User should have an role.")
+        images = (
+            Image.objects.filter(owner=user)
+            .only("pk", "token", "file_name", "upload_date", *IMAGE_METADATA_FIELDS)
+            .prefetch_related(
+                Prefetch(
+                    "thumbnails",
+                    queryset=Thumbnail.objects.only(
+                        "pk", "image_id", "height", "token", *THUMBNAIL_METADATA_FIELDS
+                    ),
+                )
+            )
+        )
 
-        if not (
-            image_file.content_type == "image/jpeg"
-            or image_file.content_type == "image/png"
-        ):
-            raise ValidationError("Only JPEG and PNG image formats are supported.")
+        if request.query_params.get("legacy") in ("1", "true"):
+            response_data = {}
+            for i, image in enumerate(images.order_by("pk"), start=1):
+                response_data[f"image{i}"] = self.image_data(request, image, policy)
+            return Response(response_data)
 
-        image = Image(image_file=image_file, owner=user, file_name=new_filename)
-        image.save()
+        page = self.paginate_queryset(images)
+        return self.get_paginated_response(
+            [self.image_data(request, image, policy) for image in page]
+        )
 
-        thumbnail_sizes = {
-            "Basic": [Role.objects.get(name="Basic").thumbnail_size],
-            "Premium": [
-                Role.objects.get(name="Basic").thumbnail_size,
-                Role.objects.get(name="Premium").thumbnail_size,
-            ],
-            "Enterprise": [
-                Role.objects.get(name="Basic").thumbnail_size,
-                Role.objects.get(name="Premium").thumbnail_size,
-            ],
+    @staticmethod
+    def image_data(request, image, policy):
+        """Return the listing entry of a single image."""
+        thumbnail_data = {}
+        for thumbnail in image.thumbnails.all():
+            thumbnail_data[f"{thumbnail.height}px_url"] = absolute_url(
+                request, thumbnail
+            )
+        if policy.allow_original:
+            original_url = absolute_url(request, image)
+        else:
+            original_url = None
+        return {
+            "image_id": image.pk,
+            "filename": image.file_name,
+            "original_url": original_url,
+            "thumbnails": thumbnail_data,
+            **image_metadata(image),
+            "thumbnail_metadata": thumbnail_metadata(image.thumbnails.all()),
         }
 
-        if user.role.name not in ["Basic", "Premium", "Enterprise"]:
-            thumbnail_sizes[user.role.name] = [user.role.thumbnail_size]
 
-        thumbnail_data = {}
-        for size in thumbnail_sizes[user.role.name]:
-            thumbnail = create_thumbnail(image, size)
-            thumbnail_data[f"{size}px_thumbnail"] = ThumbnailSerializer(thumbnail).data
+@api_view(["POST"])
+@parser_classes([MultiPartParser])
+@permission_classes([permissions.IsAuthenticated])
+def batch_upload_view(request):
+    """
+    Upload many images in one multipart request, sent as "image_files" fields.
+
+    All files are validated and hashed first, then the thumbnails of the valid
+    ones are rendered as one batch (on the IMAGES_THUMBNAIL_WORKERS pool when
+    configured), so a file that can't be decoded is rejected before anything is
+    stored. The rest are stored and their Image rows inserted with one query in
+    a single transaction, and their thumbnails inserted with one query. With
+    IMAGES_ASYNC_THUMBNAILS the thumbnails are queued instead of rendered.
+    A bad file doesn't fail the batch:
+    "results" has an entry per file, in the order of the request, with
+    "status" "created" (or "pending") and the same data as a single upload, or
+    "error" and the "errors".
 
-        if user.role.name == "Enterprise" or user.role.allow_original:
-            thumbnail_data["original_image"] = ImageSerializer(image).data
+    Args:
+        request (Request): DRF request object.
+    """
+    user = request.user
+    policy = get_role_policy(user.role_id)
+    if policy is None:
+        raise ValidationError("User should have an role.")
+    files = request.FILES.getlist("image_files")
+    if not files:
+        raise ValidationError("No image files were uploaded.")
+    max_files = getattr(settings, "IMAGES_MAX_BATCH_FILES", DEFAULT_MAX_BATCH_FILES)
+    if len(files) > max_files:
+        raise ValidationError(f"At most {max_files} files can be uploaded at once.")
+
+    results = [{"file_name": image_file.name} for image_file in files]
+    taken = set(
+        Image.objects.filter(
+            file_name__in=[image_file.name for image_file in files]
+        ).values_list("file_name", flat=True)
+    )
+    accepted = []
+    for result, image_file in zip(results, files):
+        try:
+            if image_file.name in taken:
+                raise ValidationError("Image with the same name field already exists.")
+            validate_upload(image_file, policy)
+        except ValidationError as error:
+            result.update(status="error", errors=error.detail)
+            continue
+        accepted.append((result, image_file, file_metadata(image_file)))
+
+    asynchronous = getattr(settings, "IMAGES_ASYNC_THUMBNAILS", False)
+    rendered = None
+    if not asynchronous:
+        # Rendered from the uploads, the stored originals are never read back.
+        rendered, failed = prerender_thumbnails(
+            {
+                metadata["content_hash"]: image_file
+                for _, image_file, metadata in accepted
+            },
+            policy.thumbnail_sizes,
+            policy.jpeg_profile,
+        )
+        for result, _, metadata in accepted:
+            if metadata["content_hash"] in failed:
+                result.update(
+                    status="error",
+                    errors=ValidationError("Image file is corrupt.").detail,
+                )
+        accepted = [item for item in accepted if item[2]["content_hash"] not in failed]
+
+    images = []
+    with transaction.atomic():
+        for _, image_file, metadata in accepted:
+            blob = acquire_blob(
+                image_file,
+                metadata["content_hash"],
+                metadata["byte_size"],
+                metadata["format"],
+            )
+            filename, extension = os.path.splitext(image_file.name)
+            images.append(
+                Image(
+                    image_file=blob.file.name,
+                    blob=blob,
+                    owner=user,
+                    file_name=f"{filename}_{user.username}{extension}",
+                    **metadata,
+                )
+            )
+        images = Image.objects.bulk_create(images)
+
+    if asynchronous:
+        for image in images:
+            enqueue_thumbnails(image, policy.thumbnail_sizes)
+    else:
+        thumbnails = create_thumbnails_batch(
+            [(image, policy.thumbnail_sizes) for image in images],
+            policy.jpeg_profile,
+            sources={
+                image.pk: image_file
+                for image, (_, image_file, _) in zip(images, accepted)
+            },
+            rendered=rendered,
+        )
 
-        return Response(thumbnail_data)
+    allow_original = policy.name == "Enterprise" or policy.allow_original
+    for image, (result, _, _) in zip(images, accepted):
+        result["image_id"] = image.pk
+        if asynchronous:
+            result.update(status="pending", thumbnails=thumbnail_status(image))
+        else:
+            result["status"] = "created"
+            for thumbnail in thumbnails[image.pk]:
+                result[f"{thumbnail.height}px_thumbnail"] = ThumbnailSerializer(
+                    thumbnail, context={"request": request}
+                ).data
+        if allow_original:
+            result["original_image"] = ImageSerializer(
+                image, context={"request": request}
+            ).data
+    return Response({"results": results})
+
+
+def _get_upload_session(request, token: str) -> UploadSession:
+    """Return an unexpired upload session of the requesting user or raise Http404."""
+    session = UploadSession.objects.filter(
+        token=token, owner=request.user, expires__gt=datetime.now()
+    ).first()
+    if session is None:
+        raise Http404("Upload session not found.")
+    return session
+
+
+def _upload_session_data(request, session: UploadSession) -> dict:
+    """Return the state of an upload session sent to the client."""
+    return {
+        "token": session.token,
+        "file_name": session.file_name,
+        "size": session.size,
+        "chunk_size": session.chunk_size,
+        "chunk_count": session.chunk_count,
+        "missing_chunks": missing_chunks(session),
+        "expires": session.expires,
+        "url": request.build_absolute_uri(
+            reverse("upload_session", args=[session.token])
+        ),
+    }
 
-    def list(self, request, *args, **kwargs):
-        user = request.user
-        if user.role is None:
-            raise ValidationError("User should have an role.")
-        images = Image.objects.filter(owner=user)
-        response_data = {}
-        for i, image in enumerate(images, start=1):
-
-            thumbnail_data = {}
-            thumbnails = image.thumbnails.all()
-            for thumbnail in thumbnails:
-                thumbnail_data[f"{thumbnail.height}px_url"] = thumbnail.url
-            if user.role.allow_original:
-                original_url = image.image_url
-            else:
-                original_url = None
-            response_data[f"image{i}"] = {
-                "image_id": image.pk,
-                "filename": image.file_name,
-                "original_url": original_url,
-                "thumbnails": thumbnail_data,
-            }
-        return Response(response_data)
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+def create_upload_session_view(request):
+    """
+    Start a chunked upload of an original.
+
+    The request has the "file_name" and the "size" in bytes of the file. The
+    response has the session "token", the "chunk_size" the file must be split
+    into and the "url" of the session. Chunks are then sent with
+    PUT <url>/chunks/<number> and the upload is completed with POST <url>/finalize.
+
+    Args:
+        request (Request): DRF request object.
+    """
+    policy = get_role_policy(request.user.role_id)
+    if policy is None:
+        raise ValidationError("User should have an role.")
+    file_name = request.data.get("file_name")
+    if not file_name:
+        raise ValidationError("File name is required.")
+    try:
+        size = int(request.data.get("size"))
+    except (TypeError, ValueError):
+        raise ValidationError("Size must be an integer.")
+    max_bytes, _ = upload_limits(policy)
+    if not 0 < size <= max_bytes:
+        raise ValidationError(f"Size must be between 1 and {max_bytes} bytes.")
+
+    session = UploadSession.objects.create(
+        owner=request.user,
+        file_name=os.path.basename(file_name),
+        size=size,
+        chunk_size=upload_chunk_size(),
+    )
+    return Response(
+        _upload_session_data(request, session), status=status.HTTP_201_CREATED
+    )
+
+
+@api_view(["GET", "DELETE"])
+@permission_classes([permissions.IsAuthenticated])
+def upload_session_view(request, token):
+    """
+    GET returns the state of an upload session, including the numbers of the
+    chunks that still have to be sent to resume it. DELETE aborts the upload.
+
+    Args:
+        request (Request): DRF request object.
+        token (str): Token of the upload session.
+    """
+    session = _get_upload_session(request, token)
+    if request.method == "DELETE":
+        discard_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(_upload_session_data(request, session))
+
+
+@api_view(["PUT"])
+@permission_classes([permissions.IsAuthenticated])
+def upload_chunk_view(request, token, number):
+    """
+    Store a chunk of an upload session. The body is the raw content of the chunk
+    and the X-Chunk-SHA256 header its hex SHA-256 checksum. Sending a chunk
+    again replaces it.
+
+    Args:
+        request (Request): DRF request object.
+        token (str): Token of the upload session.
+        number (int): Number of the chunk, starting at 0.
+    """
+    session = _get_upload_session(request, token)
+    checksum = request.headers.get("X-Chunk-SHA256")
+    if not checksum:
+        raise ValidationError("The X-Chunk-SHA256 header is required.")
+    write_chunk(session, number, request.body, checksum)
+    return Response({"number": number, "missing_chunks": missing_chunks(session)})
+
+
+@api_view(["POST"])
+@permission_classes([permissions.IsAuthenticated])
+def finalize_upload_session_view(request, token):
+    """
+    Complete an upload session: the staging file goes through the same
+    validation, storage and thumbnail creation as a single request upload, and
+    the response is the same. An optional "sha256" of the whole file is checked
+    first. The session ends when the image is created or the checksum doesn't
+    match; with missing chunks or an upload that fails validation (e.g. a taken
+    file name) it is kept, so the upload can be fixed and finalized again.
+
+    Args:
+        request (Request): DRF request object.
+        token (str): Token of the upload session.
+    """
+    session = _get_upload_session(request, token)
+    policy = get_role_policy(request.user.role_id)
+    if policy is None:
+        raise ValidationError("User should have an role.")
+    missing = missing_chunks(session)
+    if missing:
+        return Response({"missing_chunks": missing}, status=status.HTTP_400_BAD_REQUEST)
+    with open_staged_file(session) as staged_file:
+        expected_hash = request.data.get("sha256")
+        matches = True
+        if expected_hash:
+            digest = hashlib.sha256()
+            for chunk in staged_file.chunks():
+                digest.update(chunk)
+            matches = digest.hexdigest() == expected_hash.lower()
+        # A ValidationError raised here keeps the session and its chunks.
+        response = _store_upload(request, staged_file, policy) if matches else None
+    discard_session(session)
+    if not matches:
+        raise ValidationError("Checksum of the uploaded file doesn't match.")
+    return response
 
 
 class UserViewSet(generics.ListAPIView):